@@ -0,0 +1,2 @@
+from . import cases
+from .runner import BENCHMARKS, REDIS_FAKE, REDIS_SPAWN, REDIS_URL, benchmark, benchmark_redis, run_benchmarks
@@ -0,0 +1,94 @@
+import datetime
+import time
+
+from hueyx.consumer import HueyxScheduler
+from hueyx.periodic import every
+from hueyx.signals import SignalPublisher
+from .runner import BenchmarkContext, benchmark, measure, timings
+
+
+def noop(*args):
+    pass
+
+
+def heartbeat_noop(heartbeat):
+    heartbeat()
+
+
+@benchmark('enqueue')
+def enqueue(context: BenchmarkContext):
+    """ Single enqueues, one round trip each. """
+    task = context.huey().task()(noop)
+    return measure(lambda i: task(i), context.iterations)
+
+
+@benchmark('enqueue_many')
+def enqueue_many(context: BenchmarkContext):
+    """ Bulk enqueue with pipelined chunks. """
+    task = context.huey().task()(noop)
+    start = time.perf_counter()
+    task.map(range(context.iterations))
+    return timings(time.perf_counter() - start, context.iterations)
+
+
+def _execute(context: BenchmarkContext, task):
+    """ Dequeue-to-execute latency of enqueued tasks. """
+    huey = task.huey
+    huey.enqueue_many(task.s() for _ in range(context.iterations))
+    return measure(lambda i: huey.execute(huey.dequeue()), context.iterations)
+
+
+@benchmark('execute_db_task')
+def execute_db_task(context: BenchmarkContext):
+    return _execute(context, context.huey().db_task()(noop))
+
+
+@benchmark('execute_heartbeat_task')
+def execute_heartbeat_task(context: BenchmarkContext):
+    return _execute(context, context.huey().db_task(heartbeat_timeout=120)(heartbeat_noop))
+
+
+@benchmark('get_dead_tasks')
+def get_dead_tasks(context: BenchmarkContext):
+    """ Dead task detection with result_entries results and iterations observed tasks, a tenth of them dead. """
+    huey = context.huey()
+    conn = huey.storage.conn
+    now = int(time.time())
+    for start in range(0, context.result_entries, 1000):
+        conn.hset(huey.storage.result_key, mapping={f'result-{i}': b'x' * 100
+                                                    for i in range(start, min(start + 1000, context.result_entries))})
+    pipe = conn.pipeline()
+    for i in range(context.iterations):
+        deadline = now - 10 if i % 10 == 0 else now + 3600
+        pipe.hset(huey.heartbeat_observations_key, f'task-{i}', huey.serializer.serialize(('noop', {}, 120)))
+        pipe.zadd(huey.heartbeat_index_key, {f'task-{i}': deadline})
+    pipe.execute()
+    return measure(lambda i: huey.get_dead_tasks(), max(context.iterations // 100, 10))
+
+
+@benchmark('signal_publish')
+def signal_publish(context: BenchmarkContext):
+    """ Buffering signals and sending them to redis in batches. """
+    publisher = SignalPublisher(context.redis, f'{context.prefix}.signals')
+    data = {'environment': 'bench', 'queue': context.prefix, 'pid': 1, 'signal': 'complete', 'task': 'noop'}
+    start = time.perf_counter()
+    for _ in range(context.iterations):
+        publisher.publish(data)
+    publisher.flush()
+    result = timings(time.perf_counter() - start, context.iterations)
+    result['dropped'] = publisher.dropped
+    return result
+
+
+@benchmark('scheduler_tick')
+def scheduler_tick(context: BenchmarkContext):
+    """ Scheduler ticks which claim and enqueue periodic_tasks tasks due every second. """
+    huey = context.huey()
+    for i in range(context.periodic_tasks):
+        huey.periodic_task(every(seconds=1), name=f'periodic_{i}')(noop)
+    scheduler = HueyxScheduler(huey, 1, True, multiple_scheduler_locking=True)
+    now = datetime.datetime.now().replace(microsecond=0)
+    ticks = max(context.iterations // 100, 10)
+    result = measure(lambda i: scheduler.enqueue_periodic_tasks(now + datetime.timedelta(seconds=i)), ticks)
+    result['enqueued'] = huey.pending_count()
+    return result
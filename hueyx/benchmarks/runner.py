@@ -0,0 +1,160 @@
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import huey
+from redis import ConnectionPool, Redis, ResponseError
+
+from hueyx.redis_huey import RedisHuey
+
+REDIS_SPAWN = 'spawn'
+REDIS_FAKE = 'fake'
+REDIS_URL = 'url'
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str):
+    """ Registers a benchmark. It gets a BenchmarkContext and returns a dict of measurements. """
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return decorator
+
+
+class BenchmarkContext:
+    """ Creates huey instances with unique names on the benchmark redis and deletes their keys afterwards. """
+
+    def __init__(self, connection_pool: ConnectionPool, iterations=1000, periodic_tasks=100, result_entries=10000):
+        self.connection_pool = connection_pool
+        self.redis = Redis(connection_pool=connection_pool)
+        self.iterations = iterations
+        self.periodic_tasks = periodic_tasks
+        self.result_entries = result_entries
+        self.prefix = f'hueyx_bench_{uuid.uuid4().hex[:8]}'
+        self._count = 0
+
+    def huey(self, huey_class=RedisHuey, **kwargs):
+        self._count += 1
+        return huey_class(f'{self.prefix}_{self._count}', connection_pool=self.connection_pool, **kwargs)
+
+    def cleanup(self):
+        keys = list(self.redis.scan_iter(match=f'*{self.prefix}*'))
+        for i in range(0, len(keys), 1000):
+            self.redis.delete(*keys[i:i + 1000])
+
+
+def measure(fn: Callable, iterations: int) -> Dict:
+    """ Calls fn(i) iterations times and returns throughput and latency percentiles in milliseconds. """
+    durations = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        fn(i)
+        durations.append(time.perf_counter() - call_start)
+    return timings(time.perf_counter() - start, iterations, durations)
+
+
+def timings(total: float, operations: int, durations: List[float] = ()) -> Dict:
+    result = {
+        'operations': operations,
+        'total_seconds': round(total, 6),
+        'ops_per_second': round(operations / total, 1) if total else None,
+    }
+    if durations:
+        durations = sorted(durations)
+        result.update({
+            'mean_ms': round(statistics.mean(durations) * 1000, 4),
+            'p50_ms': round(_percentile(durations, 50) * 1000, 4),
+            'p99_ms': round(_percentile(durations, 99) * 1000, 4),
+            'max_ms': round(durations[-1] * 1000, 4),
+        })
+    return result
+
+
+def _percentile(sorted_values: List[float], percent: int) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def run_benchmarks(connection_pool: ConnectionPool, names: List[str] = None, **options) -> Dict:
+    """
+    Runs the selected benchmarks (all by default) and returns their measurements together with the environment,
+    ready to be dumped as JSON.
+    """
+    unknown = set(names or ()) - set(BENCHMARKS)
+    assert not unknown, f'Unknown benchmarks: {", ".join(sorted(unknown))}'
+    context = BenchmarkContext(connection_pool, **options)
+    results = {}
+    try:
+        for name in names or BENCHMARKS:
+            results[name] = BENCHMARKS[name](context)
+            context.cleanup()
+    finally:
+        context.cleanup()
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'huey': huey.__version__,
+            'redis_server': _server_version(context.redis),
+            'iterations': context.iterations,
+            'periodic_tasks': context.periodic_tasks,
+            'result_entries': context.result_entries,
+        },
+        'benchmarks': results,
+    }
+
+
+def _server_version(redis: Redis):
+    try:
+        return redis.info('server').get('redis_version')
+    except ResponseError:    # fakeredis
+        return None
+
+
+@contextmanager
+def benchmark_redis(source: str = None, url: str = None):
+    """
+    Connection pool to the benchmark redis: a redis-server spawned on a free port (default if redis-server is
+    installed), an in-process fakeredis or the redis of the given url.
+    """
+    if source is None:
+        source = REDIS_URL if url else REDIS_SPAWN if shutil.which('redis-server') else REDIS_FAKE
+    if source == REDIS_URL:
+        yield ConnectionPool.from_url(url)
+    elif source == REDIS_FAKE:
+        import fakeredis
+        yield fakeredis.FakeRedis(server=fakeredis.FakeServer()).connection_pool
+    else:
+        assert source == REDIS_SPAWN, f'Unknown redis source: {source}'
+        with _spawn_redis() as port:
+            yield ConnectionPool(host='127.0.0.1', port=port)
+
+
+@contextmanager
+def _spawn_redis():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(['redis-server', '--port', str(port), '--bind', '127.0.0.1', '--save', '',
+                                '--appendonly', 'no'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        redis = Redis(port=port)
+        for _ in range(100):
+            try:
+                redis.ping()
+                break
+            except Exception:
+                time.sleep(0.05)
+        else:
+            raise RuntimeError(f'redis-server did not start on port {port}.')
+        yield port
+    finally:
+        process.terminate()
+        process.wait()
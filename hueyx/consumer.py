@@ -1,101 +1,473 @@
+import asyncio
 import datetime
+import logging
+import os
+import signal
+import socket
+import sys
+from typing import List, Tuple
 
 import redis
-import redis_lock
-from huey.consumer import Consumer, Scheduler
+from huey.api import Task
+from huey.constants import WORKER_PROCESS, WORKER_THREAD
+from huey.consumer import Consumer, ConsumerStopped, Scheduler, Worker
+from huey.utils import time_clock
 
+from .periodic import PeriodicSchedule, CATCH_UP_SKIP, CATCH_UP_ONCE, CATCH_UP_ALL
+from .profiling import ExecutionProfiler
 
-class HueyxScheduler(Scheduler):
-    def __init__(self, *args, **kwargs):
-        self.multiple_scheduler_locking = kwargs.pop('multiple_scheduler_locking', False)
-        super().__init__(*args, **kwargs)
 
+# Claims the periodic tasks of their fire times. KEYS: one claim key per task and fire time, ARGV: [1] owner, [2] expiry
+# in seconds. Returns the 1-based indexes of the claimed keys.
+CLAIM_PERIODIC_TASKS_LUA = """
+local claimed = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('SET', key, ARGV[1], 'NX', 'EX', ARGV[2]) then
+        table.insert(claimed, i)
+    end
+end
+return claimed
+"""
+
+# Acquires or renews the scheduler leader lease. KEYS: [1] lease, ARGV: [1] owner, [2] lease timeout in milliseconds.
+LEADER_LEASE_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Releases the lease if it is still held by the owner. KEYS: [1] lease, ARGV: [1] owner.
+RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+SCHEDULER_MODE_ALL = 'all'
+SCHEDULER_MODE_LEADER = 'leader'
+
+WORKER_ASYNCIO = 'asyncio'
+
+
+class HueyxScheduler(Scheduler):
     """
     Extend the usual Scheduler with the ability to prevent multiple periodic task execution due to multiple
     huey worker and finally multiple running Schedulers.
-    This is done by locking the specific execution time pattern on redis.
+    This is done by claiming the fire time of every due periodic task on redis in one atomic call.
+
+    The next fire times of the periodic tasks are kept in a PeriodicSchedule, which is checked on every loop.
+    This supports schedules with second resolution (hueyx.periodic.every) and catching up with missed fire times.
+
+    In the leader scheduler_mode only the scheduler holding a renewable lease on redis enqueues periodic tasks.
+    Another scheduler takes over when the lease of the leader expires.
     """
+    claim_expire = 120
+    # The heap is checked on every loop, its resolution is the scheduler interval.
+    periodic_task_seconds = 1
+
+    def __init__(self, *args, **kwargs):
+        self.multiple_scheduler_locking = kwargs.pop('multiple_scheduler_locking', False)
+        self.catch_up = kwargs.pop('catch_up', CATCH_UP_SKIP)
+        self.catch_up_grace = kwargs.pop('catch_up_grace', 60)
+        self.scheduler_mode = kwargs.pop('scheduler_mode', SCHEDULER_MODE_ALL)
+        self.lease_timeout = kwargs.pop('lease_timeout', 30)
+        super().__init__(*args, **kwargs)
+        self._claim_script = None
+        self.periodic_schedule = None
+        self._lease_script = None
+        self._release_script = None
+        self._lease_owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._leader_until = 0
+        self._next_lease_renewal = time_clock()
+
+    @property
+    def lease_key(self):
+        return f"huey.{self.huey.name}.scheduler_leader"
+
+    @property
+    def is_leader(self):
+        return self._leader_until > time_clock()
+
+    def loop(self, now=None):
+        if self.scheduler_mode == SCHEDULER_MODE_LEADER and self._next_lease_renewal <= time_clock():
+            self._next_lease_renewal = time_clock() + self.lease_timeout / 3
+            self.renew_lease()
+        super().loop(now)
+
+    def shutdown(self):
+        if self.scheduler_mode == SCHEDULER_MODE_LEADER and self.is_leader:
+            try:
+                self.release_lease()
+            except Exception:
+                self._logger.exception('Error releasing the scheduler lease.')
+        super().shutdown()
+
+    def renew_lease(self):
+        """ Acquires the leader lease or renews it if this scheduler is the leader. """
+        if self._lease_script is None:
+            self._lease_script = self.huey.storage.conn.register_script(LEADER_LEASE_LUA)
+        was_leader = self.is_leader
+        renewed_at = time_clock()
+        try:
+            leader = self._lease_script(keys=[self.lease_key], args=[self._lease_owner, int(self.lease_timeout * 1000)])
+        except Exception:
+            self._logger.exception('Error renewing the scheduler lease.')
+            return
+        self._leader_until = renewed_at + self.lease_timeout if leader else 0
+        if self.is_leader != was_leader:
+            self._logger.info(f'{self.lease_key}: ' + ('Became the leader.' if leader else 'Lost the leadership.'))
+
+    def release_lease(self):
+        if self._release_script is None:
+            self._release_script = self.huey.storage.conn.register_script(RELEASE_LEASE_LUA)
+        self._leader_until = 0
+        self._release_script(keys=[self.lease_key], args=[self._lease_owner])
 
     def enqueue_periodic_tasks(self, now):
-        self._logger.debug('Checking periodic tasks')
         if now is None:
             now = datetime.datetime.now()
-        for task in self.huey.read_periodic(now):
-            if self.check_and_set_for_multiple_execution(task, now):
-                self.enqueue_periodic_task(task)
+        if self.periodic_schedule is None:
+            self.periodic_schedule = PeriodicSchedule(
+                [type(task) for task in self.huey._registry.periodic_tasks], now,
+                catch_up=self.catch_up, grace=self.catch_up_grace)
+        if self.scheduler_mode == SCHEDULER_MODE_LEADER and not self.is_leader:
+            # The fire times stay in the schedule, a follower which becomes the leader catches up with them.
+            self._logger.debug('Not the leader, skip periodic tasks')
+            return True
+        due = self.periodic_schedule.pop_due(now)
+        self._logger.debug('Checking periodic tasks')
+        for task, _ in self.claim_periodic_tasks([(task_class(), fire_time) for task_class, fire_time in due], now):
+            self.enqueue_periodic_task(task)
         return True
 
-    def check_and_set_for_multiple_execution(self, task, now):
+    def claim_periodic_tasks(self, tasks: List[Tuple[Task, datetime.datetime]], now: datetime.datetime) -> List:
         """
-        Checks if the task already has been scheduled from another huey worker and if not, marks the task as scheduled.
-        :param task:
-        :param now:
-        :return: Bool if task can be scheduled.
+        Claims the tasks for their fire times, so that no other huey worker schedules them again.
+        :param tasks: Tasks and their fire times.
+        :return: The tasks and fire times which have not been scheduled yet by another worker.
         """
+        if not self.multiple_scheduler_locking or not tasks:
+            return tasks
 
-        if not self.multiple_scheduler_locking:
-            return True
+        if self._claim_script is None:
+            self._claim_script = self.huey.storage.conn.register_script(CLAIM_PERIODIC_TASKS_LUA)
+        keys = [self._claim_key(task, fire_time) for task, fire_time in tasks]
+        # Missed fire times are claimed for longer, another scheduler might catch up with them later.
+        expire = self.claim_expire + int((now - min(fire_time for _, fire_time in tasks)).total_seconds())
+        claimed = set(self._claim_script(keys=keys, args=[os.getpid(), expire]))
 
-        conn: redis.ConnectionPool = self.huey.storage.conn
-        full_name = f"huey.{self.huey.name}.{task.name}"
-        lock_name = full_name + ".periodic_lock"
-        pattern_name = full_name + '.time_pattern'
-        with redis_lock.Lock(conn, lock_name, expire=60):
-            if not self._can_execute(pattern_name, now):
-                self._logger.info(
-                    f'{full_name}: Do not schedule periodic task because this time pattern has already been scheduled.'
-                )
-                return False
+        claimed_tasks = []
+        for i, task in enumerate(tasks, start=1):
+            if i in claimed:
+                claimed_tasks.append(task)
             else:
-                self._set_execution_time_pattern(pattern_name, now)
                 self._logger.info(
-                    f'{full_name}: Set time pattern for periodic task execution.'
+                    f'{keys[i - 1]}: Do not schedule periodic task because this fire time has already been scheduled.'
                 )
-                return True
+        return claimed_tasks
 
     def enqueue_periodic_task(self, task):
         self._logger.info('Scheduling periodic task %s.', task)
         self.huey.enqueue(task)
 
-    def _create_time_pattern(self, now: datetime.datetime):
-        """Standardized time pattern which the task is executed."""
-        _, month, day, hour, minute, _, week_day, _, _ = now.timetuple()
-        current_time_pattern = f"month{month}.day{day}.week_day{week_day}.hour{hour}.minute{minute}"
-        return current_time_pattern
+    def _claim_key(self, task, fire_time: datetime.datetime):
+        return f"huey.{self.huey.name}.{task.name}.periodic_claim.{fire_time:%Y-%m-%dT%H:%M:%S}"
 
-    def _can_execute(self, full_name: str, now: datetime.datetime):
-        """Check if the current time pattern already has been executed."""
-        current_time_pattern = self._create_time_pattern(now)
 
-        last_time_pattern = self._get_last_execution_time_pattern(full_name)
-        return last_time_pattern != current_time_pattern
+class HueyxAsyncWorker(Worker):
+    """
+    Worker with an event loop. Tasks of async functions run concurrently on the loop, at most concurrency at once.
+    Dequeuing, sync tasks and the bookkeeping of huey on redis run in the executor of the loop.
+    """
+    process_name = 'AsyncWorker'
 
-    def _get_last_execution_time_pattern(self, full_name: str):
-        conn = self.huey.storage.conn
-        current_val = conn.get(full_name)
-        if current_val is not None:
-            current_val = current_val.decode("utf-8")
-        return current_val
+    def __init__(self, huey, default_delay, max_delay, backoff, concurrency=100):
+        super().__init__(huey, default_delay, max_delay, backoff)
+        self.concurrency = concurrency
+        self._event_loop = None
+        self._in_flight = set()
 
-    def _set_execution_time_pattern(self, full_name: str, now):
-        current_time_pattern = self._create_time_pattern(now)
-        conn: redis.Redis = self.huey.storage.conn
-        conn.set(full_name, current_time_pattern)
+    def initialize(self):
+        super().initialize()
+        self._event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._event_loop)
+
+    def shutdown(self):
+        if self._in_flight:
+            self._logger.info(f'Waiting for {len(self._in_flight)} tasks.')
+            self._event_loop.run_until_complete(asyncio.wait(self._in_flight))
+        self._event_loop.run_until_complete(self._event_loop.shutdown_asyncgens())
+        self._event_loop.close()
+        super().shutdown()
+
+    def loop(self, now=None):
+        self._event_loop.run_until_complete(self._loop(now))
+
+    async def _loop(self, now=None):
+        if len(self._in_flight) >= self.concurrency:
+            await asyncio.wait(self._in_flight, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+            return
+        try:
+            task = await self._event_loop.run_in_executor(None, self.huey.dequeue)
+        except Exception:
+            self._logger.exception('Error reading from queue')
+            await self._sleep()
+        else:
+            if task is not None:
+                self.delay = self.default_delay
+                execution = self._event_loop.create_task(self._execute(task, now))
+                self._in_flight.add(execution)
+                execution.add_done_callback(self._in_flight.discard)
+            elif not self.huey.storage.blocking:
+                await self._sleep()
+
+    async def _execute(self, task, now=None):
+        try:
+            if getattr(task, 'is_async', False):
+                await self.huey.aexecute(task, now)
+            else:
+                await self._event_loop.run_in_executor(None, self.huey.execute, task, now)
+        except Exception:
+            self._logger.exception('Unhandled error during execution of task %s.', task.id)
+
+    async def _sleep(self):
+        self.delay = min(self.delay, self.max_delay)
+        await asyncio.sleep(self.delay)
+        self.delay *= self.backoff
 
 
 class HueyxConsumer(Consumer):
+    # Consumer settings of hueyx which are not supported by huey's ConsumerConfig.
+    hueyx_options = ('multiple_scheduler_locking', 'scheduler_mode', 'scheduler_lease_timeout',
+                     'periodic_catch_up', 'periodic_catch_up_grace', 'dead_task_check_interval', 'min_workers',
+                     'max_workers', 'autoscale_interval', 'async_concurrency', 'profiling')
+
+    # Autoscaling hysteresis: consecutive samples required to add or retire a worker.
+    scale_up_samples = 2
+    scale_down_samples = 6
+
     def __init__(self, *args, **kwargs):
         self.multiple_scheduler_locking = kwargs.pop('multiple_scheduler_locking', False)
+        self.scheduler_mode = kwargs.pop('scheduler_mode', SCHEDULER_MODE_ALL)
+        assert self.scheduler_mode in (SCHEDULER_MODE_ALL, SCHEDULER_MODE_LEADER), \
+            f'Unknown scheduler_mode: {self.scheduler_mode}'
+        self.scheduler_lease_timeout = kwargs.pop('scheduler_lease_timeout', 30)
+        # The lease is renewed from the scheduler loop, which runs every scheduler_interval.
+        assert self.scheduler_mode != SCHEDULER_MODE_LEADER or \
+            self.scheduler_lease_timeout > kwargs.get('scheduler_interval', 1), \
+            'scheduler_lease_timeout needs to be greater than scheduler_interval.'
+        self.periodic_catch_up = kwargs.pop('periodic_catch_up', CATCH_UP_SKIP)
+        assert self.periodic_catch_up in (CATCH_UP_SKIP, CATCH_UP_ONCE, CATCH_UP_ALL), \
+            f'Unknown periodic_catch_up: {self.periodic_catch_up}'
+        self.periodic_catch_up_grace = kwargs.pop('periodic_catch_up_grace', 60)
+        self.dead_task_check_interval = kwargs.pop('dead_task_check_interval', 60)
+        workers = kwargs.get('workers', 1)
+        min_workers = kwargs.pop('min_workers', None)
+        self.max_workers = kwargs.pop('max_workers', None) or max(workers, min_workers or 1)
+        self.min_workers = min_workers or min(workers, self.max_workers)
+        assert 1 <= self.min_workers <= self.max_workers, 'Workers need to fulfill 1 <= min_workers <= max_workers.'
+        kwargs['workers'] = min(max(workers, self.min_workers), self.max_workers)
+        self.autoscale_interval = kwargs.pop('autoscale_interval', 10)
+        self.async_concurrency = kwargs.pop('async_concurrency', 100)
+        profiling = kwargs.pop('profiling', False)
+        # The asyncio workers are threads which run an event loop.
+        self.is_asyncio = kwargs.get('worker_type') == WORKER_ASYNCIO
+        if self.is_asyncio:
+            kwargs['worker_type'] = WORKER_THREAD
         super().__init__(*args, **kwargs)
+        if profiling:
+            options = profiling if isinstance(profiling, dict) else {}
+            self.huey.profiler = ExecutionProfiler(self.huey.storage.conn, self.huey.profile_key, **options)
+        self._next_dead_task_check = time_clock() + self.dead_task_check_interval
+
+        self._next_autoscale = time_clock() + self.autoscale_interval
+        self._scale_up_streak = 0
+        self._scale_down_streak = 0
+        self._retired_workers = []
+
+    @property
+    def is_autoscaling(self):
+        return self.min_workers < self.max_workers
 
     def _create_scheduler(self):
         self._logger.info('multiple_scheduler_locking: ' + str(self.multiple_scheduler_locking))
+        self._logger.info('scheduler_mode: ' + self.scheduler_mode)
         return HueyxScheduler(
             huey=self.huey,
             interval=self.scheduler_interval,
             periodic=self.periodic,
-            multiple_scheduler_locking=self.multiple_scheduler_locking)
+            multiple_scheduler_locking=self.multiple_scheduler_locking,
+            scheduler_mode=self.scheduler_mode,
+            lease_timeout=self.scheduler_lease_timeout,
+            catch_up=self.periodic_catch_up,
+            catch_up_grace=self.periodic_catch_up_grace)
+
+    def _create_worker(self):
+        if self.is_asyncio:
+            worker = HueyxAsyncWorker(huey=self.huey, default_delay=self.default_delay, max_delay=self.max_delay,
+                                      backoff=self.backoff, concurrency=self.async_concurrency)
+        else:
+            worker = super()._create_worker()
+        worker.retire_flag = self.environment.get_stop_flag()
+        return worker
+
+    def _create_process(self, process, name):
+        """ Same as Consumer._create_process, but a worker can also be stopped on its own by its retire_flag. """
+        retire_flag = getattr(process, 'retire_flag', None)
+
+        def _run():
+            if self.worker_type == WORKER_PROCESS:
+                self._set_child_signal_handlers()
+
+            process.initialize()
+            try:
+                while not self.stop_flag.is_set() and not (retire_flag and retire_flag.is_set()):
+                    process.loop()
+            except KeyboardInterrupt:
+                pass
+            except:
+                self._logger.exception('Process %s died!', name)
+            finally:
+                process.shutdown()
+        return self.environment.create_process(_run, name)
 
     def run(self):
-        self.huey.restart_dead_tasks()
+        self.restart_dead_tasks()
         super().run()
+
+    def stop(self, graceful=False):
+        super().stop(graceful)
+        if graceful:
+            for worker_process in self._retired_workers:
+                worker_process.join()
+
+    def loop(self, health_check_ts=None):
+        health_check_ts = super().loop(health_check_ts)
+        if self.dead_task_check_interval and self._next_dead_task_check <= time_clock():
+            self._next_dead_task_check = time_clock() + self.dead_task_check_interval
+            try:
+                self.restart_dead_tasks()
+            except Exception:
+                self._logger.exception('Error restarting dead tasks.')
+        if self.is_autoscaling and self._next_autoscale <= time_clock():
+            self._next_autoscale = time_clock() + self.autoscale_interval
+            try:
+                self.autoscale()
+            except Exception:
+                self._logger.exception('Error autoscaling workers.')
+        return health_check_ts
+
+    def autoscale(self):
+        """
+        Samples the queue length. A worker is added if more tasks are waiting than workers are running,
+        and retired if the queue has been empty. Both need several consecutive samples to avoid flapping.
+        """
+        pending = self.huey.pending_count()
+        workers = len(self.worker_threads)
+        self._scale_up_streak = self._scale_up_streak + 1 if pending > workers else 0
+        self._scale_down_streak = self._scale_down_streak + 1 if pending == 0 else 0
+
+        if self._scale_up_streak >= self.scale_up_samples and workers < self.max_workers:
+            self._scale_up_streak = 0
+            self._add_worker()
+            self._logger.info(f'{pending} pending tasks: scaled up to {len(self.worker_threads)} workers.')
+        elif self._scale_down_streak >= self.scale_down_samples and workers > self.min_workers:
+            self._scale_down_streak = 0
+            self._retire_worker()
+            self._logger.info(f'No pending tasks: scaled down to {len(self.worker_threads)} workers.')
+
+    def _add_worker(self):
+        worker = self._create_worker()
+        worker_process = self._create_process(worker, 'Worker-%d' % (len(self.worker_threads) + 1))
+        worker_process.start()
+        self.worker_threads.append((worker, worker_process))
+        self.workers = len(self.worker_threads)
+
+    def _retire_worker(self):
+        """ The worker finishes its current task and stops. """
+        worker, worker_process = self.worker_threads.pop()
+        worker.retire_flag.set()
+        self._retired_workers = [p for p in self._retired_workers if self.environment.is_alive(p)]
+        self._retired_workers.append(worker_process)
+        self.workers = len(self.worker_threads)
+
+    def restart_dead_tasks(self):
+        """
+        Restarts the dead tasks if no other consumer of this queue did so within the dead_task_check_interval.
+        The consumers coordinate with a lease on redis which expires after the interval.
+        """
+        if not self._acquire_dead_task_lease():
+            self._logger.debug('Dead tasks have been checked by another consumer.')
+            return
+        restarted = self.huey.restart_dead_tasks()
+        if restarted:
+            self._logger.warning(f'Restarted {restarted} dead tasks.')
+
+    def _acquire_dead_task_lease(self):
+        if not self.dead_task_check_interval:
+            return True
+        conn: redis.Redis = self.huey.storage.conn
+        lease_name = f"huey.{self.huey.name}.dead_task_lease"
+        return bool(conn.set(lease_name, os.getpid(), nx=True, px=int(self.dead_task_check_interval * 1000)))
+
+
+class HueyxMultiConsumer:
+    """
+    Runs the consumers of several queues within one process.
+    Every consumer has its own workers and scheduler. The main loop and the signal handling are shared.
+    """
+
+    def __init__(self, consumers: List[HueyxConsumer]):
+        self.consumers = consumers
+        self._logger = logging.getLogger('huey.consumer')
+        for consumer in self.consumers:
+            consumer._stop_flag_timeout = consumer._stop_flag_timeout / len(self.consumers)
+
+    def start(self):
+        # Fork the worker processes before any worker thread of another queue is running.
+        for consumer in sorted(self.consumers, key=lambda c: c.worker_type != WORKER_PROCESS):
+            consumer.restart_dead_tasks()
+            consumer.start()
+        self._set_signal_handlers()
+
+    def run(self):
+        self.start()
+        health_check_ts = {consumer: time_clock() for consumer in self.consumers}
+        running = list(self.consumers)
+        while running:
+            for consumer in list(running):
+                try:
+                    health_check_ts[consumer] = consumer.loop(health_check_ts[consumer])
+                except ConsumerStopped:
+                    running.remove(consumer)
+
+        for consumer in self.consumers:
+            consumer.huey.notify_interrupted_tasks()
+
+        if any(consumer._restart for consumer in self.consumers):
+            self._logger.info('Consumer will restart.')
+            python = sys.executable
+            os.execl(python, python, *sys.argv)
+        else:
+            self._logger.info('Consumer exiting.')
+
+    def _set_signal_handlers(self):
+        """ Every consumer registered its own handlers on start -> replace them with handlers for all consumers. """
+        signal.signal(signal.SIGTERM, self._forward_signal('_handle_stop_signal'))
+        signal.signal(signal.SIGINT, self._forward_signal('_handle_interrupt_signal_gevent'))
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._forward_signal('_handle_restart_signal'))
+
+    def _forward_signal(self, handler_name: str):
+        def handler(sig_num, frame):
+            for consumer in self.consumers:
+                getattr(consumer, handler_name)(sig_num, frame)
+        return handler
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+from django.db import connections
+
+DB_CONNECTION_CLOSE = 'close'
+DB_CONNECTION_PERSISTENT = 'persistent'
+
+
+class DbConnectionLifecycle:
+    """
+    Keeps the django connections of a worker open between db tasks instead of calling close_old_connections
+    after every task. Before a task the connections are validated: connections older than max_age or with a changed
+    autocommit are closed, connections with errors or idle for idle_check seconds are pinged.
+    The connections are closed after a task which raised an exception.
+    """
+
+    def __init__(self, max_age=300, idle_check=30):
+        self.max_age = max_age
+        self.idle_check = idle_check
+        self._local = threading.local()
+        self._stats: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def before_task(self):
+        now = time.monotonic()
+        stats = self._worker_stats()
+        for conn in connections.all():
+            if conn.connection is None:
+                stats['connected'] += 1
+                continue
+            opened_at, last_used = self._state().get(conn.alias, (now, now))
+            if now - opened_at >= self.max_age:
+                conn.close()
+                stats['closed_max_age'] += 1
+            elif conn.get_autocommit() != conn.settings_dict['AUTOCOMMIT']:
+                conn.close()
+                stats['closed_unusable'] += 1
+            elif (conn.errors_occurred or now - last_used >= self.idle_check) and not conn.is_usable():
+                conn.close()
+                stats['closed_unusable'] += 1
+            else:
+                conn.errors_occurred = False
+                stats['reused'] += 1
+
+    def after_task(self, error=False):
+        now = time.monotonic()
+        state = self._state()
+        for conn in connections.all():
+            if conn.connection is None:
+                state.pop(conn.alias, None)
+            elif error:
+                conn.close()
+                state.pop(conn.alias, None)
+                self._worker_stats()['closed_on_error'] += 1
+            else:
+                opened_at, _ = state.get(conn.alias, (now, now))
+                state[conn.alias] = (opened_at, now)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """ Connection statistics per worker (pid and thread) of this process. """
+        with self._lock:
+            return {worker: dict(stats) for worker, stats in self._stats.items()}
+
+    def _state(self) -> Dict[str, tuple]:
+        """ Opening and last use time of the connections of this thread by alias. """
+        if not hasattr(self._local, 'state'):
+            self._local.state = {}
+        return self._local.state
+
+    def _worker_stats(self) -> Counter:
+        if not hasattr(self._local, 'stats'):
+            self._local.stats = Counter()
+            with self._lock:
+                self._stats[f'{os.getpid()}:{threading.current_thread().name}'] = self._local.stats
+        return self._local.stats
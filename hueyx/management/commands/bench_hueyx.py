@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hueyx.benchmarks import BENCHMARKS, REDIS_FAKE, REDIS_SPAWN, benchmark_redis, run_benchmarks
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the hot paths of hueyx and prints the results as JSON. Example usage::
+    django-admin.py bench_hueyx
+    django-admin.py bench_hueyx enqueue scheduler_tick --redis-url redis://localhost:6379/15 --output bench.json
+    """
+    help = "Benchmark hueyx against a spawned redis-server, fakeredis or a redis url"
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*', type=str,
+                            help=f'Select the benchmarks to run: {", ".join(BENCHMARKS)}. All by default.')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--spawn', action='store_const', const=REDIS_SPAWN, dest='source',
+                           help='Spawn a redis-server on a free port (default if redis-server is installed).')
+        group.add_argument('--fake', action='store_const', const=REDIS_FAKE, dest='source',
+                           help='Use an in-process fakeredis.')
+        group.add_argument('--redis-url', type=str, help='Use this redis. Only keys of the benchmark are deleted.')
+        parser.add_argument('--iterations', type=int, default=1000)
+        parser.add_argument('--periodic-tasks', type=int, default=100)
+        parser.add_argument('--result-entries', type=int, default=10000)
+        parser.add_argument('--output', type=str, help='Write the JSON to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        unknown = [name for name in options['benchmarks'] if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(unknown)}')
+
+        with benchmark_redis(options['source'], options['redis_url']) as connection_pool:
+            results = run_benchmarks(connection_pool, options['benchmarks'], iterations=options['iterations'],
+                                     periodic_tasks=options['periodic_tasks'],
+                                     result_entries=options['result_entries'])
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
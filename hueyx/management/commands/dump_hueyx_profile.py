@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from hueyx.profiling import read_profiles
+from hueyx.queues import settings_reader
+
+
+class Command(BaseCommand):
+    """
+    Prints the profiling snapshots of the running consumers as JSON. Requires the consumer setting profiling.
+    Example usage::
+    django-admin.py dump_hueyx_profile queue_name1 queue_name2
+    """
+    help = "Dump the execution profiles of the running consumers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('queue_names', nargs='*', type=str,
+                            help='Select the queues to dump. All queues are dumped by default.')
+        parser.add_argument('--no-traces', action='store_true', help='Omit the cProfile traces of the slowest tasks.')
+
+    def handle(self, *args, **options):
+        queue_names = options['queue_names'] or list(settings_reader.configurations)
+
+        profiles = {}
+        for queue_name in queue_names:
+            huey = settings_reader.configurations[queue_name].huey_instance
+            profiles[queue_name] = read_profiles(huey.storage.conn, huey.profile_key)
+            if options['no_traces']:
+                for snapshot in profiles[queue_name].values():
+                    for slow in snapshot['slowest']:
+                        slow.pop('profile')
+        self.stdout.write(json.dumps(profiles, indent=2))
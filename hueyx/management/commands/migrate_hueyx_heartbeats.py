@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from hueyx.queues import settings_reader
+
+
+class Command(BaseCommand):
+    """
+    Moves heartbeat observations of hueyx <= 1.0.3 into the heartbeat index. Example usage::
+    django-admin.py migrate_hueyx_heartbeats queue_name1 queue_name2
+    """
+    help = "Migrate heartbeat observations from the result store into the heartbeat index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('queue_names', nargs='*', type=str,
+                            help='Select the queues to migrate. All queues are migrated by default.')
+
+    def handle(self, *args, **options):
+        queue_names = options['queue_names'] or list(settings_reader.configurations)
+
+        for queue_name in queue_names:
+            huey = settings_reader.configurations[queue_name].huey_instance
+            migrated = huey.migrate_heartbeat_observations()
+            self.stdout.write(f'{queue_name}: migrated {migrated} heartbeat observations.')
@@ -1,11 +1,11 @@
 import logging
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils.module_loading import autodiscover_modules
 from huey.consumer_options import ConsumerConfig
 
-from hueyx.consumer import HueyxConsumer
-from hueyx.queues import settings_reader
+from hueyx.consumer import HueyxConsumer, HueyxMultiConsumer
+from hueyx.queues import settings_reader, warmup
 
 logger = logging.getLogger('huey.consumer')
 
@@ -14,30 +14,44 @@ class Command(BaseCommand):
     """
     Queue consumer. Example usage::
     To start the consumer (note you must export the settings module):
-    django-admin.py run_hueyx
+    django-admin.py run_hueyx queue_name
+    To run the consumers of several queues in one process:
+    django-admin.py run_hueyx queue_name1 queue_name2
+    django-admin.py run_hueyx --all
     """
-    help = "Run a huey consumer on a specific pool"
-    consumer_options = None
+    help = "Run a huey consumer on one or several specific pools"
 
     def add_arguments(self, parser):
-        parser.add_argument('queue_name', nargs=1, type=str, help='Select the queue to listen on.')
+        parser.add_argument('queue_names', nargs='*', type=str, help='Select the queues to listen on.')
+        parser.add_argument('--all', action='store_true', help='Listen on all configured queues.')
 
-    def run_consumer(self, queue_name):
-        multiple_scheduler_locking = self.consumer_options.pop('multiple_scheduler_locking', False)
+    def create_consumer(self, queue_name, setup_logger=True):
+        consumer_options = settings_reader.configurations[queue_name].consumer_options
+        hueyx_options = {name: consumer_options.pop(name) for name in HueyxConsumer.hueyx_options
+                         if name in consumer_options}
 
         HUEY = settings_reader.configurations[queue_name].huey_instance
 
-        config = ConsumerConfig(**self.consumer_options)
+        config = ConsumerConfig(**consumer_options)
         config.validate()
-        config.setup_logger()
+        if setup_logger:
+            config.setup_logger()
 
         logger.info(f'Run huey on {queue_name}')
-        consumer = HueyxConsumer(HUEY, multiple_scheduler_locking=multiple_scheduler_locking, **config.values)
-        consumer.run()
+        return HueyxConsumer(HUEY, **hueyx_options, **config.values)
 
     def handle(self, *args, **options):
-        queue_name = options['queue_name'][0]
-        self.consumer_options = settings_reader.configurations[queue_name].consumer_options
+        queue_names = list(settings_reader.configurations) if options['all'] else options['queue_names']
+        if not queue_names:
+            raise CommandError('Select at least one queue or use --all.')
+        unknown = [name for name in queue_names if name not in settings_reader.configurations]
+        if unknown:
+            raise CommandError(f'Unknown queues: {", ".join(unknown)}')
 
         autodiscover_modules("tasks")
-        self.run_consumer(queue_name)
+        warmup(queue_names)
+        consumers = [self.create_consumer(name, setup_logger=i == 0) for i, name in enumerate(queue_names)]
+        if len(consumers) == 1:
+            consumers[0].run()
+        else:
+            HueyxMultiConsumer(consumers).run()
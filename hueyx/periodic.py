@@ -0,0 +1,132 @@
+import datetime
+import heapq
+import itertools
+from collections import deque
+from typing import List, Tuple
+
+CATCH_UP_SKIP = 'skip'
+CATCH_UP_ONCE = 'once'
+CATCH_UP_ALL = 'all'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Crontab schedules are searched minute by minute. Rare schedules are searched again after this window.
+CRONTAB_SEARCH_MINUTES = 7 * 24 * 60
+
+
+class every:
+    """
+    Periodic task schedule with an interval of seconds, e.g. @huey.periodic_task(every(seconds=10)).
+    The fire times are aligned to the unix epoch, so all schedulers agree on them.
+    """
+
+    def __init__(self, seconds=0, minutes=0, hours=0):
+        self.interval = int(datetime.timedelta(seconds=seconds, minutes=minutes, hours=hours).total_seconds())
+        assert self.interval >= 1, 'The interval needs to be at least one second.'
+
+    def __call__(self, timestamp: datetime.datetime):
+        """ Same interface as huey's crontab. Huey's consumer validates minutes only. """
+        return self._seconds(timestamp) % self.interval == 0
+
+    def next_fire(self, after: datetime.datetime) -> datetime.datetime:
+        seconds = (self._seconds(after) // self.interval + 1) * self.interval
+        return EPOCH + datetime.timedelta(seconds=seconds)
+
+    def last_fire(self, before: datetime.datetime) -> datetime.datetime:
+        seconds = self._seconds(before) // self.interval * self.interval
+        return EPOCH + datetime.timedelta(seconds=seconds)
+
+    def _seconds(self, timestamp: datetime.datetime) -> int:
+        return int((timestamp.replace(microsecond=0) - EPOCH).total_seconds())
+
+
+def next_fire(schedule, after: datetime.datetime) -> Tuple[datetime.datetime, bool]:
+    """
+    :return: The first fire time after the timestamp and whether the task fires then. If a crontab does not fire
+     within the search window, the end of the window is returned to search again later.
+    """
+    if hasattr(schedule, 'next_fire'):
+        return schedule.next_fire(after), True
+    minute = after.replace(second=0, microsecond=0)
+    for _ in range(CRONTAB_SEARCH_MINUTES):
+        minute += datetime.timedelta(minutes=1)
+        if schedule(minute):
+            return minute, True
+    return minute, False
+
+
+class PeriodicSchedule:
+    """
+    Keeps the next fire time of every periodic task in a heap, so a scheduler tick only handles the due tasks.
+    Fire times which have been missed, e.g. because the scheduler was busy, are handled by the catch_up policy:
+    skip runs the latest fire time only if it is at most grace seconds old, once runs the latest fire time
+    and all runs every missed fire time (at most max_catch_up).
+    """
+
+    def __init__(self, task_classes: List, now: datetime.datetime, catch_up=CATCH_UP_SKIP, grace=60,
+                 max_catch_up=100):
+        assert catch_up in (CATCH_UP_SKIP, CATCH_UP_ONCE, CATCH_UP_ALL), f'Unknown catch_up policy: {catch_up}'
+        self.catch_up = catch_up
+        self.grace = datetime.timedelta(seconds=grace)
+        self.max_catch_up = max_catch_up
+        self._counter = itertools.count()
+        self._heap = []
+        for task_class in task_classes:
+            schedule = get_schedule(task_class)
+            # A crontab fires in the current minute like in huey's scheduler, an interval not before now.
+            if hasattr(schedule, 'next_fire'):
+                after = now - datetime.timedelta(seconds=1)
+            else:
+                after = now.replace(second=0, microsecond=0) - datetime.timedelta(minutes=1)
+            self._push(task_class, *next_fire(schedule, after))
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def next_fire_time(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime.datetime) -> List[Tuple[type, datetime.datetime]]:
+        """ :return: The task classes and fire times to enqueue, ordered by fire time. """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire, _, task_class, fires = heapq.heappop(self._heap)
+            schedule = get_schedule(task_class)
+            missed = deque([fire] if fires else [], maxlen=self.max_catch_up)
+            if hasattr(schedule, 'last_fire') and self.catch_up != CATCH_UP_ALL:
+                # Intervals jump to the latest fire time instead of iterating over all missed ones.
+                latest = schedule.last_fire(now)
+                if latest != fire:
+                    missed.append(latest)
+                fire, fires = schedule.next_fire(now), True
+            else:
+                fire, fires = next_fire(schedule, fire)
+                while fire <= now:
+                    if fires:
+                        missed.append(fire)
+                    fire, fires = next_fire(schedule, fire)
+            self._push(task_class, fire, fires)
+            due.extend((task_class, fire_time) for fire_time in self._catch_up(missed, now))
+        return sorted(due, key=lambda item: item[1])
+
+    def _catch_up(self, missed: deque, now: datetime.datetime) -> List[datetime.datetime]:
+        if not missed:
+            return []
+        if self.catch_up == CATCH_UP_ALL:
+            return list(missed)
+        latest = missed[-1]
+        if self.catch_up == CATCH_UP_SKIP and now - latest > self.grace:
+            return []
+        return [latest]
+
+    def _push(self, task_class, fire: datetime.datetime, fires: bool):
+        heapq.heappush(self._heap, (fire, next(self._counter), task_class, fires))
+
+
+def get_schedule(task_class):
+    """ The validate_datetime of the periodic task, see BaseHueyx.periodic_task. """
+    schedule = getattr(task_class, 'periodic_schedule', None)
+    if schedule is None:
+        return lambda timestamp: task_class().validate_datetime(timestamp)
+    return schedule
@@ -0,0 +1,181 @@
+import cProfile
+import heapq
+import io
+import itertools
+import json
+import logging
+import os
+import pstats
+import random
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List
+
+from redis import Redis
+
+from .signals import BackgroundReporter
+
+logger = logging.getLogger(__name__)
+
+PHASE_DEQUEUE = 'dequeue'
+PHASE_DESERIALIZE = 'deserialize'
+PHASE_DB_CONNECTIONS = 'db_connections'
+PHASE_TASK = 'task'
+PHASE_HEARTBEAT = 'heartbeat'
+PHASE_RESULT = 'result'
+PHASE_SIGNALS = 'signals'
+PHASE_TOTAL = 'total'
+
+PERCENTILES = (50, 90, 99)
+
+
+class ExecutionProfiler(BackgroundReporter):
+    """
+    Records the duration of the phases of every task execution in a worker: dequeue, deserialize, db_connections,
+    task, heartbeat, result, signals and the total. The last window durations are kept per task and phase.
+    Blocking dequeues wait idle for messages, so they are not recorded and the total starts when the message arrives.
+    profile_sample_rate of the task bodies run with cProfile, the traces of the profile_slowest executions are kept.
+    A snapshot of every process is written to a redis hash every report_interval seconds (see read_profiles).
+    Tasks of async functions are not profiled.
+    """
+    thread_name = 'hueyx-profiler'
+
+    def __init__(self, redis: Redis, key: str, window=1000, profile_slowest=0, profile_sample_rate=0.1,
+                 report_interval=10.0):
+        super().__init__(redis)
+        self.key = key
+        self.window = window
+        self.profile_slowest = profile_slowest
+        self.profile_sample_rate = profile_sample_rate
+        self.report_interval = report_interval
+        self._local = threading.local()
+        self._durations = {}
+        self._slowest = []
+        self._counter = itertools.count()
+
+    def begin(self, restart=False, started: float = None):
+        """ Starts recording an execution in this thread unless one is recorded already. """
+        if restart or getattr(self._local, 'record', None) is None:
+            self._ensure_thread()
+            self._local.record = {}
+            self._local.started = time.perf_counter() if started is None else started
+            self._local.profile = None
+
+    def add(self, name: str, duration: float):
+        """ Adds the duration of a phase which was measured before the recording started. """
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record[name] = record.get(name, 0.0) + duration
+
+    def end(self, task_name: str):
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            return
+        self._local.record = None
+        record[PHASE_TOTAL] = time.perf_counter() - self._local.started
+        with self._lock:
+            phases = self._durations.setdefault(task_name, {})
+            for phase, duration in record.items():
+                phases.setdefault(phase, deque(maxlen=self.window)).append(duration)
+            if self._local.profile is not None:
+                self._keep_profile(task_name, record[PHASE_TOTAL], self._local.profile)
+
+    @contextmanager
+    def phase(self, name: str):
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record[name] = record.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def task_phase(self):
+        """ The task body, run with cProfile for sampled executions. """
+        if getattr(self._local, 'record', None) is None or not self._sample():
+            with self.phase(PHASE_TASK):
+                yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:    # another profiler is active
+            with self.phase(PHASE_TASK):
+                yield
+            return
+        try:
+            with self.phase(PHASE_TASK):
+                yield
+        finally:
+            profile.disable()
+            self._local.profile = profile
+
+    def stats(self) -> Dict:
+        """ :return: {task: {phase: {'count': .., 'mean_ms': .., 'p50_ms': .., 'p90_ms': .., ..}}} """
+        with self._lock:
+            durations = {task: {phase: sorted(values) for phase, values in phases.items()}
+                         for task, phases in self._durations.items()}
+        return {task: {phase: _summary(values) for phase, values in phases.items()}
+                for task, phases in durations.items()}
+
+    def slowest(self) -> List[Dict]:
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+        return [{'task': task, 'total_ms': round(duration * 1000, 3), 'profile': trace}
+                for duration, _, task, trace in slowest]
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        snapshot = {'updated': time.time(), 'tasks': self.stats(), 'slowest': self.slowest()}
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(self.key, f'{socket.gethostname()}:{os.getpid()}', json.dumps(snapshot))
+            pipe.expire(self.key, int(self.report_interval * 6))
+            pipe.execute()
+        except Exception:
+            logger.exception('Could not write the profile.')
+
+    def _sample(self) -> bool:
+        return self.profile_slowest > 0 and random.random() < self.profile_sample_rate
+
+    def _keep_profile(self, task_name: str, duration: float, profile: cProfile.Profile):
+        if len(self._slowest) >= self.profile_slowest and duration <= self._slowest[0][0]:
+            return
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(20)
+        item = (duration, next(self._counter), task_name, output.getvalue())
+        if len(self._slowest) < self.profile_slowest:
+            heapq.heappush(self._slowest, item)
+        else:
+            heapq.heapreplace(self._slowest, item)
+
+    def _reset(self):
+        self._durations = {}
+        self._slowest = []
+
+    def _run(self):
+        while True:
+            time.sleep(self.report_interval)
+            self.flush()
+
+
+def _summary(sorted_values: List[float]) -> Dict:
+    summary = {'count': len(sorted_values),
+               'mean_ms': round(sum(sorted_values) / len(sorted_values) * 1000, 3),
+               'max_ms': round(sorted_values[-1] * 1000, 3)}
+    for percent in PERCENTILES:
+        index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+        summary[f'p{percent}_ms'] = round(sorted_values[index] * 1000, 3)
+    return summary
+
+
+def read_profiles(redis: Redis, key: str) -> Dict:
+    """ The snapshots of the ExecutionProfiler by host:pid of the consumer process. """
+    return {field.decode(): json.loads(value) for field, value in redis.hgetall(key).items()}
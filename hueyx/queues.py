@@ -1,11 +1,26 @@
-from .redis_huey import RedisHuey
-from functools import lru_cache
+from typing import Dict, Iterable, List
 
+from .redis_huey import RedisHuey
 from .settings_reader import DjangoSettingsReader
 
+# The settings are read on first use, see DjangoSettingsReader.
 settings_reader = DjangoSettingsReader()
-settings_reader.interpret_settings()
 
 
 def hueyx(queue_name: str) -> RedisHuey:
     return settings_reader.configurations[queue_name].huey_instance
+
+
+def warmup(queue_names: Iterable[str] = None):
+    """
+    Creates the huey instances of the queues (default all) and opens a redis connection for each of them.
+    Workers call it before they start, other processes create the queues on first use.
+    """
+    for queue_name in queue_names or settings_reader.configurations:
+        huey = hueyx(queue_name)
+        huey.storage.conn.ping()
+
+
+def pool_stats() -> List[Dict]:
+    """ The redis connection pools of the created queues. Queues with the same connection share a pool. """
+    return settings_reader.connection_pools.stats()
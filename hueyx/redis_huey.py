@@ -1,14 +1,128 @@
-from collections import namedtuple
-from contextlib import contextmanager
-from datetime import timedelta
-from functools import wraps
-from typing import List
+import asyncio
+import hashlib
+import inspect
+import logging
+import re
+import threading
+import time
+import traceback
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
+from copy import copy
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache, wraps
+from typing import Iterable, List, Optional, Tuple
+from weakref import WeakKeyDictionary
 
-from django.db import close_old_connections
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
 from django.utils import timezone
-from huey import Huey as HueyOriginal
-from huey.api import Task
-from huey.storage import RedisStorage, PriorityRedisStorage, RedisExpireStorage, PriorityRedisExpireStorage
+from huey import Huey as HueyOriginal, signals as S
+from huey.api import PeriodicTask, Result, ResultGroup, Task, TaskWrapper
+from huey.constants import EmptyData
+from huey.exceptions import CancelExecution, ResultTimeout, RetryTask, TaskException, TaskLockedException
+from huey.storage import RedisStorage, PriorityRedisStorage, RedisExpireStorage, PriorityRedisExpireStorage, \
+    RedisPriorityQueue
+from huey.utils import Error, normalize_time, time_clock
+
+from .db_connections import DbConnectionLifecycle, DB_CONNECTION_CLOSE, DB_CONNECTION_PERSISTENT
+from .profiling import PHASE_DB_CONNECTIONS, PHASE_DEQUEUE, PHASE_DESERIALIZE, PHASE_HEARTBEAT, PHASE_RESULT, \
+    PHASE_SIGNALS
+from .serializers import ResultSerializer, RESULT_CODEC_PICKLE
+from .storage import FairPriorityRedisStorage, FairPriorityRedisExpireStorage, FairRedisQueue, DEFAULT_FAIR_KEY
+from .signals import SIGNAL_COALESCED, SIGNAL_ENQUEUED_MANY, SIGNAL_RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: heartbeat index, KEYS[2..n]: redis keys of the revoke data
+# ARGV[1]: task id, ARGV[2]: now, ARGV[3]: update interval, ARGV[4]: heartbeat timeout,
+# ARGV[5..]: hash fields of the revoke data ('' if the revoke data is stored in a plain key)
+# Returns the revoke data ('' if not revoked) followed by the (refreshed) deadline ('' if not observed).
+HEARTBEAT_CHECK_LUA = """
+local result = {}
+local revoked = false
+for i = 2, #KEYS do
+    local field = ARGV[i + 3]
+    local data
+    if field == '' then
+        data = redis.call('GET', KEYS[i])
+    else
+        data = redis.call('HGET', KEYS[i], field)
+    end
+    result[i - 1] = data or ''
+    revoked = revoked or data
+end
+local now = tonumber(ARGV[2])
+local timeout = tonumber(ARGV[4])
+local deadline = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1]))
+if deadline and not revoked and now < deadline and deadline - timeout + tonumber(ARGV[3]) <= now then
+    deadline = now + timeout
+    redis.call('ZADD', KEYS[1], 'XX', deadline, ARGV[1])
+end
+result[#KEYS] = deadline or ''
+return result
+"""
+
+# KEYS[1]: unique key of the task, ARGV[1]: task id, ARGV[2]: expire in seconds
+# Returns the id of the pending task with the same unique key or false if the task claimed the key.
+UNIQUE_CLAIM_LUA = """
+local pending = redis.call('GET', KEYS[1])
+if pending and pending ~= ARGV[1] then
+    return pending
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return false
+"""
+
+# KEYS[1]: unique key of the task, ARGV[1]: task id
+UNIQUE_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS[1]: token bucket, ARGV[1]: capacity, ARGV[2]: tokens per second, ARGV[3]: task id
+# Takes a token, a missing token is reserved for the task: returns the milliseconds until its token is available
+# (0 if the task runs now). The reservation is kept as a field of the bucket and redeemed when the task returns.
+# The clock of redis is used, the clocks of the workers may differ.
+RATE_LIMIT_LUA = """
+if redis.call('HDEL', KEYS[1], ARGV[3]) == 1 then
+    return 0
+end
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate) - 1
+local wait = 0
+if tokens < 0 then
+    wait = math.ceil(-tokens / rate * 1000)
+    redis.call('HSET', KEYS[1], ARGV[3], 1)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], wait + math.ceil(capacity / rate * 1000) + 60000)
+return wait
+"""
+
+RATE_LIMIT_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_LIMIT_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*/\s*(\d*)\s*([smhd])\s*$')
+
+
+@lru_cache(maxsize=None)
+def parse_rate_limit(rate_limit: str) -> Tuple[float, float]:
+    """ '100/s', '10/m', '5/10s' -> (capacity, tokens per second) of the token bucket. """
+    match = RATE_LIMIT_PATTERN.match(rate_limit)
+    assert match and float(match.group(1)) > 0, f'Invalid rate_limit: {rate_limit}'
+    count = float(match.group(1))
+    seconds = int(match.group(2) or 1) * RATE_LIMIT_PERIODS[match.group(3)]
+    return count, count / seconds
 
 
 class BaseHueyx(HueyOriginal):
@@ -18,14 +132,33 @@ class BaseHueyx(HueyOriginal):
 
     DeadTask = namedtuple('DeadTask', ['id', 'name', 'settings'])
     HEARTBEAT_UPDATE_INTERVAL = 60  # min wait time in seconds to send another heartbeat to redis
+    UNIQUE_KEY_EXPIRE = 3600  # max time in seconds a pending task absorbs enqueues (in addition to coalesce_delay)
+
+    def __init__(self, *args, **kwargs):
+        db_connection_mode = kwargs.pop('db_connection_mode', DB_CONNECTION_CLOSE)
+        db_connection_max_age = kwargs.pop('db_connection_max_age', 300)
+        db_connection_idle_check = kwargs.pop('db_connection_idle_check', 30)
+        assert db_connection_mode in (DB_CONNECTION_CLOSE, DB_CONNECTION_PERSISTENT), \
+            f'Unknown db_connection_mode: {db_connection_mode}'
+        super().__init__(*args, **kwargs)
+        self.serializer = ResultSerializer(self.serializer)
+        self._async_clients = WeakKeyDictionary()
+        self._rate_limit_scripts = WeakKeyDictionary()
+        self._executing = threading.local()
+        # ExecutionProfiler, set by HueyxConsumer if profiling is enabled
+        self.profiler = None
+        self.db_connection_lifecycle = None
+        if db_connection_mode == DB_CONNECTION_PERSISTENT:
+            self.db_connection_lifecycle = DbConnectionLifecycle(db_connection_max_age, db_connection_idle_check)
 
     def db_task(self, *args, **kwargs):
         def decorator(fn):
             heartbeat_timeout = kwargs.pop('heartbeat_timeout', 0)
+            background_heartbeat = kwargs.pop('background_heartbeat', False)
             if heartbeat_timeout:
                 assert not kwargs.get('include_task',
                                       False), 'include_task and heartbeat_timeout keywords are not allowed together.'
-                wrap = _wrap_heartbeat(close_db(fn, self), self, heartbeat_timeout)
+                wrap = _wrap_heartbeat(close_db(fn, self), self, heartbeat_timeout, background_heartbeat)
                 kwargs['context'] = True
             else:
                 wrap = close_db(fn, self)
@@ -36,6 +169,715 @@ class BaseHueyx(HueyOriginal):
 
         return decorator
 
+    def db_batch_task(self, *args, batch_size=100, max_wait=1.0, **kwargs):
+        """
+        Collects the calls of the task and executes up to batch_size of them at once. The function is called with
+        the list of argument tuples within one transaction and returns a list with the result of every item.
+        An exception in this list is reported as the error of its item. A call waits at most max_wait seconds
+        for its batch to fill up. Calls with keyword arguments raise a TypeError.
+        """
+        assert not kwargs.get('coalesce') and 'unique_key' not in kwargs, 'Batch tasks can not be coalesced.'
+
+        def decorator(fn):
+            def execute_single(*item_args):
+                result = fn([item_args])
+                result = result[0] if result else None
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+            def execute_batch():
+                self.execute_batch(ret.task_class, fn)
+
+            execute_single.__name__ = execute_batch.__name__ = kwargs.pop('name', None) or fn.__name__
+            execute_single.__module__ = execute_batch.__module__ = fn.__module__
+            execute_batch.__name__ += '_flush'
+            ret = self.task(*args, batch_size=batch_size, max_wait=max_wait, **kwargs)(
+                close_db(transaction.atomic(execute_single), self))
+            flush = self.task(priority=kwargs.get('priority'))(close_db(execute_batch, self))
+            ret.task_class.flush_task_class = flush.task_class
+            ret.call_local = fn
+            return ret
+
+        return decorator
+
+    def get_task_wrapper_class(self):
+        return HueyxTaskWrapper
+
+    def enqueue(self, task: Task):
+        """
+        Calls of db_batch_task are collected in the batch list of the task instead of the queue.
+        Fair queues enqueue the task in the sub-queue of its fair key.
+        """
+        _check_batch_call(task)
+        if self._immediate:
+            return super().enqueue(task)
+        pending_id, = self._claim_unique_keys([task])
+        if pending_id is not None:
+            self._emit(SIGNAL_COALESCED, task)
+            return Result(self, Task(id=pending_id)) if self.results else None
+        if getattr(task, 'batch_size', None):
+            if task.expires:
+                task.resolve_expires(self.utc)
+            self._emit(S.SIGNAL_ENQUEUED, task)
+            if self._is_delayed(task):
+                self.add_schedule(task)
+                return Result(self, task) if self.results else None
+            length = self.storage.conn.rpush(self.batch_key(type(task)), self.serialize_task(task))
+            self._schedule_batch_flush(type(task), length, 1)
+            return Result(self, task) if self.results else None
+        if isinstance(self.storage, FairRedisQueue):
+            if task.expires:
+                task.resolve_expires(self.utc)
+            self._emit(S.SIGNAL_ENQUEUED, task)
+            self._storage_enqueue(self.storage, task, self.serialize_task(task))
+            return self._enqueue_result(task) if self.results else None
+        return super().enqueue(task)
+
+    def _storage_enqueue(self, storage, task: Task, message: bytes):
+        """ Enqueues the message on the storage or a pipelined copy of it. """
+        if isinstance(self.storage, FairRedisQueue):
+            storage.enqueue(message, task.priority, self.get_fair_key(task))
+        else:
+            storage.enqueue(message, task.priority)
+
+    def get_unique_key(self, task: Task) -> Optional[str]:
+        """
+        Redis key which a pending task holds to absorb enqueues with the same key: from the task option unique_key
+        (a constant or a function of the task arguments) or, with coalesce=True, from the task arguments.
+        """
+        unique_key = getattr(type(task), 'unique_key', None)
+        if callable(unique_key):
+            key = unique_key(*task.args, **task.kwargs)
+        elif unique_key is not None:
+            key = unique_key
+        elif getattr(type(task), 'coalesce', False):
+            key = hashlib.sha1(repr((task.args, sorted(task.kwargs.items()))).encode()).hexdigest()
+        else:
+            return None
+        return f'huey.unique.{self.storage.name}.{task.name}.{key}'
+
+    def _claim_unique_keys(self, tasks: List[Task]) -> List[Optional[str]]:
+        """
+        Claims the unique keys of the tasks in one round trip. Claimed tasks with coalesce_delay are delayed.
+        :return: Per task the id of the pending task which absorbs it or None if the task is enqueued.
+        """
+        keys = [self.get_unique_key(task) for task in tasks]
+        if not any(keys):
+            return [None] * len(tasks)
+        script = self.storage.conn.register_script(UNIQUE_CLAIM_LUA)
+        pipe = self.storage.conn.pipeline(transaction=False)
+        for task, key in zip(tasks, keys):
+            if key:
+                script(keys=[key], args=[task.id, self._unique_key_expire(task)], client=pipe)
+        claims = iter(pipe.execute())
+
+        pending_ids = []
+        for task, key in zip(tasks, keys):
+            pending_id = next(claims) if key else None
+            if key and not pending_id and getattr(task, 'coalesce_delay', 0) and task.eta is None:
+                task.eta = normalize_time(delay=task.coalesce_delay, utc=self.utc)
+            pending_ids.append(pending_id.decode() if pending_id else None)
+        return pending_ids
+
+    def _unique_key_expire(self, task: Task) -> int:
+        return int(self.UNIQUE_KEY_EXPIRE + getattr(task, 'coalesce_delay', 0))
+
+    def _release_unique_key(self, task: Task):
+        """ New enqueues are not absorbed anymore once the task runs. """
+        key = self.get_unique_key(task)
+        if key and not self._immediate:
+            self.storage.conn.register_script(UNIQUE_RELEASE_LUA)(keys=[key], args=[task.id])
+
+    @staticmethod
+    def get_fair_key(task: Task) -> str:
+        """
+        The fair key of the task option fair_key (a constant or a function of the task arguments) or of the task
+        argument selected by fair_key_arg (position or keyword).
+        """
+        fair_key = getattr(type(task), 'fair_key', None)
+        if callable(fair_key):
+            return str(fair_key(*task.args, **task.kwargs))
+        if fair_key is not None:
+            return str(fair_key)
+        fair_key_arg = getattr(type(task), 'fair_key_arg', None)
+        if fair_key_arg in task.kwargs:
+            return str(task.kwargs[fair_key_arg])
+        # Position of the argument, a name is mapped to its position when the task class is created.
+        position = fair_key_arg if isinstance(fair_key_arg, int) else getattr(type(task), 'fair_key_position', None)
+        if position is not None and position < len(task.args):
+            return str(task.args[position])
+        return DEFAULT_FAIR_KEY
+
+    def get_rate_limit_key(self, task: Task) -> str:
+        """ Token bucket of the task. Tasks with the same rate_limit_key share one bucket across all queues. """
+        rate_limit_key = getattr(type(task), 'rate_limit_key', None)
+        if rate_limit_key:
+            return f'huey.rate_limit.{rate_limit_key}'
+        return f'huey.rate_limit.{self.storage.name}.{task.name}'
+
+    def _rate_limited(self, task: Task, timestamp) -> bool:
+        """
+        Takes a token of the rate_limit of the task. A throttled task gets the eta of its reserved token,
+        so execute defers it to the schedule instead of blocking the worker.
+        """
+        wait = self._acquire_rate_limit(task)
+        if not wait:
+            return False
+        task.eta = timestamp + timedelta(milliseconds=wait)
+        logger.info('Task %s is rate limited, deferred by %sms', task, wait)
+        self._emit(SIGNAL_RATE_LIMITED, task)
+        return True
+
+    def _acquire_rate_limit(self, task: Task) -> int:
+        """ :return: The milliseconds until the task may run. """
+        rate_limit = getattr(task, 'rate_limit', None)
+        if not rate_limit or self._immediate:
+            return 0
+        capacity, rate = parse_rate_limit(rate_limit)
+        conn = self.storage.conn
+        if conn not in self._rate_limit_scripts:
+            self._rate_limit_scripts[conn] = conn.register_script(RATE_LIMIT_LUA)
+        script = self._rate_limit_scripts[conn]
+        return int(script(keys=[self.get_rate_limit_key(task)], args=[capacity, rate, task.id]))
+
+    def batch_key(self, task_class):
+        """ Redis list of the collected calls of a db_batch_task. """
+        return f'huey.batch.{self.storage.name}.{self._registry.task_to_string(task_class)}'
+
+    def _schedule_batch_flush(self, task_class, length, added):
+        """
+        Enqueues a flush task after items have been added to the batch list: delayed by max_wait for the first
+        item of a batch and immediately when a batch is full.
+        """
+        flush_task = self._batch_flush_task(task_class, length, added)
+        if flush_task is not None:
+            self.enqueue(flush_task)
+
+    def _is_delayed(self, task: Task) -> bool:
+        """ Batch calls with a future eta wait in the schedule, which enqueues them into the batch list when due. """
+        return task.eta is not None and task.eta > self._get_timestamp()
+
+    def _batch_flush_task(self, task_class, length, added) -> Optional[Task]:
+        if length // task_class.batch_size > (length - added) // task_class.batch_size:
+            return task_class.flush_task_class()
+        if length == added:
+            return task_class.flush_task_class(eta=normalize_time(delay=task_class.max_wait, utc=self.utc))
+        return None
+
+    def execute_batch(self, task_class, fn):
+        """
+        Pops up to batch_size calls of the task from its batch list in one round trip and executes them with a
+        single call of fn within a transaction. Results, errors and signals are reported per call.
+        """
+        pipe = self.storage.conn.pipeline()
+        pipe.lrange(self.batch_key(task_class), 0, task_class.batch_size - 1)
+        pipe.ltrim(self.batch_key(task_class), task_class.batch_size, -1)
+        pipe.llen(self.batch_key(task_class))
+        messages, _, remaining = pipe.execute()
+        if remaining:
+            self._schedule_batch_flush(task_class, remaining, remaining)
+
+        timestamp = self._get_timestamp()
+        tasks = []
+        for task in (self.deserialize_task(message) for message in messages):
+            if self.is_revoked(task, timestamp, False):
+                logger.warning('Task %s was revoked, not executing', task)
+                self._emit(S.SIGNAL_REVOKED, task)
+            elif task.expires_resolved and task.expires_resolved < timestamp:
+                logger.info('Task %s expired, not executing.', task)
+                self._emit(S.SIGNAL_EXPIRED, task)
+            else:
+                self._emit(S.SIGNAL_EXECUTING, task)
+                tasks.append(task)
+        if not tasks:
+            return
+
+        start = time_clock()
+        tb = None
+        try:
+            with transaction.atomic():
+                results = fn([task.args for task in tasks])
+            results = [None] * len(tasks) if results is None else list(results)
+            if len(results) != len(tasks):
+                raise ValueError(f'{task_class.__name__} returned {len(results)} results for {len(tasks)} calls.')
+        except Exception as exc:
+            logger.exception('Unhandled exception in batch of %s.', task_class.__name__)
+            results = [exc] * len(tasks)
+            tb = traceback.format_exc()
+        logger.info('%s calls of %s executed in %0.3fs', len(tasks), task_class.__name__, time_clock() - start)
+        self._report_batch(tasks, results, tb)
+
+    def _report_batch(self, tasks: List[Task], results: List, tb=None):
+        """ tb is the formatted traceback of an exception of the whole batch. """
+        pipe = self.storage.conn.pipeline()
+        storage = self._pipelined_storage(pipe)
+        retries = []
+        for task, result in zip(tasks, results):
+            if isinstance(result, Exception):
+                self._emit(S.SIGNAL_ERROR, task, result)
+                if self.results:
+                    self._put_task_result(storage, task, Error(self.build_error_result(task, result, tb)))
+                if task.retries:
+                    retries.append(task)
+            else:
+                if self.results and (result is not None or self.store_none):
+                    self._put_task_result(storage, task, result)
+                self._emit(S.SIGNAL_COMPLETE, task)
+        pipe.execute()
+
+        for task in retries:
+            self._emit(S.SIGNAL_RETRYING, task)
+            self._requeue_task(task, self._get_timestamp())
+
+    def enqueue_many(self, tasks: Iterable[Task], chunk_size=1000):
+        """
+        Enqueues the tasks in chunks. Every chunk is written to redis with a single pipeline and
+        reported with one SIGNAL_ENQUEUED_MANY signal per task type instead of one enqueued signal per task.
+        """
+        if self._immediate:
+            return ResultGroup([self.enqueue(task) for task in tasks]) if self.results else None
+
+        results = []
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) >= chunk_size:
+                results.extend(self._enqueue_chunk(chunk))
+                chunk = []
+        if chunk:
+            results.extend(self._enqueue_chunk(chunk))
+        return ResultGroup(results) if self.results else None
+
+    def _enqueue_chunk(self, tasks: List[Task]):
+        for task in tasks:
+            _check_batch_call(task)
+        pending_ids = self._claim_unique_keys(tasks)
+        for task, pending_id in zip(tasks, pending_ids):
+            if pending_id is not None:
+                self._emit(SIGNAL_COALESCED, task)
+        enqueued = [task for task, pending_id in zip(tasks, pending_ids) if pending_id is None]
+        results = self._enqueue_tasks(enqueued) if enqueued else []
+        if not self.results:
+            return []
+        results = iter(results)
+        return [Result(self, Task(id=pending_id)) if pending_id is not None else next(results)
+                for pending_id in pending_ids]
+
+    def _enqueue_tasks(self, tasks: List[Task]):
+        for task in tasks:
+            if task.expires:
+                task.resolve_expires(self.utc)
+        batches = {}
+        scheduled = []
+        queued = []
+        for task in tasks:
+            if getattr(task, 'batch_size', None) and self._is_delayed(task):
+                scheduled.append(task)
+            elif getattr(task, 'batch_size', None):
+                batches.setdefault(type(task), []).append(self.serialize_task(task))
+            else:
+                queued.append((task, self.serialize_task(task)))
+
+        pipe = self.storage.conn.pipeline()
+        storage = self._pipelined_storage(pipe)
+        for task_class, messages in batches.items():
+            pipe.rpush(self.batch_key(task_class), *messages)
+        for task in scheduled:
+            storage.add_to_schedule(self.serialize_task(task), task.eta)
+        if isinstance(self.storage, (RedisPriorityQueue, FairRedisQueue)):
+            for task, message in queued:
+                self._storage_enqueue(storage, task, message)
+        elif queued:
+            pipe.lpush(self.storage.queue_key, *(message for _, message in queued))
+        lengths = pipe.execute()
+        for (task_class, messages), length in zip(batches.items(), lengths):
+            self._schedule_batch_flush(task_class, length, len(messages))
+
+        first_tasks = {}
+        counts = Counter()
+        for task in tasks:
+            first_tasks.setdefault(type(task), task)
+            counts[type(task)] += 1
+        for task_type, task in first_tasks.items():
+            self._emit(SIGNAL_ENQUEUED_MANY, task, counts[task_type])
+
+        if not self.results:
+            return []
+        return [self._enqueue_result(task) for task in tasks]
+
+    def _enqueue_result(self, task: Task):
+        """ Result handle like Huey.enqueue returns it. """
+        if task.on_complete:
+            current = task
+            results = []
+            while current is not None:
+                results.append(Result(self, current))
+                current = current.on_complete
+            return ResultGroup(results)
+        return Result(self, task)
+
+    @property
+    def async_conn(self):
+        """
+        redis.asyncio client with the connection parameters of the storage. Asyncio connections are bound to
+        their event loop, hence every loop gets its own client.
+        """
+        from redis import asyncio as aioredis
+
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            pool = self.storage.pool
+            connection_class = getattr(aioredis.connection, pool.connection_class.__name__, aioredis.Connection)
+            async_pool = aioredis.ConnectionPool(connection_class=connection_class,
+                                                 max_connections=pool.max_connections, **pool.connection_kwargs)
+            self._async_clients[loop] = aioredis.Redis(connection_pool=async_pool)
+        return self._async_clients[loop]
+
+    async def aenqueue(self, task: Task):
+        """ Same as enqueue, but with redis.asyncio. Immediate mode executes the task right away. """
+        if self._immediate and not getattr(task, 'is_async', False):
+            return self.enqueue(task)
+        _check_batch_call(task)
+        if task.expires:
+            task.resolve_expires(self.utc)
+
+        if self._immediate:
+            self._emit(S.SIGNAL_ENQUEUED, task)
+            await self.aexecute(task)
+        else:
+            key = self.get_unique_key(task)
+            if key:
+                pending_id = await self.async_conn.eval(UNIQUE_CLAIM_LUA, 1, key, task.id,
+                                                        self._unique_key_expire(task))
+                if pending_id:
+                    self._emit(SIGNAL_COALESCED, task)
+                    return Result(self, Task(id=pending_id.decode())) if self.results else None
+                if getattr(task, 'coalesce_delay', 0) and task.eta is None:
+                    task.eta = normalize_time(delay=task.coalesce_delay, utc=self.utc)
+            self._emit(S.SIGNAL_ENQUEUED, task)
+            if getattr(task, 'batch_size', None):
+                await self._aenqueue_batch_call(task)
+            else:
+                pipe = self.async_conn.pipeline(transaction=False)
+                self._storage_enqueue(self._pipelined_storage(pipe), task, self.serialize_task(task))
+                await pipe.execute()
+
+        if not self.results:
+            return
+        return self._enqueue_result(task)
+
+    async def _aenqueue_batch_call(self, task: Task):
+        """ Same as the batch branch of enqueue. """
+        if self._is_delayed(task):
+            pipe = self.async_conn.pipeline(transaction=False)
+            self._pipelined_storage(pipe).add_to_schedule(self.serialize_task(task), task.eta)
+            await pipe.execute()
+            return
+        length = await self.async_conn.rpush(self.batch_key(type(task)), self.serialize_task(task))
+        flush_task = self._batch_flush_task(type(task), length, 1)
+        if flush_task is not None:
+            await self.aenqueue(flush_task)
+
+    async def aresult(self, id, blocking=False, timeout=None, backoff=1.15, max_delay=1.0, revoke_on_timeout=False,
+                      preserve=False):
+        """ Same as result, but with redis.asyncio. """
+        if self._immediate:
+            return self.result(id, blocking, timeout, backoff, max_delay, revoke_on_timeout, preserve)
+        start = time_clock()
+        delay = .1
+        while True:
+            data = await self._aget_raw(id, peek=preserve)
+            if data is not EmptyData:
+                result = self.serializer.deserialize(data)
+                if result is not None and isinstance(result, Error):
+                    raise TaskException(result.metadata)
+                return result
+            if not blocking:
+                return None
+            if timeout and time_clock() - start >= timeout:
+                if revoke_on_timeout:
+                    pipe = self.async_conn.pipeline(transaction=False)
+                    storage = self._pipelined_storage(pipe)
+                    storage.put_data(Task(id=id).revoke_id, self.serializer.serialize((None, True)))
+                    await pipe.execute()
+                raise ResultTimeout('timed out waiting for result')
+            await asyncio.sleep(min(delay, max_delay))
+            delay *= backoff
+
+    async def _aget_raw(self, key, peek=False):
+        pipe = self.async_conn.pipeline()
+        self._queue_raw_reads(pipe, key, peek)
+        return self._raw_value(await pipe.execute())
+
+    async def aexecute(self, task: Task, timestamp=None):
+        """
+        Same as execute for tasks of async functions. The coroutine runs on the current event loop,
+        the bookkeeping of huey on redis (revocation, results, signals, retries) runs in the executor of the loop.
+        """
+        loop = asyncio.get_running_loop()
+        if timestamp is None:
+            timestamp = self._get_timestamp()
+        if not await loop.run_in_executor(None, self._prepare_execution, task, timestamp):
+            return
+
+        start = time_clock()
+        task_value = exception = tb = None
+        try:
+            self._tasks_in_flight.add(task)
+            try:
+                task_value = await task.execute()
+            finally:
+                self._tasks_in_flight.remove(task)
+        except asyncio.CancelledError:
+            logger.warning('Received exit signal, %s did not finish.', task.id)
+            self._emit(S.SIGNAL_INTERRUPTED, task)
+            raise
+        except Exception as exc:
+            exception = exc
+            # The error result is built in the executor, outside of this except block.
+            tb = traceback.format_exc()
+        duration = time_clock() - start
+        return await loop.run_in_executor(None, self._finish_execution, task, task_value, exception, duration, tb)
+
+    def _prepare_execution(self, task: Task, timestamp) -> bool:
+        """
+        First half of Huey.execute and Huey._execute of huey 2.6.0, keep it in sync when upgrading huey.
+        :return: True if the task is executed.
+        """
+        if not self._check_execution(task, timestamp):
+            return False
+        if self._pre_execute:
+            try:
+                self._run_pre_execute(task)
+            except CancelExecution:
+                self._emit(S.SIGNAL_CANCELED, task)
+                return False
+        return True
+
+    def _check_execution(self, task: Task, timestamp) -> bool:
+        """
+        Huey.execute of huey 2.6.0 up to the call of _execute. The unique key of the task is released before the
+        revoke and expiry signals, so a revoked or expired task does not absorb new enqueues. The rate limit token
+        is only taken by tasks which run, a throttled task keeps its unique key while it waits in the schedule.
+        :return: True if the task is executed.
+        """
+        if not self.ready_to_run(task, timestamp):
+            self.add_schedule(task)
+            return False
+        revoked = self.is_revoked(task, timestamp, False)
+        expired = not revoked and task.expires_resolved and task.expires_resolved < timestamp
+        if not revoked and not expired and self._rate_limited(task, timestamp):
+            self.add_schedule(task)
+            return False
+        self._release_unique_key(task)
+        if revoked:
+            logger.warning('Task %s was revoked, not executing', task)
+            self._emit(S.SIGNAL_REVOKED, task)
+        elif expired:
+            logger.info('Task %s expired, not executing.', task)
+            self._emit(S.SIGNAL_EXPIRED, task)
+        else:
+            logger.info('Executing %s', task)
+            self._emit(S.SIGNAL_EXECUTING, task)
+            return True
+        return False
+
+    def _finish_execution(self, task: Task, task_value, exception, duration, tb=None):
+        """
+        Second half of Huey._execute of huey 2.6.0 which handles the outcome of the task, keep it in sync when
+        upgrading huey. tb is the formatted traceback of the exception.
+        """
+        retry_eta = None
+        if exception is None:
+            logger.info('%s executed in %0.3fs', task, duration)
+        elif isinstance(exception, TaskLockedException):
+            logger.warning('Task %s not run, %s.', task.id, exception)
+            self._emit(S.SIGNAL_LOCKED, task)
+        elif isinstance(exception, RetryTask):
+            logger.info('Task %s raised RetryTask, retrying.', task.id)
+            task.retries += 1
+            if exception.eta or exception.delay is not None:
+                retry_eta = normalize_time(exception.eta, exception.delay, self.utc)
+        elif isinstance(exception, CancelExecution):
+            if exception.retry or (exception.retry is None and task.retries):
+                task.retries = max(task.retries, 1)
+            else:
+                task.retries = 0
+            logger.warning('Task %s raised CancelExecution.', task.id)
+            self._emit(S.SIGNAL_CANCELED, task)
+        else:
+            logger.error('Unhandled exception in task %s.', task.id, exc_info=exception)
+            self._emit(S.SIGNAL_ERROR, task, exception)
+
+        if not isinstance(task, PeriodicTask):
+            self.get(task.revoke_id)
+
+        if self.results and not isinstance(task, PeriodicTask):
+            if exception is not None:
+                self._put_task_result(self.storage, task, Error(self.build_error_result(task, exception, tb)))
+            elif task_value is not None or self.store_none:
+                self._put_task_result(self.storage, task, task_value)
+
+        if self._post_execute:
+            self._run_post_execute(task, task_value, exception)
+
+        if exception is None:
+            self._emit(S.SIGNAL_COMPLETE, task)
+
+        if task.on_complete and exception is None:
+            next_task = task.on_complete
+            next_task.extend_data(task_value)
+            self.enqueue(next_task)
+        elif task.on_error and exception is not None:
+            next_task = task.on_error
+            next_task.extend_data(exception)
+            self.enqueue(next_task)
+
+        if exception is not None and task.retries:
+            self._emit(S.SIGNAL_RETRYING, task)
+            self._requeue_task(task, self._get_timestamp(), retry_eta)
+
+        return task_value
+
+    def build_error_result(self, task: Task, exception, tb=None):
+        """ huey formats the traceback of the exception being handled, tb replaces it if it was caught earlier. """
+        error = super().build_error_result(task, exception)
+        if tb is not None:
+            error['traceback'] = tb
+        return error
+
+    def dequeue(self):
+        if self.profiler is None:
+            return super().dequeue()
+        started = time.perf_counter()
+        data = self.storage.dequeue()
+        if data is None:
+            return None
+        if self.storage.blocking:
+            # A blocking dequeue waits idle for a message, the execution is recorded from its arrival.
+            self.profiler.begin(restart=True)
+        else:
+            self.profiler.begin(restart=True, started=started)
+            self.profiler.add(PHASE_DEQUEUE, time.perf_counter() - started)
+        with self.profiler.phase(PHASE_DESERIALIZE):
+            return self.deserialize_task(data)
+
+    def execute(self, task: Task, timestamp=None):
+        if getattr(task, 'is_async', False):
+            # Thread, process and greenlet workers run tasks of async functions on an event loop of their own.
+            return asyncio.run(self.aexecute(task, timestamp))
+        if self.profiler is None:
+            return self._execute_sync(task, timestamp)
+        self.profiler.begin()
+        try:
+            return self._execute_sync(task, timestamp)
+        finally:
+            self.profiler.end(task.name)
+
+    def _execute_sync(self, task: Task, timestamp):
+        """ Huey.execute with the checks of _check_execution. """
+        if timestamp is None:
+            timestamp = self._get_timestamp()
+        if self._check_execution(task, timestamp):
+            return self._execute(task, timestamp)
+
+    def _emit(self, signal, task, *args, **kwargs):
+        with self.profile_phase(PHASE_SIGNALS):
+            super()._emit(signal, task, *args, **kwargs)
+
+    def profile_phase(self, name: str):
+        """ Records the duration of the phase if profiling is enabled. """
+        return self.profiler.phase(name) if self.profiler is not None else nullcontext()
+
+    def profile_task_phase(self):
+        return self.profiler.task_phase() if self.profiler is not None else nullcontext()
+
+    @property
+    def profile_key(self):
+        """ Hash of the profiling snapshots of the consumer processes. """
+        return f'huey.profile.{self.storage.name}'
+
+    def _execute(self, task: Task, timestamp):
+        """ Remembers the executing task for put_result. Immediate mode executes tasks nested. """
+        previous = getattr(self._executing, 'task', None)
+        self._executing.task = task
+        try:
+            return super()._execute(task, timestamp)
+        finally:
+            self._executing.task = previous
+
+    def put_result(self, key, data):
+        task = getattr(self._executing, 'task', None)
+        if task is not None and task.id == key:
+            return self._put_task_result(self.storage, task, data)
+        return super().put_result(key, data)
+
+    def _put_task_result(self, storage, task: Task, value):
+        """
+        Stores the result according to the result options of the task:
+        store_result=False skips the result but still stores errors, result_ttl stores it in its own key which
+        expires after the given seconds, result_max_size replaces larger results by a ResultTooLargeError and
+        result_codec selects a compact encoding. Errors are always encoded with the serializer of the huey instance.
+        """
+        if not getattr(task, 'store_result', True) and not isinstance(value, Error):
+            return
+        if isinstance(value, Error):
+            data = self.serializer.serialize(value)
+        else:
+            data = self.serializer.serialize(value, getattr(task, 'result_codec', RESULT_CODEC_PICKLE))
+        max_size = getattr(task, 'result_max_size', None)
+        if max_size and len(data) > max_size:
+            logger.warning('Result of %s has %s bytes, result_max_size is %s.', task.id, len(data), max_size)
+            exception = ResultTooLargeError(f'Result has {len(data)} bytes, result_max_size is {max_size}.')
+            data = self.serializer.serialize(Error(self.build_error_result(task, exception)))
+        ttl = getattr(task, 'result_ttl', None)
+        with self.profile_phase(PHASE_RESULT):
+            if ttl and isinstance(self.storage, RedisStorage):
+                storage.conn.setex(self.ttl_result_key(task.id), ttl, data)
+            else:
+                storage.put_data(task.id, data, is_result=True)
+
+    def ttl_result_key(self, key):
+        """ Redis key of a result with result_ttl. The expire storage keeps all results in such keys. """
+        if isinstance(self.storage, RedisExpireStorage):
+            return self.storage.result_key(key)
+        return f'huey.r.{self.storage.name}.{key}'
+
+    def get_raw(self, key, peek=False):
+        """ Reads the result store and the keys of results with result_ttl in one round trip. """
+        if not isinstance(self.storage, RedisStorage) or isinstance(self.storage, RedisExpireStorage):
+            return super().get_raw(key, peek)
+        pipe = self.storage.conn.pipeline()
+        self._queue_raw_reads(pipe, key, peek)
+        return self._raw_value(pipe.execute())
+
+    def _queue_raw_reads(self, pipe, key, peek):
+        """ Same as RedisStorage.peek_data / pop_data. The expire storage never pops results. """
+        redis_key, field = self._data_location(key)
+        if field:
+            pipe.hexists(redis_key, field)
+            pipe.hget(redis_key, field)
+            pipe.get(self.ttl_result_key(key))
+            if not peek:
+                pipe.hdel(redis_key, field)
+                pipe.delete(self.ttl_result_key(key))
+        else:
+            pipe.exists(redis_key)
+            pipe.get(redis_key)
+
+    @staticmethod
+    def _raw_value(results):
+        exists, value, *rest = results
+        if exists:
+            return value
+        return rest[0] if rest and rest[0] is not None else EmptyData
+
+    def periodic_task(self, validate_datetime, *args, **kwargs):
+        """ Keeps the schedule on the task class for the next fire times of the HueyxScheduler. """
+        return super().periodic_task(validate_datetime, *args, periodic_schedule=staticmethod(validate_datetime),
+                                     **kwargs)
+
     def db_periodic_task(self, *args, **kwargs):
         def decorator(fn):
             return self.periodic_task(*args, **kwargs)(close_db(fn, self))
@@ -44,31 +886,163 @@ class BaseHueyx(HueyOriginal):
 
     @staticmethod
     def get_heartbeat_observation_key(task_id):
+        """Legacy (hueyx <= 1.0.3) result store key of a heartbeat observation."""
         return f'hb:{task_id}'
 
     @staticmethod
     def get_heartbeat_timestamp_key(task_id):
+        """Legacy (hueyx <= 1.0.3) result store key of a heartbeat timestamp."""
         return f'hbts:{task_id}'
 
+    @property
+    def heartbeat_index_key(self):
+        """Sorted set of the observed task ids scored by their heartbeat deadline (unix timestamp in seconds)."""
+        return f'huey.heartbeats.{self.storage.name}'
+
+    @property
+    def heartbeat_observations_key(self):
+        """Hash of the observed task ids and the data to restart them."""
+        return f'huey.heartbeat_observations.{self.storage.name}'
+
+    def start_heartbeat_observation(self, task_id, observation, deadline: int):
+        pipe = self.storage.conn.pipeline()
+        pipe.hset(self.heartbeat_observations_key, task_id, self.serializer.serialize(observation))
+        pipe.zadd(self.heartbeat_index_key, {task_id: deadline})
+        pipe.execute()
+
+    def stop_heartbeat_observation(self, task_id):
+        pipe = self.storage.conn.pipeline()
+        pipe.hdel(self.heartbeat_observations_key, task_id)
+        pipe.zrem(self.heartbeat_index_key, task_id)
+        pipe.execute()
+
+    def set_heartbeat_deadline(self, task_id, deadline: int):
+        self.storage.conn.zadd(self.heartbeat_index_key, {task_id: deadline}, xx=True)
+
+    def get_heartbeat_deadline(self, task_id):
+        deadline = self.storage.conn.zscore(self.heartbeat_index_key, task_id)
+        return int(deadline) if deadline is not None else None
+
+    def delete_heartbeat_deadline(self, task_id):
+        self.storage.conn.zrem(self.heartbeat_index_key, task_id)
+
+    def check_heartbeat(self, task: Task, heartbeat_timeout: int, now: int):
+        """
+        Reads the revoke data of the task and its heartbeat deadline in a single round trip.
+        The deadline is refreshed if no revoke data exists and HEARTBEAT_UPDATE_INTERVAL has passed.
+        :return: Tuple of the serialized revoke data found and the deadline (None if not observed).
+        """
+        revoke_keys = (task.revoke_id, self._task_key(type(task), 'rt'))
+        locations = [self._data_location(key) for key in revoke_keys]
+        script = self.storage.conn.register_script(HEARTBEAT_CHECK_LUA)
+        result = script(keys=[self.heartbeat_index_key] + [key for key, _ in locations],
+                        args=[task.id, now, self.HEARTBEAT_UPDATE_INTERVAL, heartbeat_timeout] +
+                             [field for _, field in locations])
+        *revoke_data, deadline = result
+        return [data for data in revoke_data if data], int(deadline) if deadline else None
+
+    def _data_location(self, key):
+        """ Redis key and hash field ('' for plain keys) where the storage keeps the data of the given key. """
+        if isinstance(self.storage, RedisExpireStorage):
+            return self.storage.result_key(key), ''
+        return self.storage.result_key, key
+
     def get_dead_tasks(self) -> List[DeadTask]:
+        conn = self.storage.conn
+        task_ids = conn.zrangebyscore(self.heartbeat_index_key, '-inf', timezone.now().timestamp())
+        if not task_ids:
+            return []
         dead_tasks = []
+        for task_id, observation in zip(task_ids, conn.hmget(self.heartbeat_observations_key, task_ids)):
+            if observation is None:     # observation has been stopped in the meantime
+                continue
+            name, task_settings, heartbeat_timeout = self.serializer.deserialize(observation)
+            dead_tasks.append(self.DeadTask(task_id.decode(), name, task_settings))
+        return dead_tasks
+
+    def restart_dead_tasks(self, batch_size=100) -> int:
+        """ Restarts the dead tasks in batches. Every batch is sent to redis in a single pipeline. """
+        dead_tasks = self.get_dead_tasks()
+        for i in range(0, len(dead_tasks), batch_size):
+            self._restart_dead_tasks(dead_tasks[i:i + batch_size])
+        return len(dead_tasks)
+
+    def _restart_dead_tasks(self, dead_tasks: List[DeadTask]):
+        pipe = self.storage.conn.pipeline()
+        storage = self._pipelined_storage(pipe)
+        tasks = []
+        for dead_task in dead_tasks:
+            task_type = self._registry.string_to_task(dead_task.name)
+            storage.put_data(Task(id=dead_task.id).revoke_id, self.serializer.serialize((None, False)))
+            pipe.hdel(self.heartbeat_observations_key, dead_task.id)
+            pipe.zrem(self.heartbeat_index_key, dead_task.id)
+            task = task_type(**dead_task.settings)
+            if task.expires:
+                task.resolve_expires(self.utc)
+            self._storage_enqueue(storage, task, self.serialize_task(task))
+            tasks.append(task)
+        pipe.execute()
+        for task in tasks:
+            self._emit(S.SIGNAL_ENQUEUED, task)
+
+    def _pipelined_storage(self, pipe):
+        """ Copy of the storage which queues its write commands on the given pipeline. """
+        storage = copy(self.storage)
+        storage.conn = pipe
+        return storage
+
+    def migrate_heartbeat_observations(self) -> int:
+        """
+        Moves heartbeat observations written by hueyx <= 1.0.3 from the result store into the heartbeat index.
+        Scans the whole result store once. Returns the number of migrated observations.
+        """
+        migrated = 0
         observation_key_prefix = self.get_heartbeat_observation_key('')
         for result in self.storage.conn.hscan_iter(self.storage.result_key, match=observation_key_prefix + '*'):
             key = result[0].decode()
             task_id = key[len(observation_key_prefix):]
-            name, task_settings, heartbeat_timeout = self.get(key, peek=True)
-            timestamp = self.get(self.get_heartbeat_timestamp_key(task_id), peek=True)
-            if not timestamp or timestamp + timedelta(seconds=heartbeat_timeout) <= timezone.now():
-                dead_tasks.append(self.DeadTask(task_id, name, task_settings))
-        return dead_tasks
+            observation = self.get(key)
+            timestamp = self.get(self.get_heartbeat_timestamp_key(task_id))
+            if observation is None:
+                continue
+            heartbeat_timeout = observation[2]
+            deadline = int((timestamp + timedelta(seconds=heartbeat_timeout)).timestamp()) if timestamp else 0
+            self.start_heartbeat_observation(task_id, observation, deadline)
+            migrated += 1
+        return migrated
+
+
+class HueyxTaskWrapper(TaskWrapper):
 
-    def restart_dead_tasks(self):
-        for task in self.get_dead_tasks():
-            task_type = self._registry.string_to_task(task.name)
-            self.revoke_by_id(task.id)
-            self.get(self.get_heartbeat_observation_key(task.id))
-            task = task_type(**task.settings)
-            self.enqueue(task)
+    def create_task(self, func, *args, **kwargs):
+        task_class = super().create_task(func, *args, **kwargs)
+        task_class.is_async = asyncio.iscoroutinefunction(func)
+        if getattr(task_class, 'rate_limit', None):
+            parse_rate_limit(task_class.rate_limit)
+        if isinstance(getattr(task_class, 'fair_key_arg', None), str):
+            task_class.fair_key_position = _argument_position(func, task_class.fair_key_arg)
+        return task_class
+
+    async def aenqueue(self, *args, **kwargs):
+        """ Enqueues the task with redis.asyncio: await my_task.aenqueue(1, 2) """
+        return await self.huey.aenqueue(self.s(*args, **kwargs))
+
+    def map(self, it, chunk_size=1000):
+        """ Enqueues a task for every item with pipelined writes. See BaseHueyx.enqueue_many. """
+        return self.huey.enqueue_many(self._apply(it), chunk_size)
+
+
+def _check_batch_call(task: Task):
+    """ db_batch_task passes the positional arguments of the calls only. """
+    if getattr(task, 'batch_size', None) and task.kwargs:
+        raise TypeError(f'{task.name} is a db_batch_task, keyword arguments are not supported.')
+
+
+def _argument_position(func, name: str) -> Optional[int]:
+    """ Position of the argument name in the signature of the (wrapped) function, None if it is keyword-only. """
+    positional = [parameter.name for parameter in inspect.signature(func).parameters.values()
+                  if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)]
+    return positional.index(name) if name in positional else None
 
 
 class RedisHuey(BaseHueyx):
@@ -91,28 +1065,88 @@ class PriorityRedisExpireHuey(BaseHueyx):
         super().__init__(*args, storage_class=PriorityRedisExpireStorage, **kwargs)
 
 
+class FairPriorityRedisHuey(BaseHueyx):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, storage_class=FairPriorityRedisStorage, **kwargs)
+
+
+class FairPriorityRedisExpireHuey(BaseHueyx):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, storage_class=FairPriorityRedisExpireStorage, **kwargs)
+
+
 def close_db(fn, huey: BaseHueyx):
     """Decorator to be used with tasks that may operate on the database."""
+    if asyncio.iscoroutinefunction(fn):
+        return _async_close_db(fn, huey)
 
     @wraps(fn)
     def inner(*args, **kwargs):
+        lifecycle = huey.db_connection_lifecycle
+        if lifecycle is not None and not huey.immediate:
+            with huey.profile_phase(PHASE_DB_CONNECTIONS):
+                lifecycle.before_task()
+            try:
+                with huey.profile_task_phase():
+                    result = fn(*args, **kwargs)
+            except Exception:
+                with huey.profile_phase(PHASE_DB_CONNECTIONS):
+                    lifecycle.after_task(error=True)
+                raise
+            with huey.profile_phase(PHASE_DB_CONNECTIONS):
+                lifecycle.after_task()
+            return result
+
+        try:
+            with huey.profile_task_phase():
+                return fn(*args, **kwargs)
+        finally:
+            if not huey.immediate:
+                with huey.profile_phase(PHASE_DB_CONNECTIONS):
+                    close_old_connections()
+
+    return inner
+
+
+def _async_close_db(fn, huey: BaseHueyx):
+    """ Django connections are closed in the thread in which sync_to_async runs the ORM. """
+
+    @wraps(fn)
+    async def inner(*args, **kwargs):
+        lifecycle = huey.db_connection_lifecycle
+        if lifecycle is not None and not huey.immediate:
+            await sync_to_async(lifecycle.before_task)()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception:
+                await sync_to_async(lifecycle.after_task)(error=True)
+                raise
+            await sync_to_async(lifecycle.after_task)()
+            return result
+
         try:
-            return fn(*args, **kwargs)
+            return await fn(*args, **kwargs)
         finally:
             if not huey.immediate:
-                close_old_connections()
+                await sync_to_async(close_old_connections)()
 
     return inner
 
 
-def _wrap_heartbeat(fn, huey: BaseHueyx, heartbeat_timeout: int):
+def _wrap_heartbeat(fn, huey: BaseHueyx, heartbeat_timeout: int, background=False):
+    if asyncio.iscoroutinefunction(fn):
+        return _wrap_async_heartbeat(fn, huey, heartbeat_timeout)
+
     # noinspection PyProtectedMember
     @wraps(fn)
     def inner(*args, **kwargs):
         task: Task = kwargs.pop('task')
-        heartbeat = Heartbeat(huey, task, heartbeat_timeout)
-        heartbeat._start_heartbeat_observation()
-        heartbeat._set_timestamp()
+        heartbeat_class = ImmediateHeartbeat if huey.immediate else Heartbeat
+        heartbeat = heartbeat_class(huey, task, heartbeat_timeout, background)
+        with huey.profile_phase(PHASE_HEARTBEAT):
+            heartbeat._start_heartbeat_observation()
+        if background:
+            heartbeat._start_background_heartbeat()
         result = None
         try:
             result = fn(*args, heartbeat=heartbeat, **kwargs)
@@ -121,10 +1155,46 @@ def _wrap_heartbeat(fn, huey: BaseHueyx, heartbeat_timeout: int):
         except RevokedError:    # stop heartbeat observation because task has been revoked
             pass
         except Exception as e:  # stop heartbeat observation and reraise exception
+            with huey.profile_phase(PHASE_HEARTBEAT):
+                heartbeat._stop_heartbeat_observation()
+            raise e
+        finally:
+            if background:
+                heartbeat._stop_background_heartbeat()
+
+        with huey.profile_phase(PHASE_HEARTBEAT):
             heartbeat._stop_heartbeat_observation()
+        return result
+
+    assert heartbeat_timeout >= 120, 'Minimal heartbeat_timeout is 120 seconds.'
+    return inner
+
+
+def _wrap_async_heartbeat(fn, huey: BaseHueyx, heartbeat_timeout: int):
+    """ Same as _wrap_heartbeat for async functions. The heartbeats are always sent in the background. """
+    # noinspection PyProtectedMember
+    @wraps(fn)
+    async def inner(*args, **kwargs):
+        task: Task = kwargs.pop('task')
+        heartbeat = ImmediateHeartbeat(huey, task, heartbeat_timeout) if huey.immediate else \
+            AsyncHeartbeat(huey, task, heartbeat_timeout)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, heartbeat._start_heartbeat_observation)
+        heartbeat._start_background_heartbeat()
+        result = None
+        try:
+            result = await fn(*args, heartbeat=heartbeat, **kwargs)
+        except HeartbeatTimeoutError:   # do not stop heartbeat observation -> task needs to be restarted
+            return
+        except RevokedError:    # stop heartbeat observation because task has been revoked
+            pass
+        except Exception as e:  # stop heartbeat observation and reraise exception
+            await loop.run_in_executor(None, heartbeat._stop_heartbeat_observation)
             raise e
+        finally:
+            heartbeat._stop_background_heartbeat()
 
-        heartbeat._stop_heartbeat_observation()
+        await loop.run_in_executor(None, heartbeat._stop_heartbeat_observation)
         return result
 
     assert heartbeat_timeout >= 120, 'Minimal heartbeat_timeout is 120 seconds.'
@@ -139,15 +1209,23 @@ class HeartbeatTimeoutError(Exception):
     pass
 
 
+class ResultTooLargeError(Exception):
+    pass
+
+
 class Heartbeat:
 
     CHECK_INTERVAL = timedelta(seconds=5)   # check timestamp just every 5 seconds -> otherwise redis can get heady load
 
-    def __init__(self, huey: BaseHueyx, task: Task, heartbeat_timeout: int):
+    def __init__(self, huey: BaseHueyx, task: Task, heartbeat_timeout: int, background=False):
         self._huey = huey
         self.task = task
         self.heartbeat_timeout = heartbeat_timeout
         self.next_check = None
+        self.background = background
+        self._background_error = None
+        self._background_stopped = threading.Event()
+        self._background_thread = None
 
     @contextmanager
     def long_running_operation(self, delta: timedelta):
@@ -156,6 +1234,10 @@ class Heartbeat:
         self._set_timestamp()
 
     def __call__(self):
+        if self.background:     # the background thread talks to redis -> just check its outcome
+            if self._background_error:
+                raise self._background_error
+            return
         if not self.next_check or self.next_check < timezone.now():
             self._check_timestamp()
             self.next_check = timezone.now() + self.CHECK_INTERVAL
@@ -164,20 +1246,46 @@ class Heartbeat:
         """
         - Check if task has not been revoked -> RevokedError
         - Check if timestamp has not been expired -> HeartbeatTimeoutError
-        Set new timestamp if checks are true
+        Set new timestamp if checks are true. The checks and the update take a single round trip to redis.
         """
-        if self._huey.is_revoked(self.task):
+        now = int(timezone.now().timestamp())
+        revoke_data, deadline = self._huey.check_heartbeat(self.task, self.heartbeat_timeout, now)
+        if revoke_data and self._is_revoked(revoke_data):
             self._delete_timestamp()
             raise RevokedError()
-        else:
-            timestamp = self._get_timestamp()
-            if not timestamp:
-                raise HeartbeatTimeoutError()
-            now = timezone.now()
-            if timestamp + timedelta(seconds=self._huey.HEARTBEAT_UPDATE_INTERVAL) <= now:
-                if timestamp + timedelta(seconds=self.heartbeat_timeout) <= now:
-                    raise HeartbeatTimeoutError()
-                self._set_timestamp()
+        if not deadline or deadline <= now:
+            raise HeartbeatTimeoutError()
+        if revoke_data and deadline - self.heartbeat_timeout + self._huey.HEARTBEAT_UPDATE_INTERVAL <= now:
+            self._set_timestamp()   # revoke data has expired -> redis did not refresh the timestamp
+
+    def _start_background_heartbeat(self):
+        self._background_thread = threading.Thread(
+            target=self._run_background_heartbeat, name=f'Heartbeat-{self.task.id}', daemon=True)
+        self._background_thread.start()
+
+    def _stop_background_heartbeat(self):
+        self._background_stopped.set()
+        self._background_thread.join()
+
+    def _run_background_heartbeat(self):
+        """ Sends heartbeats until stopped. Revocation and timeouts are passed to the task with the next call. """
+        while not self._background_stopped.wait(self.CHECK_INTERVAL.total_seconds()):
+            try:
+                self._check_timestamp()
+            except (RevokedError, HeartbeatTimeoutError) as e:
+                self._background_error = e
+                return
+            except Exception:
+                logger.exception(f'Background heartbeat of task {self.task.id} failed.')
+
+    def _is_revoked(self, revoke_data):
+        """ Same rules as Huey.is_revoked (without restoring) applied to the serialized revoke data. """
+        timestamp = self._huey._get_timestamp()
+        for data in revoke_data:
+            revoke_until, revoke_once = self._huey.serializer.deserialize(data)
+            if revoke_once or revoke_until is None or revoke_until > timestamp:
+                return True
+        return False
 
     def _start_heartbeat_observation(self):
         """ Start heartbeat observation and save data to restart task if necessary. """
@@ -188,17 +1296,74 @@ class Heartbeat:
         task_settings = dict(on_complete=self.task.on_complete,
                              retries=self.task.retries, retry_delay=self.task.retry_delay, args=args, kwargs=kwargs)
         task_name = self.task.__module__ + '.' + self.task.name
-        self._huey.put(self._huey.get_heartbeat_observation_key(self.task.id),
-                       (task_name, task_settings, self.heartbeat_timeout))
+        self._huey.start_heartbeat_observation(self.task.id, (task_name, task_settings, self.heartbeat_timeout),
+                                               self._deadline(timezone.now()))
 
     def _stop_heartbeat_observation(self):
-        self._huey.get(self._huey.get_heartbeat_observation_key(self.task.id))
+        self._huey.stop_heartbeat_observation(self.task.id)
 
     def _set_timestamp(self, delta=timedelta()):
-        self._huey.put(self._huey.get_heartbeat_timestamp_key(self.task.id), timezone.now() + delta)
+        self._huey.set_heartbeat_deadline(self.task.id, self._deadline(timezone.now() + delta))
 
     def _get_timestamp(self):
-        return self._huey.get(self._huey.get_heartbeat_timestamp_key(self.task.id), peek=True)
+        deadline = self._huey.get_heartbeat_deadline(self.task.id)
+        if deadline is None:
+            return None
+        return datetime.fromtimestamp(deadline, tz=dt_timezone.utc) - timedelta(seconds=self.heartbeat_timeout)
 
     def _delete_timestamp(self):
-        return self._huey.get(self._huey.get_heartbeat_timestamp_key(self.task.id), peek=False)
+        self._huey.delete_heartbeat_deadline(self.task.id)
+
+    def _deadline(self, timestamp: datetime) -> int:
+        return int((timestamp + timedelta(seconds=self.heartbeat_timeout)).timestamp())
+
+
+class AsyncHeartbeat(Heartbeat):
+    """
+    Heartbeat of async tasks. An asyncio task checks the heartbeat in the background and calls redis in the
+    executor of the loop, so neither the loop is blocked nor a thread per task is needed.
+    """
+
+    def __init__(self, huey: BaseHueyx, task: Task, heartbeat_timeout: int, background=True):
+        super().__init__(huey, task, heartbeat_timeout, background=True)
+        self._background_task = None
+
+    def _start_background_heartbeat(self):
+        self._background_task = asyncio.ensure_future(self._run_async_heartbeat())
+
+    def _stop_background_heartbeat(self):
+        self._background_task.cancel()
+
+    async def _run_async_heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.CHECK_INTERVAL.total_seconds())
+            try:
+                await loop.run_in_executor(None, self._check_timestamp)
+            except (RevokedError, HeartbeatTimeoutError) as e:
+                self._background_error = e
+                return
+            except Exception:
+                logger.exception(f'Background heartbeat of task {self.task.id} failed.')
+
+
+class ImmediateHeartbeat(Heartbeat):
+    """ Heartbeat for tasks executed in immediate mode. No consumer restarts them -> nothing to observe. """
+
+    def __call__(self):
+        pass
+
+    def _start_heartbeat_observation(self):
+        pass
+
+    def _stop_heartbeat_observation(self):
+        pass
+
+    def _set_timestamp(self, delta=timedelta()):
+        pass
+
+    def _start_background_heartbeat(self):
+        pass
+
+    def _stop_background_heartbeat(self):
+        pass
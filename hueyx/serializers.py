@@ -0,0 +1,43 @@
+import pickle
+import zlib
+
+RESULT_CODEC_PICKLE = 'pickle'
+RESULT_CODEC_ZLIB = 'zlib'
+RESULT_CODEC_MSGPACK = 'msgpack'
+
+# Compact results start with a tag. Results of the huey serializer never start with a null byte
+# (pickle starts with its protocol opcode, gzip and zlib with their magic bytes).
+CODEC_TAGS = {RESULT_CODEC_ZLIB: b'\x00z', RESULT_CODEC_MSGPACK: b'\x00m'}
+
+
+class ResultSerializer:
+    """
+    Wraps the serializer of the huey instance. Results can be encoded with a compact codec per task
+    (result_codec='zlib' for compressed pickle or 'msgpack' which needs the msgpack package).
+    Tagged results are decoded by every reader, all other data is passed to the wrapped serializer.
+    """
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def __getattr__(self, name):
+        if name == 'serializer':
+            raise AttributeError(name)
+        return getattr(self.serializer, name)
+
+    def serialize(self, data, codec=RESULT_CODEC_PICKLE):
+        if codec == RESULT_CODEC_ZLIB:
+            return CODEC_TAGS[codec] + zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        if codec == RESULT_CODEC_MSGPACK:
+            import msgpack
+            return CODEC_TAGS[codec] + msgpack.packb(data, use_bin_type=True)
+        assert codec == RESULT_CODEC_PICKLE, f'Unknown result_codec: {codec}'
+        return self.serializer.serialize(data)
+
+    def deserialize(self, data):
+        if data[:2] == CODEC_TAGS[RESULT_CODEC_ZLIB]:
+            return pickle.loads(zlib.decompress(data[2:]))
+        if data[:2] == CODEC_TAGS[RESULT_CODEC_MSGPACK]:
+            import msgpack
+            return msgpack.unpackb(data[2:], raw=False)
+        return self.serializer.deserialize(data)
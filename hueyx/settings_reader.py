@@ -1,26 +1,65 @@
-import json
 import os
+import threading
 from importlib import import_module
-from typing import Dict
+from typing import Dict, List
 
-from cached_property import cached_property
+from cached_property import threaded_cached_property
 from django.conf import settings
 from huey.storage import RedisStorage
 from redis import ConnectionPool
 
 from .redis_huey import RedisHuey
+from .signals import SignalPublisher, SignalStreamPublisher, SignalMetrics, DROP_NEWEST, DEFAULT_BUCKETS, \
+    MODE_PUBSUB, MODE_METRICS, MODE_STREAM, SIGNAL_ENQUEUED_MANY
 
 
 class HueyxException(Exception):
     pass
 
 
+class ConnectionPools:
+    """
+    Shares one ConnectionPool between the queues with the same connection parameters (including the db).
+    """
+
+    def __init__(self):
+        self._pools: Dict[tuple, ConnectionPool] = {}
+        self._queues: Dict[tuple, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, queue_name: str, connection: Dict) -> ConnectionPool:
+        key = tuple(sorted((name, repr(value)) for name, value in connection.items()))
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(**connection)
+                self._queues[key] = []
+            if queue_name not in self._queues[key]:
+                self._queues[key].append(queue_name)
+            return self._pools[key]
+
+    def stats(self) -> List[Dict]:
+        """ Queues and connection counts per pool. """
+        with self._lock:
+            pools = [(self._pools[key], list(self._queues[key])) for key in self._pools]
+        return [dict(
+            queues=queues,
+            host=pool.connection_kwargs.get('host'),
+            port=pool.connection_kwargs.get('port'),
+            db=pool.connection_kwargs.get('db', 0),
+            max_connections=pool.max_connections,
+            created_connections=pool._created_connections,
+            in_use_connections=len(pool._in_use_connections),
+            available_connections=len(pool._available_connections),
+        ) for pool, queues in pools]
+
+
 class SingleConfigReader:
     default_hueyx_path = 'hueyx.redis_huey'
 
-    def __init__(self, name: str, config: Dict):
+    def __init__(self, name: str, config: Dict, connection_pools: ConnectionPools = None):
         self.name = name
         self.config = config
+        self.connection_pools = connection_pools
         self._is_prometheus_initialized = False
 
     @property
@@ -31,7 +70,7 @@ class SingleConfigReader:
             raise HueyxException('No consumer configured.')
         return self.config['consumer']
 
-    @cached_property
+    @threaded_cached_property
     def connection_pool(self) -> ConnectionPool:
         if 'connection' not in self.config:
             raise HueyxException('No connection configured.')
@@ -39,6 +78,8 @@ class SingleConfigReader:
         connection = self.config['connection']
         if 'connection_pool' in connection:
             return connection['connection_pool']
+        elif self.connection_pools is not None:
+            return self.connection_pools.get(self.name, connection)
         else:
             return ConnectionPool(**connection)
 
@@ -51,7 +92,7 @@ class SingleConfigReader:
         config.pop('name', {})
         return config
 
-    @cached_property
+    @threaded_cached_property
     def huey_instance(self):
         huey_config = self.huey_options
         backend_path = huey_config.pop('huey_class', 'huey.RedisHuey')
@@ -68,7 +109,7 @@ class SingleConfigReader:
             msg = f'Not supported Huey class: {backend_path}'
             raise HueyxException(msg)
 
-    @cached_property
+    @threaded_cached_property
     def redis(self):
         return self.huey_instance.storage.conn
 
@@ -79,6 +120,10 @@ class SingleConfigReader:
 
         return settings.HUEYX_SIGNALS['environment']
 
+    @property
+    def signals_options(self):
+        return getattr(settings, 'HUEYX_SIGNALS', {})
+
     @property
     def is_signals_enabled(self):
         if not hasattr(settings, 'HUEYX_SIGNALS'):
@@ -87,10 +132,45 @@ class SingleConfigReader:
             return False
         return settings.HUEYX_SIGNALS['enabled']
 
+    @threaded_cached_property
+    def signal_publisher(self) -> SignalPublisher:
+        options = self.signals_options
+        buffer_options = dict(
+            batch_size=options.get('batch_size', 100),
+            flush_interval=options.get('flush_interval', 1.0),
+            buffer_size=options.get('buffer_size', 10000),
+            drop_policy=options.get('drop_policy', DROP_NEWEST),
+        )
+        if options.get('mode', MODE_PUBSUB) == MODE_STREAM:
+            publisher = SignalStreamPublisher(self.redis, 'hueyx.huey2.signals',
+                                              maxlen=options.get('stream_maxlen', 100000), **buffer_options)
+        else:
+            publisher = SignalPublisher(self.redis, 'hueyx.huey2.signaling', **buffer_options)
+        self.huey_instance.on_shutdown('hueyx_signals')(publisher.flush)
+        return publisher
+
+    @threaded_cached_property
+    def signal_metrics(self) -> SignalMetrics:
+        options = self.signals_options
+        metrics = SignalMetrics(
+            self.redis, f'hueyx.huey2.metrics.{self.environment}.{self.huey_instance.name}',
+            flush_interval=options.get('metrics_interval', 10.0),
+            buckets=options.get('histogram_buckets', DEFAULT_BUCKETS),
+        )
+        self.huey_instance.on_shutdown('hueyx_metrics')(metrics.flush)
+        return metrics
+
     def _connect_signals_to_redis(self, huey: RedisHuey):
-        huey._signal.connect(self._on_signal_received)
+        if self.signals_options.get('mode', MODE_PUBSUB) == MODE_METRICS:
+            huey._signal.connect(self._on_signal_aggregated)
+        else:
+            huey._signal.connect(self._on_signal_received)
 
-    def _on_signal_received(self, signal, task, exc=None):
+    def _on_signal_aggregated(self, signal, task, *args):
+        count = args[0] if signal == SIGNAL_ENQUEUED_MANY else 1
+        self.signal_metrics.record(signal, task, count)
+
+    def _on_signal_received(self, signal, task, *args):
         queue = self.huey_instance.name
         pid = os.getpid()
         data = {
@@ -100,17 +180,37 @@ class SingleConfigReader:
             'signal': signal,
             'task': task.name
         }
-        self.redis.publish('hueyx.huey2.signaling', json.dumps(data))
+        if signal == SIGNAL_ENQUEUED_MANY:
+            data['count'] = args[0]
+        self.signal_publisher.publish(data)
 
 
 class DjangoSettingsReader:
+    """
+    Reads the HUEYX settings on first use. The huey instance and connection pool of a queue are created
+    when the queue is used for the first time.
+    """
+
     def __init__(self):
-        self.configurations: Dict[str, SingleConfigReader] = {}
+        self._configurations: Dict[str, SingleConfigReader] = {}
+        self.connection_pools = ConnectionPools()
+        self._interpreted = False
+        self._lock = threading.Lock()
 
-    def interpret_settings(self):
-        if not hasattr(settings, 'HUEYX'):
-            raise HueyxException('No HUEYX config found in settings')
+    @property
+    def configurations(self) -> Dict[str, SingleConfigReader]:
+        if not self._interpreted:
+            self.interpret_settings()
+        return self._configurations
 
-        for name, values in settings.HUEYX.items():
-            reader = SingleConfigReader(name, values)
-            self.configurations[name] = reader
+    def interpret_settings(self):
+        with self._lock:
+            if self._interpreted:
+                return
+            if not hasattr(settings, 'HUEYX'):
+                raise HueyxException('No HUEYX config found in settings')
+
+            for name, values in settings.HUEYX.items():
+                reader = SingleConfigReader(name, values, self.connection_pools)
+                self._configurations[name] = reader
+            self._interpreted = True
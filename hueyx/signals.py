@@ -0,0 +1,309 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from huey import signals as S
+from redis import Redis, ResponseError
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = 'newest'
+DROP_OLDEST = 'oldest'
+
+# Sent once per task type and chunk by BaseHueyx.enqueue_many with the number of enqueued tasks.
+SIGNAL_ENQUEUED_MANY = 'enqueued_many'
+# Sent by BaseHueyx.enqueue if a pending task with the same unique key absorbed the task.
+SIGNAL_COALESCED = 'coalesced'
+# Sent by BaseHueyx.execute if the rate_limit of the task deferred it to the schedule.
+SIGNAL_RATE_LIMITED = 'rate_limited'
+
+MODE_PUBSUB = 'pubsub'
+MODE_METRICS = 'metrics'
+MODE_STREAM = 'stream'
+
+# Compact field names of the signals in the stream
+STREAM_FIELDS = {'environment': 'e', 'queue': 'q', 'pid': 'p', 'signal': 's', 'task': 't', 'count': 'c'}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+FINISHED_SIGNALS = (S.SIGNAL_COMPLETE, S.SIGNAL_ERROR, S.SIGNAL_CANCELED, S.SIGNAL_INTERRUPTED, S.SIGNAL_LOCKED)
+
+
+class BackgroundReporter:
+    """
+    Base class for reporters which send to redis from a background thread.
+    Every process needs its own thread and state, e.g. process workers are forked after the setup.
+    """
+    thread_name = 'hueyx-reporter'
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def flush(self):
+        raise NotImplementedError
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._reset()
+            thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.flush)
+
+    def _reset(self):
+        """ Initializes the process local state. """
+        pass
+
+    def _run(self):
+        raise NotImplementedError
+
+
+class SignalPublisher(BackgroundReporter):
+    """
+    Publishes huey signals to the redis pubsub from a background thread.
+    The signals are buffered in a bounded queue and sent in pipelined batches, so redis latency
+    or outages never block the task execution. If the buffer is full, signals are dropped according to drop_policy.
+    """
+    thread_name = 'hueyx-signals'
+
+    def __init__(self, redis: Redis, channel: str, batch_size=100, flush_interval=1.0, buffer_size=10000,
+                 drop_policy=DROP_NEWEST):
+        assert drop_policy in (DROP_NEWEST, DROP_OLDEST), f'Unknown drop_policy: {drop_policy}'
+        super().__init__(redis)
+        self.channel = channel
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._queue = None
+
+    def publish(self, data: Dict):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+            if self.drop_policy == DROP_OLDEST:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.put_nowait(data)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def flush(self):
+        """ Sends all buffered signals synchronously. """
+        if self._pid != os.getpid():
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._send(batch)
+                batch = []
+        if batch:
+            self._send(batch)
+
+    def _reset(self):
+        self._queue = queue.Queue(maxsize=self.buffer_size)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            flush_at = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = flush_at - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch: List[Dict]):
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for data in batch:
+                self._add_to_pipeline(pipe, data)
+            pipe.execute()
+        except Exception:
+            self.dropped += len(batch)
+            logger.exception(f'Could not publish {len(batch)} signals.')
+
+    def _add_to_pipeline(self, pipe, data: Dict):
+        pipe.publish(self.channel, json.dumps(data))
+
+
+class SignalStreamPublisher(SignalPublisher):
+    """
+    Appends the signals to a redis stream instead of the pubsub. The stream is trimmed to approximately maxlen
+    entries. Consumers read the signals in batches and without losses through consumer groups (SignalStreamReader).
+    """
+    thread_name = 'hueyx-signal-stream'
+
+    def __init__(self, redis: Redis, stream: str, maxlen=100000, **kwargs):
+        super().__init__(redis, stream, **kwargs)
+        self.maxlen = maxlen
+
+    def _add_to_pipeline(self, pipe, data: Dict):
+        fields = {STREAM_FIELDS[name]: value for name, value in data.items()}
+        pipe.xadd(self.channel, fields, maxlen=self.maxlen, approximate=True)
+
+
+class SignalStreamReader:
+    """
+    Reads the signals of a SignalStreamPublisher within a consumer group.
+    Read signals need to be acknowledged. Not acknowledged signals are delivered again with pending=True.
+    """
+
+    def __init__(self, redis: Redis, stream: str, group: str, consumer: str):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self._group_created = False
+
+    def read(self, count=100, block=1000, pending=False) -> List[Tuple[bytes, Dict]]:
+        """
+        :param pending: Read the signals which have been delivered to this consumer but not acknowledged.
+        :return: List of stream ids and decoded signals.
+        """
+        self._create_group()
+        response = self.redis.xreadgroup(self.group, self.consumer, {self.stream: '0' if pending else '>'},
+                                         count=count, block=None if pending else block)
+        if not response:
+            return []
+        _, entries = response[0]
+        return [(entry_id, decode_stream_signal(fields)) for entry_id, fields in entries if fields]
+
+    def ack(self, *entry_ids):
+        if entry_ids:
+            self.redis.xack(self.stream, self.group, *entry_ids)
+
+    def _create_group(self):
+        if self._group_created:
+            return
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_created = True
+
+
+def decode_stream_signal(fields: Dict) -> Dict:
+    names = {short: name for name, short in STREAM_FIELDS.items()}
+    signal = {names[key.decode()]: value.decode() for key, value in fields.items()}
+    signal['pid'] = int(signal['pid'])
+    if 'count' in signal:
+        signal['count'] = int(signal['count'])
+    return signal
+
+
+class SignalMetrics(BackgroundReporter):
+    """
+    Aggregates huey signals in the process instead of publishing every single signal.
+    Counts per task and signal and a histogram of the execution time (executing -> complete) per task
+    are added periodically to a redis hash, which is shared by all processes of the queue. See read_metrics.
+    """
+    thread_name = 'hueyx-metrics'
+
+    def __init__(self, redis: Redis, key: str, flush_interval=10.0, buckets=DEFAULT_BUCKETS):
+        super().__init__(redis)
+        self.key = key
+        self.flush_interval = flush_interval
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts = Counter()
+        self._durations = Counter()
+        self._started = {}
+
+    def record(self, signal: str, task, count=1):
+        self._ensure_thread()
+        now = time.monotonic()
+        if signal == SIGNAL_ENQUEUED_MANY:
+            signal = S.SIGNAL_ENQUEUED
+        with self._lock:
+            self._counts[f'count|{task.name}|{signal}'] += count
+            if signal == S.SIGNAL_EXECUTING:
+                self._started[task.id] = now
+            elif signal in FINISHED_SIGNALS and task.id in self._started:
+                duration = now - self._started.pop(task.id)
+                if signal == S.SIGNAL_COMPLETE:
+                    self._observe_duration(task.name, duration)
+
+    def flush(self):
+        """ Adds the aggregated metrics to redis. They are kept for the next flush if redis is not available. """
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            durations, self._durations = self._durations, Counter()
+        if not counts and not durations:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for field, value in counts.items():
+                pipe.hincrby(self.key, field, value)
+            for field, value in durations.items():
+                pipe.hincrbyfloat(self.key, field, value)
+            pipe.execute()
+        except Exception:
+            logger.exception('Could not write signal metrics.')
+            with self._lock:
+                self._counts.update(counts)
+                self._durations.update(durations)
+
+    def _observe_duration(self, task_name: str, duration: float):
+        for le in self.buckets:
+            if duration <= le:
+                self._counts[f'duration_bucket|{task_name}|{_format_bucket(le)}'] += 1
+        self._counts[f'duration_count|{task_name}'] += 1
+        self._durations[f'duration_sum|{task_name}'] += duration
+
+    def _reset(self):
+        self._counts = Counter()
+        self._durations = Counter()
+        self._started = {}
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+def _format_bucket(le: float) -> str:
+    return '+Inf' if le == float('inf') else repr(float(le))
+
+
+def read_metrics(redis: Redis, key: str) -> Dict:
+    """
+    Reads the metrics written by SignalMetrics. The histogram buckets are cumulative like prometheus histograms.
+    :return: {'counts': {(task, signal): count}, 'durations': {task: {'buckets': {le: count}, 'sum': .., 'count': ..}}}
+    """
+    metrics = {'counts': {}, 'durations': {}}
+    for field, value in redis.hgetall(key).items():
+        kind, task_name, *rest = field.decode().split('|')
+        if kind == 'count':
+            metrics['counts'][(task_name, rest[0])] = int(value)
+            continue
+        durations = metrics['durations'].setdefault(task_name, {'buckets': {}, 'sum': 0.0, 'count': 0})
+        if kind == 'duration_bucket':
+            durations['buckets'][rest[0]] = int(value)
+        elif kind == 'duration_sum':
+            durations['sum'] = float(value)
+        elif kind == 'duration_count':
+            durations['count'] = int(value)
+    return metrics
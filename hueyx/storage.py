@@ -0,0 +1,127 @@
+import json
+import struct
+import time
+from typing import Dict
+
+from huey.storage import RedisStorage, RedisExpireStorage
+
+DEFAULT_FAIR_KEY = 'default'
+
+# KEYS[1]: sub-queue of the fair key, KEYS[2]: ring of the fair keys with pending tasks
+# ARGV[1]: fair key, ARGV[2]: score (negative priority), ARGV[3]: message
+FAIR_ENQUEUE_LUA = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+if redis.call('ZCARD', KEYS[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+"""
+
+# KEYS[1]: ring, KEYS[2]: hash of the tasks dequeued in the current turn, KEYS[3]: hash of the weights
+# ARGV[1]: key prefix of the sub-queues, ARGV[2]: json of the configured weights
+# The fair key at the head of the ring keeps its turn for weight tasks, then it moves to the tail.
+# Returns the message with the highest priority of the sub-queue or false if all sub-queues are empty.
+FAIR_DEQUEUE_LUA = """
+local weights = cjson.decode(ARGV[2])
+for _ = 1, redis.call('LLEN', KEYS[1]) do
+    local fair_key = redis.call('LINDEX', KEYS[1], 0)
+    local queue = ARGV[1] .. fair_key
+    local item = redis.call('ZPOPMIN', queue)
+    if redis.call('EXISTS', queue) == 0 then
+        redis.call('LPOP', KEYS[1])
+        redis.call('HDEL', KEYS[2], fair_key)
+    else
+        local weight = tonumber(redis.call('HGET', KEYS[3], fair_key)) or tonumber(weights[fair_key]) or 1
+        if redis.call('HINCRBY', KEYS[2], fair_key, 1) >= weight then
+            redis.call('HDEL', KEYS[2], fair_key)
+            redis.call('RPUSH', KEYS[1], redis.call('LPOP', KEYS[1]))
+        end
+    end
+    if item[1] then
+        return item[1]
+    end
+end
+return false
+"""
+
+
+class FairRedisQueue:
+    """
+    Fair queuing: every fair key (e.g. a tenant) gets its own priority sub-queue. The sub-queues are dequeued
+    round-robin by a lua script, a fair key with weight n gets n tasks per turn. Weights are configured with
+    fair_weights or changed at runtime with set_fair_weight. Dequeuing polls, lua scripts can not block.
+    """
+    priority = True
+
+    def __init__(self, *args, fair_weights: Dict[str, int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blocking = False
+        self.fair_weights = json.dumps({str(key): weight for key, weight in (fair_weights or {}).items()})
+        self.fair_prefix = f'huey.fair.{self.name}.'
+        self._dequeue_script = self.conn.register_script(FAIR_DEQUEUE_LUA)
+
+    @property
+    def ring_key(self):
+        return self.fair_prefix + 'ring'
+
+    @property
+    def turns_key(self):
+        return self.fair_prefix + 'turns'
+
+    @property
+    def weights_key(self):
+        return self.fair_prefix + 'weights'
+
+    def sub_queue_key(self, fair_key: str):
+        return f'{self.fair_prefix}queue.{fair_key}'
+
+    def enqueue(self, data, priority=None, fair_key=DEFAULT_FAIR_KEY):
+        priority = 0 if priority is None else -priority
+        # Timestamp prefix like RedisPriorityQueue: same priorities keep their order.
+        prefix = struct.pack('>Q', int(time.time() * 1e6))
+        # EVAL instead of a registered script, because the conn may be a (redis.asyncio) pipeline.
+        self.conn.eval(FAIR_ENQUEUE_LUA, 2, self.sub_queue_key(fair_key), self.ring_key, fair_key, priority,
+                       prefix + data)
+
+    def dequeue(self):
+        item = self._dequeue_script(keys=[self.ring_key, self.turns_key, self.weights_key],
+                                    args=[self.sub_queue_key(''), self.fair_weights])
+        if item:
+            return item[8:]
+
+    def fair_keys(self):
+        return [key.decode() for key in self.conn.lrange(self.ring_key, 0, -1)]
+
+    def fair_queue_sizes(self) -> Dict[str, int]:
+        """ Pending tasks per fair key. """
+        fair_keys = self.fair_keys()
+        pipe = self.conn.pipeline()
+        for fair_key in fair_keys:
+            pipe.zcard(self.sub_queue_key(fair_key))
+        return dict(zip(fair_keys, pipe.execute()))
+
+    def set_fair_weight(self, fair_key: str, weight: int = None):
+        """ Overrides the configured weight of the fair key, None restores it. """
+        if weight is None:
+            self.conn.hdel(self.weights_key, fair_key)
+        else:
+            self.conn.hset(self.weights_key, fair_key, weight)
+
+    def queue_size(self):
+        return sum(self.fair_queue_sizes().values())
+
+    def enqueued_items(self, limit=None):
+        items = []
+        for fair_key in self.fair_keys():
+            items.extend(item[8:] for item in self.conn.zrange(self.sub_queue_key(fair_key), 0, -1))
+        return items[:limit] if limit else items
+
+    def flush_queue(self):
+        self.conn.delete(self.ring_key, self.turns_key, *(self.sub_queue_key(key) for key in self.fair_keys()))
+
+
+class FairPriorityRedisStorage(FairRedisQueue, RedisStorage):
+    pass
+
+
+class FairPriorityRedisExpireStorage(FairRedisQueue, RedisExpireStorage):
+    pass
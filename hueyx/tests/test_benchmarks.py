@@ -0,0 +1,31 @@
+from unittest.mock import MagicMock
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from hueyx.benchmarks import BENCHMARKS, run_benchmarks
+from hueyx.benchmarks.runner import measure, timings
+
+
+class BenchmarkRunnerTest(TestCase):
+
+    def test_measure(self):
+        calls = []
+        result = measure(calls.append, 100)
+        self.assertEqual(calls, list(range(100)))
+        self.assertEqual(result['operations'], 100)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertLessEqual(result['p99_ms'], result['max_ms'])
+
+    def test_timings_without_durations(self):
+        self.assertEqual(timings(2.0, 100), {'operations': 100, 'total_seconds': 2.0, 'ops_per_second': 50.0})
+
+    def test_registered_benchmarks(self):
+        self.assertEqual(set(BENCHMARKS), {'enqueue', 'enqueue_many', 'execute_db_task', 'execute_heartbeat_task',
+                                           'get_dead_tasks', 'signal_publish', 'scheduler_tick'})
+
+    def test_unknown_benchmark(self):
+        with self.assertRaises(AssertionError):
+            run_benchmarks(MagicMock(), ['unknown'])
+        with self.assertRaises(CommandError):
+            call_command('bench_hueyx', 'unknown')
@@ -0,0 +1,287 @@
+import asyncio
+import datetime
+import os
+import signal
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from django.test import TestCase
+import redis
+
+from hueyx.consumer import HueyxConsumer, HueyxMultiConsumer, HueyxScheduler, HueyxAsyncWorker, \
+    SCHEDULER_MODE_LEADER
+from hueyx.periodic import every
+from hueyx.redis_huey import RedisHuey
+
+
+class HueyxSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.huey = RedisHuey('queue1')
+        self.huey.storage = MagicMock()
+        self.huey.enqueue = MagicMock()
+        self.claim = self.huey.storage.conn.register_script.return_value
+
+        @self.huey.periodic_task(lambda dt: True)
+        def periodic1():
+            pass
+
+        @self.huey.periodic_task(lambda dt: True)
+        def periodic2():
+            pass
+
+        self.now = datetime.datetime(2021, 3, 4, 5, 6, 7)
+
+    def test_without_locking(self):
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True)
+        scheduler.enqueue_periodic_tasks(self.now)
+        self.assertEqual(self.huey.enqueue.call_count, 2)
+        self.claim.assert_not_called()
+
+    def test_claim_all_tasks_at_once(self):
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True, multiple_scheduler_locking=True)
+        self.claim.return_value = [2]
+        scheduler.enqueue_periodic_tasks(self.now)
+
+        self.claim.assert_called_once()
+        keys = self.claim.call_args[1]['keys']
+        self.assertEqual(len(keys), 2)
+        self.assertTrue(all(key.endswith('.periodic_claim.2021-03-04T05:06:00') for key in keys))
+        self.huey.enqueue.assert_called_once()
+        self.assertEqual(self.huey.enqueue.call_args[0][0].name, keys[1].split('.')[2])
+
+    def test_claim_expires_after_missed_fire_times(self):
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True, multiple_scheduler_locking=True)
+        self.claim.return_value = [1]
+        fire_time = self.now - datetime.timedelta(seconds=600)
+        scheduler.claim_periodic_tasks([(self.huey._registry.periodic_tasks[0], fire_time)], self.now)
+        self.assertEqual(self.claim.call_args[1]['args'][1], 720)
+
+    def test_second_resolution(self):
+        @self.huey.periodic_task(every(seconds=10))
+        def periodic3():
+            pass
+
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True)
+        scheduler.enqueue_periodic_tasks(self.now)
+        self.assertEqual(self.huey.enqueue.call_count, 2)
+        scheduler.enqueue_periodic_tasks(self.now + datetime.timedelta(seconds=3))
+        self.assertEqual(self.huey.enqueue.call_count, 3)
+        self.assertEqual(self.huey.enqueue.call_args[0][0].name, 'periodic3')
+        scheduler.enqueue_periodic_tasks(self.now + datetime.timedelta(seconds=5))
+        self.assertEqual(self.huey.enqueue.call_count, 3)
+
+    def test_leader_schedules(self):
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True, scheduler_mode=SCHEDULER_MODE_LEADER)
+        scheduler.sleep_for_interval = MagicMock()
+        self.claim.return_value = 1
+        scheduler.loop()
+        self.assertTrue(scheduler.is_leader)
+        self.assertEqual(self.claim.call_args[1]['keys'], ['huey.queue1.scheduler_leader'])
+        self.assertEqual(self.huey.enqueue.call_count, 2)
+
+    def test_follower_does_not_schedule(self):
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True, scheduler_mode=SCHEDULER_MODE_LEADER)
+        scheduler.sleep_for_interval = MagicMock()
+        self.claim.return_value = 0
+        scheduler.loop()
+        self.assertFalse(scheduler.is_leader)
+        self.huey.enqueue.assert_not_called()
+
+    def test_follower_keeps_fire_times(self):
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True, scheduler_mode=SCHEDULER_MODE_LEADER)
+        scheduler.enqueue_periodic_tasks(self.now)
+        self.huey.enqueue.assert_not_called()
+        self.claim.return_value = 1
+        scheduler.renew_lease()
+        scheduler.enqueue_periodic_tasks(self.now + datetime.timedelta(seconds=1))
+        self.assertEqual(self.huey.enqueue.call_count, 2)
+
+    def test_leader_until_lease_timeout_on_redis_error(self):
+        scheduler = HueyxScheduler(huey=self.huey, interval=1, periodic=True, scheduler_mode=SCHEDULER_MODE_LEADER)
+        self.claim.return_value = 1
+        scheduler.renew_lease()
+        self.claim.side_effect = redis.ConnectionError()
+        scheduler.renew_lease()
+        self.assertTrue(scheduler.is_leader)
+        scheduler._leader_until = 0
+        scheduler.renew_lease()
+        self.assertFalse(scheduler.is_leader)
+
+
+class HueyxAsyncWorkerTest(TestCase):
+
+    def setUp(self):
+        self.huey = RedisHuey('queue1', immediate=True)
+        self.started = []
+
+        @self.huey.task()
+        async def async_task(i):
+            self.started.append(i)
+            await asyncio.sleep(10)
+
+        self.tasks = [async_task.s(i) for i in range(3)]
+        self.huey.dequeue = MagicMock(side_effect=self.tasks)
+
+    def test_concurrency(self):
+        worker = HueyxAsyncWorker(self.huey, default_delay=0.1, max_delay=1, backoff=1.15, concurrency=2)
+        worker.initialize()
+        worker.loop()
+        worker.loop()
+        worker._event_loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(self.started, [0, 1])
+        self.assertEqual(len(worker._in_flight), 2)
+        with patch('hueyx.consumer.asyncio.wait', new_callable=AsyncMock) as wait:
+            worker.loop()
+            wait.assert_awaited_once()
+        self.assertEqual(self.huey.dequeue.call_count, 2)
+        for execution in worker._in_flight:
+            execution.cancel()
+        worker.shutdown()
+
+    def test_consumer_worker_type(self):
+        consumer = HueyxConsumer(self.huey, workers=2, worker_type='asyncio', async_concurrency=10)
+        self.assertEqual(consumer.worker_type, 'thread')
+        workers = [worker for worker, _ in consumer.worker_threads]
+        self.assertTrue(all(isinstance(worker, HueyxAsyncWorker) for worker in workers))
+        self.assertEqual(workers[0].concurrency, 10)
+
+
+class HueyxConsumerTest(TestCase):
+
+    def setUp(self):
+        self.huey = RedisHuey('queue1')
+        self.huey.storage = MagicMock()
+        self.huey.restart_dead_tasks = MagicMock(return_value=0)
+        self.conn = self.huey.storage.conn
+
+    def test_restart_dead_tasks_with_lease(self):
+        consumer = HueyxConsumer(self.huey, dead_task_check_interval=30)
+        self.conn.set.return_value = True
+        consumer.restart_dead_tasks()
+        self.conn.set.assert_called_once_with('huey.queue1.dead_task_lease', os.getpid(), nx=True, px=30000)
+        self.huey.restart_dead_tasks.assert_called_once()
+
+    def test_restart_dead_tasks_without_lease(self):
+        consumer = HueyxConsumer(self.huey, dead_task_check_interval=30)
+        self.conn.set.return_value = None
+        consumer.restart_dead_tasks()
+        self.huey.restart_dead_tasks.assert_not_called()
+
+    def test_restart_dead_tasks_disabled_interval(self):
+        consumer = HueyxConsumer(self.huey, dead_task_check_interval=0)
+        consumer.restart_dead_tasks()
+        self.conn.set.assert_not_called()
+        self.huey.restart_dead_tasks.assert_called_once()
+
+    def test_lease_timeout_greater_than_scheduler_interval(self):
+        HueyxConsumer(self.huey, scheduler_mode=SCHEDULER_MODE_LEADER, scheduler_lease_timeout=10, scheduler_interval=5)
+        with self.assertRaises(AssertionError):
+            HueyxConsumer(self.huey, scheduler_mode=SCHEDULER_MODE_LEADER, scheduler_lease_timeout=10,
+                          scheduler_interval=10)
+
+    def test_loop_restarts_dead_tasks_periodically(self):
+        consumer = HueyxConsumer(self.huey, dead_task_check_interval=30)
+        consumer.restart_dead_tasks = MagicMock()
+        consumer._next_dead_task_check = 0
+        consumer.loop()
+        consumer.loop()
+        consumer.restart_dead_tasks.assert_called_once()
+
+
+
+class HueyxConsumerAutoscaleTest(TestCase):
+
+    def setUp(self):
+        self.huey = RedisHuey('queue1')
+        self.huey.storage = MagicMock()
+        self.consumer = HueyxConsumer(self.huey, workers=1, min_workers=1, max_workers=3, dead_task_check_interval=0)
+        self.consumer._create_process = MagicMock()
+
+    def sample(self, pending, times=1):
+        self.huey.storage.queue_size.return_value = pending
+        for _ in range(times):
+            self.consumer.autoscale()
+
+    def test_workers_within_limits(self):
+        consumer = HueyxConsumer(self.huey, workers=1, min_workers=2, max_workers=4)
+        self.assertEqual(len(consumer.worker_threads), 2)
+        consumer = HueyxConsumer(self.huey, workers=8, max_workers=4)
+        self.assertEqual(len(consumer.worker_threads), 4)
+        self.assertFalse(HueyxConsumer(self.huey, workers=2).is_autoscaling)
+
+    def test_scale_up(self):
+        self.sample(10)
+        self.assertEqual(len(self.consumer.worker_threads), 1)
+        self.sample(10)
+        self.assertEqual(len(self.consumer.worker_threads), 2)
+        self.consumer._create_process.return_value.start.assert_called_once()
+        self.sample(10, times=10)
+        self.assertEqual(len(self.consumer.worker_threads), 3)
+
+    def test_no_scale_up_without_backlog(self):
+        self.sample(1, times=10)
+        self.assertEqual(len(self.consumer.worker_threads), 1)
+
+    def test_scale_down(self):
+        self.sample(10, times=4)
+        workers = [worker for worker, _ in self.consumer.worker_threads]
+        self.sample(0, times=self.consumer.scale_down_samples - 1)
+        self.assertEqual(len(self.consumer.worker_threads), 3)
+        self.sample(0)
+        self.assertEqual(len(self.consumer.worker_threads), 2)
+        self.assertTrue(workers[-1].retire_flag.is_set())
+        self.assertFalse(workers[0].retire_flag.is_set())
+        self.sample(0, times=100)
+        self.assertEqual(len(self.consumer.worker_threads), 1)
+
+    def test_retired_worker_stops(self):
+        consumer = HueyxConsumer(self.huey, workers=1, dead_task_check_interval=0)
+        worker, _ = consumer.worker_threads[0]
+        worker.loop = MagicMock(side_effect=lambda: worker.retire_flag.set())
+        worker_process = consumer._create_process(worker, 'Worker-1')
+        worker_process.start()
+        worker_process.join(1)
+        self.assertFalse(worker_process.is_alive())
+        worker.loop.assert_called_once()
+
+
+class HueyxMultiConsumerTest(TestCase):
+
+    def setUp(self):
+        self.consumers = []
+        for name, worker_type in (('queue1', 'thread'), ('queue2', 'process')):
+            huey = RedisHuey(name)
+            huey.storage = MagicMock()
+            consumer = HueyxConsumer(huey, worker_type=worker_type, dead_task_check_interval=0)
+            consumer.start = MagicMock(side_effect=lambda n=name: self.started.append(n))
+            consumer.restart_dead_tasks = MagicMock()
+            self.consumers.append(consumer)
+        self.started = []
+
+    @patch('hueyx.consumer.signal.signal')
+    def test_start_process_consumers_first(self, *args):
+        HueyxMultiConsumer(self.consumers).start()
+        self.assertEqual(self.started, ['queue2', 'queue1'])
+        for consumer in self.consumers:
+            consumer.restart_dead_tasks.assert_called_once()
+
+    @patch('hueyx.consumer.signal.signal')
+    def test_forward_signals(self, signal_mock):
+        HueyxMultiConsumer(self.consumers).start()
+        handlers = {call[0][0]: call[0][1] for call in signal_mock.call_args_list}
+        handlers[signal.SIGTERM](signal.SIGTERM, None)
+        for consumer in self.consumers:
+            self.assertTrue(consumer._received_signal)
+            self.assertFalse(consumer._graceful)
+
+    @patch('hueyx.consumer.signal.signal')
+    def test_run_until_all_consumers_stopped(self, *args):
+        multi_consumer = HueyxMultiConsumer(self.consumers)
+        for consumer in self.consumers:
+            consumer._received_signal = True
+            consumer._graceful = False
+            consumer.huey.notify_interrupted_tasks = MagicMock()
+        multi_consumer.run()
+        for consumer in self.consumers:
+            self.assertTrue(consumer.stop_flag.is_set())
+            consumer.huey.notify_interrupted_tasks.assert_called_once()
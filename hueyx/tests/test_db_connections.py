@@ -0,0 +1,70 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase
+
+from hueyx.db_connections import DbConnectionLifecycle
+from hueyx.redis_huey import RedisHuey, close_db
+
+
+class DbConnectionLifecycleTest(TestCase):
+
+    def setUp(self):
+        self.conn = MagicMock(alias='default', errors_occurred=False, settings_dict={'AUTOCOMMIT': True})
+        self.conn.get_autocommit.return_value = True
+        patcher = patch('hueyx.db_connections.connections')
+        self.connections = patcher.start()
+        self.connections.all.return_value = [self.conn]
+        self.addCleanup(patcher.stop)
+        self.lifecycle = DbConnectionLifecycle(max_age=300, idle_check=30)
+
+    def run_task(self, error=False):
+        self.lifecycle.before_task()
+        self.lifecycle.after_task(error)
+
+    def stats(self):
+        return list(self.lifecycle.stats().values())[0]
+
+    def test_reuse(self):
+        self.run_task()
+        self.run_task()
+        self.conn.close.assert_not_called()
+        self.conn.is_usable.assert_not_called()
+        self.assertEqual(self.stats(), {'reused': 2})
+
+    def test_new_connection(self):
+        self.conn.connection = None
+        self.run_task()
+        self.assertEqual(self.stats(), {'connected': 1})
+
+    def test_close_on_error(self):
+        self.run_task(error=True)
+        self.conn.close.assert_called_once()
+        self.assertEqual(self.stats(), {'reused': 1, 'closed_on_error': 1})
+
+    @patch('hueyx.db_connections.time.monotonic')
+    def test_close_at_max_age(self, monotonic):
+        monotonic.return_value = 1000
+        self.run_task()
+        monotonic.return_value = 1300
+        self.run_task()
+        self.conn.close.assert_called_once()
+        self.assertEqual(self.stats()['closed_max_age'], 1)
+
+    @patch('hueyx.db_connections.time.monotonic')
+    def test_check_idle_connection(self, monotonic):
+        monotonic.return_value = 1000
+        self.run_task()
+        monotonic.return_value = 1040
+        self.conn.is_usable.return_value = False
+        self.run_task()
+        self.conn.close.assert_called_once()
+        self.assertEqual(self.stats()['closed_unusable'], 1)
+
+    def test_close_db(self):
+        huey = RedisHuey(db_connection_mode='persistent')
+        huey.db_connection_lifecycle = MagicMock()
+        fn = MagicMock(side_effect=ValueError())
+        with self.assertRaises(ValueError):
+            close_db(fn, huey)()
+        huey.db_connection_lifecycle.before_task.assert_called_once()
+        huey.db_connection_lifecycle.after_task.assert_called_once_with(error=True)
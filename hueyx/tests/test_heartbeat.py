@@ -1,10 +1,11 @@
+import asyncio
+import time
 from datetime import timedelta
 from unittest.mock import MagicMock, patch
 
 from django.test import TestCase
 from django.utils import timezone
 from huey.api import Task
-from huey.constants import EmptyData
 
 from hueyx.redis_huey import RedisHuey, Heartbeat, HeartbeatTimeoutError, RevokedError, _wrap_heartbeat
 
@@ -34,131 +35,150 @@ class HeartbeatTest(TestCase):
 
     def test_start_heartbeat_observation(self):
         self.heartbeat._start_heartbeat_observation()
-        self.assertEqual(self.redis.method_calls[0][0], 'put_data')
-        self.assertEqual(self.redis.method_calls[0][1][0], f'hb:{self.task.id}')
+        pipe = self.redis.conn.pipeline.return_value
+        self.assertEqual(pipe.hset.call_args[0][:2], (self.huey.heartbeat_observations_key, self.task.id))
+        self.assertEqual(pipe.zadd.call_args[0][0], self.huey.heartbeat_index_key)
+        self.assertIn(self.task.id, pipe.zadd.call_args[0][1])
+        pipe.execute.assert_called_once()
 
     def test_stop_heartbeat_observation(self):
-        def pop_data(*args, **kwargs):
-            self.assertEqual(args[0], f'hb:{self.task.id}')
-            self.called = True
-            return EmptyData
-
-        self.redis.pop_data = pop_data
         self.heartbeat._stop_heartbeat_observation()
-        self.assertTrue(self.called)
+        pipe = self.redis.conn.pipeline.return_value
+        pipe.hdel.assert_called_once_with(self.huey.heartbeat_observations_key, self.task.id)
+        pipe.zrem.assert_called_once_with(self.huey.heartbeat_index_key, self.task.id)
+        pipe.execute.assert_called_once()
 
     def test_set_timestamp(self):
+        now = timezone.now()
         self.heartbeat._set_timestamp()
-        self.assertEqual(self.redis.method_calls[0][0], 'put_data')
-        self.assertEqual(self.redis.method_calls[0][1][0], f'hbts:{self.task.id}')
+        key, mapping = self.redis.conn.zadd.call_args[0]
+        self.assertEqual(key, self.huey.heartbeat_index_key)
+        self.assertAlmostEqual(mapping[self.task.id], int(now.timestamp()) + self.timeout, delta=1)
 
     def test_get_timestamp(self):
-        def peek_data(*args, **kwargs):
-            self.assertEqual(args[0], f'hbts:{self.task.id}')
-            self.called = True
-            return EmptyData
+        now = timezone.now()
+        self.redis.conn.zscore.return_value = now.timestamp() + self.timeout
+        timestamp = self.heartbeat._get_timestamp()
+        self.redis.conn.zscore.assert_called_once_with(self.huey.heartbeat_index_key, self.task.id)
+        self.assertAlmostEqual(timestamp.timestamp(), now.timestamp(), delta=1)
 
-        self.redis.peek_data = peek_data
-        self.heartbeat._get_timestamp()
-        self.assertTrue(self.called)
+    def test_get_no_timestamp(self):
+        self.redis.conn.zscore.return_value = None
+        self.assertIsNone(self.heartbeat._get_timestamp())
 
     def test_delete_timestamp(self):
-        def pop_data(*args, **kwargs):
-            self.assertEqual(args[0], f'hbts:{self.task.id}')
-            self.called = True
-            return EmptyData
-
-        self.redis.pop_data = pop_data
         self.heartbeat._delete_timestamp()
-        self.assertTrue(self.called)
+        self.redis.conn.zrem.assert_called_once_with(self.huey.heartbeat_index_key, self.task.id)
 
-    def test_heartbeat_no_new_timestamp(self):
-        def get_timestamp():
-            self.called = True
-            return timezone.now()
-
-        self.heartbeat._get_timestamp = get_timestamp
-        self.heartbeat()
-        self.assertTrue(self.called)
+    def check_heartbeat(self, timestamp=None, revoke_data=()):
+        """ Mocks the redis round trip with the deadline of the given timestamp. """
+        def check_heartbeat(task, heartbeat_timeout, now):
+            self.assertEqual(task, self.task)
+            self.call_cnt += 1
+            deadline = int(timestamp.timestamp()) + heartbeat_timeout if timestamp else None
+            return list(revoke_data), deadline
 
-    def test_heartbeat_new_timestamp(self):
-        def get_timestamp():
-            return timezone.now() - timedelta(seconds=self.huey.HEARTBEAT_UPDATE_INTERVAL)
+        self.huey.check_heartbeat = check_heartbeat
 
-        def set_timestamp():
-            self.called = True
+    def set_timestamp(self):
+        self.called = True
 
-        self.heartbeat._get_timestamp = get_timestamp
-        self.heartbeat._set_timestamp = set_timestamp
+    def test_heartbeat(self):
+        self.check_heartbeat(timezone.now())
+        self.heartbeat._set_timestamp = self.set_timestamp
         self.heartbeat()
-        self.assertTrue(self.called)
+        self.assertEqual(self.call_cnt, 1)
+        self.assertFalse(self.called)
 
     def test_heartbeat_no_timestamp(self):
-        def get_timestamp():
-            return None
-
-        def set_timestamp():
-            self.called = True
-
-        self.heartbeat._get_timestamp = get_timestamp
-        self.heartbeat._set_timestamp = set_timestamp
+        self.check_heartbeat(None)
         with self.assertRaises(HeartbeatTimeoutError):
             self.heartbeat()
-        self.assertFalse(self.called)
 
     def test_heartbeat_expired_timestamp(self):
-        def get_timestamp():
-            return timezone.now() - timedelta(seconds=self.timeout)
-
-        def set_timestamp():
-            self.called = True
-
-        self.heartbeat._get_timestamp = get_timestamp
-        self.heartbeat._set_timestamp = set_timestamp
+        self.check_heartbeat(timezone.now() - timedelta(seconds=self.timeout))
         with self.assertRaises(HeartbeatTimeoutError):
             self.heartbeat()
-        self.assertFalse(self.called)
 
     def test_heartbeat_revoked(self):
         def delete_timestamp():
             self.called = True
 
-        self.huey.is_revoked = MagicMock(return_value=True)
+        self.check_heartbeat(timezone.now(), [self.huey.serializer.serialize((None, False))])
         self.heartbeat._delete_timestamp = delete_timestamp
         with self.assertRaises(RevokedError):
             self.heartbeat()
         self.assertTrue(self.called)
 
-    def test_caching(self):
-        def get_timestamp():
-            self.call_cnt += 1
-            return timezone.now() - timedelta(seconds=self.huey.HEARTBEAT_UPDATE_INTERVAL)
+    def test_heartbeat_revoked_once(self):
+        self.check_heartbeat(timezone.now(), [self.huey.serializer.serialize((None, True))])
+        with self.assertRaises(RevokedError):
+            self.heartbeat()
+
+    def test_heartbeat_revoke_expired(self):
+        revoke_until = self.huey._get_timestamp() - timedelta(seconds=1)
+        self.check_heartbeat(timezone.now() - timedelta(seconds=self.huey.HEARTBEAT_UPDATE_INTERVAL),
+                             [self.huey.serializer.serialize((revoke_until, False))])
+        self.heartbeat._set_timestamp = self.set_timestamp
+        self.heartbeat()
+        self.assertTrue(self.called)
 
-        self.heartbeat._get_timestamp = get_timestamp
+    def test_caching(self):
+        self.check_heartbeat(timezone.now())
         self.heartbeat()
         self.heartbeat()
         self.assertEqual(self.call_cnt, 1)
 
     def test_no_caching(self):
-        def get_timestamp():
-            self.call_cnt += 1
-            return timezone.now() - timedelta(seconds=self.huey.HEARTBEAT_UPDATE_INTERVAL)
-
-        self.heartbeat._get_timestamp = get_timestamp
+        self.check_heartbeat(timezone.now())
         self.heartbeat.CHECK_INTERVAL = timedelta()
         self.heartbeat()
         self.heartbeat()
         self.assertEqual(self.call_cnt, 2)
 
+    def test_background_heartbeat(self):
+        self.check_heartbeat(timezone.now())
+        heartbeat = Heartbeat(self.huey, self.task, self.timeout, background=True)
+        heartbeat.CHECK_INTERVAL = timedelta(milliseconds=1)
+        heartbeat._start_background_heartbeat()
+        time.sleep(0.05)
+        heartbeat()
+        heartbeat._stop_background_heartbeat()
+        self.assertFalse(heartbeat._background_thread.is_alive())
+        self.assertGreater(self.call_cnt, 1)
+
+    def test_background_heartbeat_revoked(self):
+        self.check_heartbeat(timezone.now(), [self.huey.serializer.serialize((None, False))])
+        heartbeat = Heartbeat(self.huey, self.task, self.timeout, background=True)
+        heartbeat._delete_timestamp = MagicMock()
+        heartbeat.CHECK_INTERVAL = timedelta(milliseconds=1)
+        heartbeat._start_background_heartbeat()
+        heartbeat._background_thread.join(1)
+        with self.assertRaises(RevokedError):
+            heartbeat()
+        self.assertEqual(self.call_cnt, 1)
+
+    def test_check_heartbeat(self):
+        script = self.redis.conn.register_script.return_value
+        script.return_value = [b'', b'', 1000]
+        revoke_data, deadline = self.huey.check_heartbeat(self.task, self.timeout, 500)
+        self.assertEqual((revoke_data, deadline), ([], 1000))
+        keys, args = script.call_args[1]['keys'], script.call_args[1]['args']
+        self.assertEqual(keys[0], self.huey.heartbeat_index_key)
+        self.assertEqual(args[:4], [self.task.id, 500, self.huey.HEARTBEAT_UPDATE_INTERVAL, self.timeout])
+        self.assertEqual(args[4], self.task.revoke_id)
+
+    def test_check_heartbeat_not_observed(self):
+        script = self.redis.conn.register_script.return_value
+        script.return_value = [b'revoked', b'', b'']
+        self.assertEqual(self.huey.check_heartbeat(self.task, self.timeout, 500), ([b'revoked'], None))
+
 
 class HeartbeatMock(MagicMock):
 
     def _start_heartbeat_observation(self):
         self.calls = ['start']
 
-    def _set_timestamp(self):
-        self.calls.append('timestamp')
-
     def _stop_heartbeat_observation(self):
         self.calls.append('stop')
 
@@ -178,7 +198,7 @@ class HeartbeatWrapperTest(TestCase):
 
         result = _wrap_heartbeat(task, self.huey, self.timeout)(task=self.task)
         self.assertEqual(result, 'finish')
-        self.assertEqual(self.heartbeat.calls, ['start', 'timestamp', 'stop'])
+        self.assertEqual(self.heartbeat.calls, ['start', 'stop'])
 
     def test_timeout(self, *args):
         def task(heartbeat):
@@ -187,7 +207,7 @@ class HeartbeatWrapperTest(TestCase):
 
         result = _wrap_heartbeat(task, self.huey, self.timeout)(task=self.task)
         self.assertEqual(result, None)
-        self.assertEqual(self.heartbeat.calls, ['start', 'timestamp'])
+        self.assertEqual(self.heartbeat.calls, ['start'])
 
     def test_revoke(self, *args):
         def task(heartbeat):
@@ -196,7 +216,17 @@ class HeartbeatWrapperTest(TestCase):
 
         result = _wrap_heartbeat(task, self.huey, self.timeout)(task=self.task)
         self.assertEqual(result, None)
-        self.assertEqual(self.heartbeat.calls, ['start', 'timestamp', 'stop'])
+        self.assertEqual(self.heartbeat.calls, ['start', 'stop'])
+
+    def test_background_heartbeat(self, *args):
+        def task(heartbeat):
+            self.heartbeat = heartbeat
+            return 'finish'
+
+        result = _wrap_heartbeat(task, self.huey, self.timeout, background=True)(task=self.task)
+        self.assertEqual(result, 'finish')
+        self.heartbeat._start_background_heartbeat.assert_called_once()
+        self.heartbeat._stop_background_heartbeat.assert_called_once()
 
     def test_exception(self, *args):
         def task(heartbeat):
@@ -205,64 +235,93 @@ class HeartbeatWrapperTest(TestCase):
 
         with self.assertRaises(Exception):
             _wrap_heartbeat(task, self.huey, self.timeout)(task=self.task)
-        self.assertEqual(self.heartbeat.calls, ['start', 'timestamp', 'stop'])
+        self.assertEqual(self.heartbeat.calls, ['start', 'stop'])
 
+    @patch('hueyx.redis_huey.AsyncHeartbeat', new_callable=HeartbeatMock)
+    def test_async_task_execution(self, *args):
+        async def task(heartbeat):
+            self.heartbeat = heartbeat
+            return 'finish'
 
-class RedisMock(MagicMock):
-
-    @property
-    def conn(self, *args, **kwargs):
-        return self
-
-    # noinspection PyMethodMayBeStatic
-    def hscan_iter(self, *args, **kwargs):
-        return [[b'hb:task-id']]
+        result = asyncio.run(_wrap_heartbeat(task, self.huey, self.timeout)(task=self.task))
+        self.assertEqual(result, 'finish')
+        self.assertEqual(self.heartbeat.calls, ['start', 'stop'])
+        self.heartbeat._start_background_heartbeat.assert_called_once()
+        self.heartbeat._stop_background_heartbeat.assert_called_once()
 
 
 class RedisHueyTest(TestCase):
 
-    # @patch('huey.storage.RedisStorage', new_callable=RedisMock)
     def setUp(self, *args):
         self.huey = RedisHuey()
-        self.huey.storage = RedisMock()
-        self.called = False
+        self.huey.storage = MagicMock()
+        self.conn = self.huey.storage.conn
 
     def test_no_dead_tasks(self):
-        def get(key, *args, peek, **kwargs):
-            assert peek
-            self.called = True
-            if key.startswith('hb:'):
-                return 'name', 'settings', 60
-            return timezone.now()
-
-        self.huey.get = get
+        self.conn.zrangebyscore.return_value = []
         tasks = self.huey.get_dead_tasks()
         self.assertEqual(len(tasks), 0)
-        self.assertTrue(self.called)
-
-    def test_dead_tasks_no_timestamp(self):
-        def get(key, *args, peek, **kwargs):
-            assert peek
-            self.called = True
-            if key.startswith('hb:'):
-                return 'name', 'settings', 60
+        self.assertEqual(self.conn.zrangebyscore.call_args[0][0], self.huey.heartbeat_index_key)
+        self.conn.hmget.assert_not_called()
 
-        self.huey.get = get
+    def test_dead_tasks(self):
+        self.conn.zrangebyscore.return_value = [b'task-id']
+        self.conn.hmget.return_value = [self.huey.serializer.serialize(('name', 'settings', 120))]
         tasks = self.huey.get_dead_tasks()
         self.assertEqual(len(tasks), 1)
         self.assertEqual(tasks[0], self.huey.DeadTask('task-id', 'name', 'settings'))
-        self.assertTrue(self.called)
+        self.conn.hmget.assert_called_once_with(self.huey.heartbeat_observations_key, [b'task-id'])
 
-    def test_dead_tasks_timestamp_expired(self):
-        def get(key, *args, peek, **kwargs):
-            assert peek
-            self.called = True
-            if key.startswith('hb:'):
-                return 'name', 'settings', 60
-            return timezone.now() - timedelta(seconds=60)
-
-        self.huey.get = get
+    def test_dead_tasks_stopped_observation(self):
+        self.conn.zrangebyscore.return_value = [b'task-id']
+        self.conn.hmget.return_value = [None]
         tasks = self.huey.get_dead_tasks()
-        self.assertEqual(len(tasks), 1)
-        self.assertEqual(tasks[0], self.huey.DeadTask('task-id', 'name', 'settings'))
-        self.assertTrue(self.called)
+        self.assertEqual(len(tasks), 0)
+
+    def test_restart_dead_tasks(self):
+        self.huey = RedisHuey()
+        self.conn = self.huey.storage.conn = MagicMock()
+
+        @self.huey.task()
+        def dead_task():
+            pass
+
+        name = self.huey._registry.task_to_string(dead_task.task_class)
+        self.huey.get_dead_tasks = MagicMock(return_value=[
+            self.huey.DeadTask(f'task-{i}', name, dict(args=(i,), kwargs={})) for i in range(3)
+        ])
+        enqueued = MagicMock()
+        self.huey.signal('enqueued')(enqueued)
+
+        self.assertEqual(self.huey.restart_dead_tasks(batch_size=2), 3)
+        self.assertEqual(self.conn.pipeline.call_count, 2)
+        pipe = self.conn.pipeline.return_value
+        self.assertEqual(pipe.execute.call_count, 2)
+        self.assertEqual(pipe.hset.call_count, 3)   # revoke the dead tasks
+        self.assertEqual(pipe.lpush.call_count, 3)  # enqueue the new tasks
+        pipe.zrem.assert_any_call(self.huey.heartbeat_index_key, 'task-2')
+        self.assertEqual(enqueued.call_count, 3)
+        self.conn.lpush.assert_not_called()
+
+    def test_migrate_heartbeat_observations(self):
+        timestamp = timezone.now()
+        data = {
+            'hb:task-id': ('name', 'settings', 120),
+            'hbts:task-id': timestamp,
+        }
+        self.conn.hscan_iter.return_value = [(b'hb:task-id', b'')]
+        self.huey.get = lambda key, peek=False: data.pop(key, None)
+        self.huey.start_heartbeat_observation = MagicMock()
+
+        self.assertEqual(self.huey.migrate_heartbeat_observations(), 1)
+        self.huey.start_heartbeat_observation.assert_called_once_with(
+            'task-id', ('name', 'settings', 120), int((timestamp + timedelta(seconds=120)).timestamp()))
+        self.assertEqual(data, {})
+
+    def test_migrate_heartbeat_observation_without_timestamp(self):
+        self.conn.hscan_iter.return_value = [(b'hb:task-id', b'')]
+        self.huey.get = lambda key, peek=False: ('name', 'settings', 120) if key.startswith('hb:') else None
+        self.huey.start_heartbeat_observation = MagicMock()
+
+        self.huey.migrate_heartbeat_observations()
+        self.huey.start_heartbeat_observation.assert_called_once_with('task-id', ('name', 'settings', 120), 0)
@@ -0,0 +1,89 @@
+import datetime
+
+from django.test import TestCase
+from huey import crontab
+
+from hueyx.periodic import every, PeriodicSchedule, CATCH_UP_SKIP, CATCH_UP_ONCE, CATCH_UP_ALL
+from hueyx.redis_huey import RedisHuey
+
+
+class EveryTest(TestCase):
+
+    def test_next_fire(self):
+        schedule = every(seconds=15)
+        now = datetime.datetime(2021, 3, 4, 5, 6, 7, 500)
+        self.assertEqual(schedule.next_fire(now), datetime.datetime(2021, 3, 4, 5, 6, 15))
+        self.assertEqual(schedule.next_fire(datetime.datetime(2021, 3, 4, 5, 6, 15)),
+                         datetime.datetime(2021, 3, 4, 5, 6, 30))
+        self.assertEqual(schedule.last_fire(now), datetime.datetime(2021, 3, 4, 5, 6, 0))
+
+    def test_validate_datetime(self):
+        schedule = every(minutes=2)
+        self.assertTrue(schedule(datetime.datetime(2021, 3, 4, 5, 6)))
+        self.assertFalse(schedule(datetime.datetime(2021, 3, 4, 5, 7)))
+
+
+class PeriodicScheduleTest(TestCase):
+
+    def setUp(self):
+        self.huey = RedisHuey('queue1')
+
+        @self.huey.periodic_task(crontab(minute='*/5'))
+        def every_five_minutes():
+            pass
+
+        @self.huey.periodic_task(every(seconds=30))
+        def every_thirty_seconds():
+            pass
+
+        self.crontab_task = every_five_minutes.task_class
+        self.interval_task = every_thirty_seconds.task_class
+        self.now = datetime.datetime(2021, 3, 4, 5, 5, 10)
+
+    def schedule(self, catch_up=CATCH_UP_SKIP):
+        return PeriodicSchedule([self.crontab_task, self.interval_task], self.now, catch_up=catch_up)
+
+    def test_current_minute(self):
+        schedule = self.schedule()
+        self.assertEqual(schedule.pop_due(self.now), [(self.crontab_task, datetime.datetime(2021, 3, 4, 5, 5))])
+        self.assertEqual(schedule.next_fire_time, datetime.datetime(2021, 3, 4, 5, 5, 30))
+        self.assertEqual(schedule.pop_due(self.now), [])
+
+    def test_due_tasks(self):
+        schedule = self.schedule()
+        schedule.pop_due(self.now)
+        now = datetime.datetime(2021, 3, 4, 5, 5, 30)
+        self.assertEqual(schedule.pop_due(now), [(self.interval_task, now)])
+
+    def test_catch_up_skip(self):
+        schedule = self.schedule(CATCH_UP_SKIP)
+        schedule.pop_due(self.now)
+        now = datetime.datetime(2021, 3, 4, 5, 16, 40)
+        self.assertEqual(schedule.pop_due(now), [(self.interval_task, datetime.datetime(2021, 3, 4, 5, 16, 30))])
+        self.assertEqual(schedule.next_fire_time, datetime.datetime(2021, 3, 4, 5, 17))
+
+    def test_catch_up_once(self):
+        schedule = self.schedule(CATCH_UP_ONCE)
+        schedule.pop_due(self.now)
+        now = datetime.datetime(2021, 3, 4, 5, 16, 40)
+        self.assertEqual(schedule.pop_due(now), [
+            (self.crontab_task, datetime.datetime(2021, 3, 4, 5, 15)),
+            (self.interval_task, datetime.datetime(2021, 3, 4, 5, 16, 30)),
+        ])
+
+    def test_catch_up_all(self):
+        schedule = self.schedule(CATCH_UP_ALL)
+        schedule.pop_due(self.now)
+        due = schedule.pop_due(datetime.datetime(2021, 3, 4, 5, 16, 40))
+        self.assertEqual([fire for task, fire in due if task is self.crontab_task],
+                         [datetime.datetime(2021, 3, 4, 5, 10), datetime.datetime(2021, 3, 4, 5, 15)])
+        self.assertEqual(len([task for task, _ in due if task is self.interval_task]), 23)
+
+    def test_rare_crontab(self):
+        @self.huey.periodic_task(crontab(month='12', day='24', hour='0', minute='0'))
+        def christmas():
+            pass
+
+        schedule = PeriodicSchedule([christmas.task_class], self.now)
+        self.assertEqual(schedule.pop_due(self.now + datetime.timedelta(days=8)), [])
+        self.assertEqual(len(schedule), 1)
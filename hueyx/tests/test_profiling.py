@@ -0,0 +1,94 @@
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase
+from huey.constants import EmptyData
+
+from hueyx.consumer import HueyxConsumer
+from hueyx.profiling import ExecutionProfiler, read_profiles
+from hueyx.redis_huey import RedisHuey
+
+
+@patch('hueyx.profiling.ExecutionProfiler._ensure_thread')
+class ExecutionProfilerTest(TestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.profiler = ExecutionProfiler(self.redis, 'profile', window=3, profile_slowest=1, profile_sample_rate=1)
+
+    def record(self, task_name, **phases):
+        self.profiler.begin()
+        for phase, duration in phases.items():
+            with patch('hueyx.profiling.time.perf_counter', side_effect=[0, duration]):
+                with self.profiler.phase(phase):
+                    pass
+        self.profiler.end(task_name)
+
+    def test_phases(self, *args):
+        for duration in (0.001, 0.002, 0.003, 0.004):
+            self.record('task1', dequeue=duration, task=duration * 10)
+        stats = self.profiler.stats()['task1']
+        self.assertEqual(stats['dequeue']['count'], 3)
+        self.assertEqual(stats['dequeue']['p50_ms'], 3.0)
+        self.assertEqual(stats['task']['max_ms'], 40.0)
+        self.assertIn('total', stats)
+
+    def test_phase_without_execution(self, *args):
+        with self.profiler.phase('dequeue'):
+            pass
+        self.profiler.end('task1')
+        self.assertEqual(self.profiler.stats(), {})
+
+    def test_slowest(self, *args):
+        for name in ('task1', 'task2'):
+            self.profiler.begin()
+            with self.profiler.task_phase():
+                sum(range(1000))
+            self.profiler.end(name)
+        slowest = self.profiler.slowest()
+        self.assertEqual(len(slowest), 1)
+        self.assertIn('function calls', slowest[0]['profile'])
+
+    def test_flush(self, *args):
+        self.record('task1', task=0.001)
+        self.profiler._pid = os.getpid()
+        self.profiler.flush()
+        pipe = self.redis.pipeline.return_value
+        key, field, snapshot = pipe.hset.call_args[0]
+        self.assertEqual(key, 'profile')
+        self.assertIn('task1', json.loads(snapshot)['tasks'])
+
+        self.redis.hgetall.return_value = {field.encode(): snapshot}
+        self.assertEqual(read_profiles(self.redis, 'profile')[field], json.loads(snapshot))
+
+
+class ProfiledExecutionTest(TestCase):
+
+    def test_db_task_phases(self):
+        huey = RedisHuey('queue1')
+        huey.storage = MagicMock()
+        huey.is_revoked = MagicMock(return_value=False)
+        huey.storage.pop_data.return_value = EmptyData
+
+        @huey.db_task()
+        def db_task():
+            return 1
+
+        HueyxConsumer(huey, workers=1, profiling=True)
+        self.assertIsInstance(huey.profiler, ExecutionProfiler)
+        huey.storage.dequeue.return_value = huey.serialize_task(db_task.s())
+        huey.storage.blocking = False
+        with patch.object(huey.profiler, '_ensure_thread'):
+            huey.execute(huey.dequeue())
+        phases = huey.profiler.stats()['db_task']
+        self.assertEqual(set(phases), {'dequeue', 'deserialize', 'signals', 'task', 'db_connections', 'result',
+                                       'total'})
+
+        # The idle wait of a blocking dequeue is not recorded.
+        huey.storage.blocking = True
+        with patch.object(huey.profiler, '_ensure_thread'):
+            huey.execute(huey.dequeue())
+        phases = huey.profiler.stats()['db_task']
+        self.assertEqual(phases['dequeue']['count'], 1)
+        self.assertEqual(phases['total']['count'], 2)
@@ -1,5 +1,10 @@
+from threading import Thread
+from unittest.mock import patch
+
 from django.test import TestCase
 
+from hueyx.settings_reader import DjangoSettingsReader
+
 
 HUEYX = {
     'queue1': {
@@ -41,3 +46,32 @@ class QueuesTest(TestCase):
 
             self.assertEqual(hueyx('queue1'), hueyx('queue1'))
 
+
+    def test_lazy_settings(self):
+        reader = DjangoSettingsReader()
+        with self.settings(HUEYX=HUEYX):
+            self.assertEqual(list(reader.configurations), ['queue1', 'queue2'])
+            self.assertNotIn('huey_instance', reader.configurations['queue1'].__dict__)
+
+    def test_thread_safe_huey_instance(self):
+        reader = DjangoSettingsReader()
+        with self.settings(HUEYX=HUEYX):
+            instances = []
+            threads = [Thread(target=lambda: instances.append(reader.configurations['queue1'].huey_instance))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(set(map(id, instances))), 1)
+
+    def test_warmup(self):
+        from hueyx import queues
+
+        reader = DjangoSettingsReader()
+        with self.settings(HUEYX=HUEYX), patch.object(queues, 'settings_reader', reader), \
+                patch('redis.Redis.ping') as ping:
+            queues.warmup(['queue2'])
+            self.assertIn('huey_instance', reader.configurations['queue2'].__dict__)
+            self.assertNotIn('huey_instance', reader.configurations['queue1'].__dict__)
+            ping.assert_called_once()
@@ -0,0 +1,507 @@
+import asyncio
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import AsyncMock, MagicMock
+
+from django.test import TestCase
+from huey.exceptions import TaskException
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401 (lua scripts of fakeredis)
+except ImportError:
+    fakeredis = None
+
+from hueyx.redis_huey import RedisHuey, PriorityRedisHuey, parse_rate_limit
+
+
+class RedisHueyTestCase(TestCase):
+    """ RedisHuey with a mocked redis connection. """
+
+    def setUp(self):
+        self.huey = RedisHuey()
+        self.conn = self.huey.storage.conn = MagicMock()
+
+
+@skipUnless(fakeredis, 'requires fakeredis[lua]')
+class FakeRedisTestCase(TestCase):
+    """ RedisHuey on an in-process fakeredis which runs the lua scripts. """
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.huey = RedisHuey('queue1', connection_pool=self.redis.connection_pool)
+
+
+class LuaScriptTest(FakeRedisTestCase):
+
+    def test_check_heartbeat(self):
+        @self.huey.task()
+        def observed_task():
+            pass
+
+        task = observed_task.s()
+        self.assertEqual(self.huey.check_heartbeat(task, 120, 1000), ([], None))
+        self.huey.start_heartbeat_observation(task.id, ('observed_task', None, 120), 1100)
+        self.assertEqual(self.huey.check_heartbeat(task, 120, 1000), ([], 1100))
+        self.assertEqual(self.huey.check_heartbeat(task, 120, 1050), ([], 1170))  # update interval passed
+        self.huey.revoke(task)
+        revoke_data, deadline = self.huey.check_heartbeat(task, 120, 1150)
+        self.assertEqual(len(revoke_data), 1)
+        self.assertEqual(deadline, 1170)
+
+    def test_coalesce(self):
+        @self.huey.task(coalesce=True)
+        def coalesced_task(obj_id):
+            pass
+
+        first = coalesced_task(1)
+        self.assertEqual(coalesced_task(1).id, first.id)
+        coalesced_task(2)
+        self.assertEqual(self.huey.pending_count(), 2)
+
+        self.huey.execute(self.huey.dequeue())
+        self.assertNotEqual(coalesced_task(1).id, first.id)
+        self.assertEqual(self.huey.pending_count(), 2)
+
+    def test_coalesce_revoked(self):
+        @self.huey.task(coalesce=True)
+        def coalesced_task(obj_id):
+            pass
+
+        revoked = coalesced_task(1)
+        revoked.revoke()
+        self.huey.execute(self.huey.dequeue())
+        self.assertEqual(self.huey.pending_count(), 0)
+        self.assertNotEqual(coalesced_task(1).id, revoked.id)
+        self.assertEqual(self.huey.pending_count(), 1)
+
+    def test_coalesce_expired(self):
+        @self.huey.task(coalesce=True, expires=timedelta(seconds=10))
+        def coalesced_task(obj_id):
+            pass
+
+        expired = coalesced_task(1)
+        self.huey.execute(self.huey.dequeue(), self.huey._get_timestamp() + timedelta(seconds=20))
+        self.assertNotEqual(coalesced_task(1).id, expired.id)
+        self.assertEqual(self.huey.pending_count(), 1)
+
+    def test_rate_limit(self):
+        @self.huey.task(rate_limit='2/m')
+        def limited_task(i):
+            return i
+
+        rate_limited = MagicMock()
+        self.huey.signal('rate_limited')(rate_limited)
+        for i in range(3):
+            limited_task(i)
+        now = self.huey._get_timestamp()
+        values = [self.huey.execute(self.huey.dequeue(), now) for _ in range(3)]
+        self.assertEqual(values, [0, 1, None])
+        rate_limited.assert_called_once()
+        deferred = rate_limited.call_args[0][1]
+        self.assertAlmostEqual((deferred.eta - now).total_seconds(), 30, delta=1)
+        self.assertEqual(self.huey.scheduled_count(), 1)
+
+        # The deferred task redeems its reserved token, other tasks wait for the next one.
+        self.assertEqual(self.huey.execute(deferred, deferred.eta), 2)
+        task = limited_task.s(3)
+        self.assertIsNone(self.huey.execute(task, now))
+        self.assertAlmostEqual((task.eta - now).total_seconds(), 60, delta=1)
+
+
+class EnqueueTest(RedisHueyTestCase):
+
+    def test_enqueue_many(self):
+        @self.huey.task()
+        def bulk_task(i):
+            pass
+
+        enqueued_many = MagicMock()
+        self.huey.signal('enqueued_many')(enqueued_many)
+
+        results = bulk_task.map(range(5), chunk_size=2)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.conn.pipeline.call_count, 3)
+        pipe = self.conn.pipeline.return_value
+        self.assertEqual(pipe.execute.call_count, 3)
+        self.assertEqual([len(call[0]) - 1 for call in pipe.lpush.call_args_list], [2, 2, 1])
+        self.assertEqual([call[0][2] for call in enqueued_many.call_args_list], [2, 2, 1])
+        self.conn.lpush.assert_not_called()
+
+    def test_enqueue_many_priority(self):
+        self.huey = PriorityRedisHuey()
+        self.conn = self.huey.storage.conn = MagicMock()
+
+        @self.huey.task(priority=5)
+        def bulk_task(i):
+            pass
+
+        bulk_task.map(range(3))
+        pipe = self.conn.pipeline.return_value
+        self.assertEqual(pipe.zadd.call_count, 3)
+        pipe.execute.assert_called_once()
+        self.conn.zadd.assert_not_called()
+
+    def test_coalesce(self):
+        self.huey.storage.enqueue = MagicMock()
+
+        @self.huey.task(coalesce=True)
+        def coalesced_task(obj_id):
+            pass
+
+        coalesced = MagicMock()
+        self.huey.signal('coalesced')(coalesced)
+        pipe = self.conn.pipeline.return_value
+        pipe.execute.return_value = [None]
+        first = coalesced_task(1)
+        pipe.execute.return_value = [first.id.encode()]
+        second = coalesced_task(1)
+
+        self.assertEqual(second.id, first.id)
+        self.huey.storage.enqueue.assert_called_once()
+        coalesced.assert_called_once()
+        script = self.conn.register_script.return_value
+        self.assertEqual(script.call_args_list[0][1]['keys'], script.call_args_list[1][1]['keys'])
+        key = self.huey.get_unique_key
+        self.assertNotEqual(key(coalesced_task.s(1)), key(coalesced_task.s(2)))
+
+    def test_unique_key_delay(self):
+        @self.huey.task(unique_key=lambda obj_id, value: obj_id, coalesce_delay=5)
+        def debounced_task(obj_id, value):
+            pass
+
+        self.conn.pipeline.return_value.execute.return_value = [None, b'pending-id', None]
+        results = debounced_task.map([(1, 1), (1, 2), (2, 1)])
+        self.assertEqual(results._results[1].id, 'pending-id')
+        key = self.huey.get_unique_key
+        self.assertEqual(key(debounced_task.s(1, 2)), key(debounced_task.s(1, 3)))
+        lpush = self.conn.pipeline.return_value.lpush
+        tasks = [self.huey.deserialize_task(message) for message in lpush.call_args[0][1:]]
+        self.assertEqual([task.args for task in tasks], [(1, 1), (2, 1)])
+        self.assertTrue(all(task.eta is not None for task in tasks))
+
+    def test_release_unique_key(self):
+        self.huey.is_revoked = MagicMock(return_value=False)
+        self.huey.get = MagicMock()
+
+        @self.huey.task(coalesce=True)
+        def coalesced_task(obj_id):
+            pass
+
+        task = coalesced_task.s(1)
+        self.huey.execute(task)
+        self.conn.register_script.return_value.assert_called_once_with(
+            keys=[self.huey.get_unique_key(task)], args=[task.id])
+
+
+class RateLimitTest(RedisHueyTestCase):
+
+    def test_rate_limit(self):
+        self.huey.storage.add_to_schedule = MagicMock()
+        self.huey.is_revoked = MagicMock(return_value=False)
+        self.huey.get = MagicMock()
+        rate_limited = MagicMock()
+        self.huey.signal('rate_limited')(rate_limited)
+
+        @self.huey.task(rate_limit='10/m')
+        def limited_task():
+            return 1
+
+        script = self.conn.register_script.return_value
+        script.return_value = 0
+        self.assertEqual(self.huey.execute(limited_task.s()), 1)
+        keys, args = script.call_args[1]['keys'], script.call_args[1]['args']
+        self.assertEqual(keys, [self.huey.get_rate_limit_key(limited_task.s())])
+        self.assertEqual(args[:2], [10, 10 / 60])
+
+        script.return_value = 1500
+        task = limited_task.s()
+        now = self.huey._get_timestamp()
+        self.assertIsNone(self.huey.execute(task, now))
+        self.assertEqual(task.eta, now + timedelta(milliseconds=1500))
+        self.huey.storage.add_to_schedule.assert_called_once()
+        rate_limited.assert_called_once()
+        self.conn.register_script.assert_called_once()
+
+    def test_revoked_without_token(self):
+        self.huey.get = MagicMock()
+        self.huey.storage.add_to_schedule = MagicMock()
+        script = self.conn.register_script.return_value
+
+        @self.huey.task(rate_limit='10/m', expires=timedelta(seconds=10))
+        def limited_task():
+            return 1
+
+        self.huey.is_revoked = MagicMock(return_value=True)
+        self.assertIsNone(self.huey.execute(limited_task.s()))
+        self.huey.is_revoked = MagicMock(return_value=False)
+        expired = limited_task.s()
+        expired.resolve_expires(self.huey.utc)
+        self.assertIsNone(self.huey.execute(expired, self.huey._get_timestamp() + timedelta(seconds=20)))
+        script.assert_not_called()
+        self.huey.storage.add_to_schedule.assert_not_called()
+
+    def test_parse_rate_limit(self):
+        self.assertEqual(parse_rate_limit('100/s'), (100, 100))
+        self.assertEqual(parse_rate_limit('30/10m'), (30, 0.05))
+        with self.assertRaises(AssertionError):
+            self.huey.task(rate_limit='100 per second')(lambda: None)
+
+
+class AsyncTest(RedisHueyTestCase):
+
+    def test_aenqueue(self):
+        @self.huey.task()
+        def async_task(a):
+            pass
+
+        enqueued = MagicMock()
+        self.huey.signal('enqueued')(enqueued)
+
+        async def enqueue():
+            async_conn = MagicMock()
+            async_conn.pipeline.return_value.execute = AsyncMock()
+            self.huey._async_clients[asyncio.get_running_loop()] = async_conn
+            result = await async_task.aenqueue(1)
+            return async_conn.pipeline.return_value, result
+
+        pipe, result = asyncio.run(enqueue())
+        pipe.lpush.assert_called_once()
+        self.assertEqual(pipe.lpush.call_args[0][0], self.huey.storage.queue_key)
+        pipe.execute.assert_awaited_once()
+        enqueued.assert_called_once()
+        self.assertEqual(result.id, enqueued.call_args[0][1].id)
+
+    def test_aenqueue_coalesced(self):
+        @self.huey.task(coalesce=True)
+        def coalesced_task(a):
+            pass
+
+        signals = []
+        self.huey.signal()(lambda signal, task, *args: signals.append(signal))
+
+        async def enqueue():
+            async_conn = MagicMock()
+            async_conn.eval = AsyncMock(return_value=b'pending-id')
+            self.huey._async_clients[asyncio.get_running_loop()] = async_conn
+            return await coalesced_task.aenqueue(1)
+
+        self.assertEqual(asyncio.run(enqueue()).id, 'pending-id')
+        self.assertEqual(signals, ['coalesced'])
+
+    def test_aenqueue_batch_call(self):
+        @self.huey.db_batch_task(batch_size=10, max_wait=5)
+        def batch_task(items):
+            pass
+
+        async def enqueue():
+            async_conn = MagicMock()
+            async_conn.rpush = AsyncMock(return_value=1)
+            async_conn.pipeline.return_value.execute = AsyncMock()
+            self.huey._async_clients[asyncio.get_running_loop()] = async_conn
+            await batch_task.aenqueue(1)
+            return async_conn
+
+        async_conn = asyncio.run(enqueue())
+        self.assertEqual(async_conn.rpush.call_args[0][0], self.huey.batch_key(batch_task.task_class))
+        flush = self.huey.deserialize_task(async_conn.pipeline.return_value.lpush.call_args[0][1])
+        self.assertIsInstance(flush, batch_task.task_class.flush_task_class)
+        self.assertIsNotNone(flush.eta)
+
+    def test_aresult(self):
+        async def result(peek, response):
+            async_conn = MagicMock()
+            async_conn.pipeline.return_value.execute = AsyncMock(return_value=response)
+            self.huey._async_clients[asyncio.get_running_loop()] = async_conn
+            return await self.huey.aresult('task-1', preserve=peek), async_conn.pipeline.return_value
+
+        value, pipe = asyncio.run(result(False, [True, self.huey.serializer.serialize(3), 1]))
+        self.assertEqual(value, 3)
+        pipe.hdel.assert_called_once_with(self.huey.storage.result_key, 'task-1')
+        value, pipe = asyncio.run(result(True, [False, None]))
+        self.assertIsNone(value)
+        pipe.hdel.assert_not_called()
+
+    def test_aexecute(self):
+        self.huey = RedisHuey(immediate=True)
+
+        @self.huey.task()
+        async def async_task(a):
+            await asyncio.sleep(0)
+            return a * 2
+
+        @self.huey.task()
+        async def failing_task():
+            raise ValueError()
+
+        signals = []
+        self.huey.signal()(lambda signal, task, *args: signals.append(signal))
+
+        self.assertTrue(async_task.task_class.is_async)
+        self.assertEqual(asyncio.run(self.huey.aexecute(async_task.s(2))), 4)
+        self.assertEqual(signals, ['executing', 'complete'])
+
+        task = failing_task.s()
+        asyncio.run(self.huey.aexecute(task))
+        self.assertEqual(signals[-1], 'error')
+        with self.assertRaises(TaskException) as context:
+            self.huey.result(task.id)
+        self.assertIn('raise ValueError()', context.exception.metadata['traceback'])
+
+    def test_execute_async_task(self):
+        @self.huey.task()
+        async def async_task(a):
+            await asyncio.sleep(0)
+            return a * 2
+
+        self.huey.is_revoked = MagicMock(return_value=False)
+        self.huey.get = MagicMock()
+        self.huey.storage.put_data = MagicMock()
+        self.assertEqual(self.huey.execute(async_task.s(2)), 4)
+        self.assertEqual(self.huey.serializer.deserialize(self.huey.storage.put_data.call_args[0][1]), 4)
+
+
+class BatchTaskTest(RedisHueyTestCase):
+
+    def test_db_batch_task_enqueue(self):
+        @self.huey.db_batch_task(batch_size=2, max_wait=5)
+        def batch_task(items):
+            pass
+
+        self.huey.storage.enqueue = MagicMock()
+        key = self.huey.batch_key(batch_task.task_class)
+        for length in (1, 2, 3):
+            self.conn.rpush.return_value = length
+            batch_task(length)
+            self.assertEqual(self.conn.rpush.call_args[0][0], key)
+        flushes = [self.huey.deserialize_task(call[0][0]) for call in self.huey.storage.enqueue.call_args_list]
+        self.assertEqual(len(flushes), 2)
+        self.assertTrue(all(isinstance(flush, batch_task.task_class.flush_task_class) for flush in flushes))
+        self.assertIsNotNone(flushes[0].eta)
+        self.assertIsNone(flushes[1].eta)
+
+    def test_execute_batch(self):
+        self.huey.is_revoked = MagicMock(return_value=False)
+        storage = self.huey._pipelined_storage = MagicMock()
+
+        @self.huey.db_batch_task(batch_size=10)
+        def batch_task(items):
+            return [ValueError() if a < 0 else a * 2 for a, in items]
+
+        tasks = [batch_task.s(a) for a in (1, -1, 3)]
+        self.conn.pipeline.return_value.execute.return_value = [
+            [self.huey.serialize_task(task) for task in tasks], True, 0]
+        signals = []
+        self.huey.signal()(lambda signal, task, *args: signals.append((signal, task.id)))
+
+        flush = batch_task.task_class.flush_task_class()
+        flush.execute()
+        put_calls = storage.return_value.put_data.call_args_list
+        self.assertEqual([call[0][0] for call in put_calls], [task.id for task in tasks])
+        results = [self.huey.serializer.deserialize(call[0][1]) for call in put_calls]
+        self.assertEqual(results[0], 2)
+        self.assertEqual(results[1].metadata['error'], 'ValueError()')
+        self.assertEqual(results[2], 6)
+        self.assertIn(('error', tasks[1].id), signals)
+        self.assertIn(('complete', tasks[2].id), signals)
+
+    def test_db_batch_task_schedule(self):
+        @self.huey.db_batch_task(batch_size=2)
+        def batch_task(items):
+            pass
+
+        self.huey.storage.add_to_schedule = MagicMock()
+        batch_task.schedule(args=(1,), delay=3600)
+        self.conn.rpush.assert_not_called()
+        self.huey.storage.add_to_schedule.assert_called_once()
+
+        batch_task.map([(2,)])
+        self.conn.pipeline.return_value.rpush.assert_called_once()
+
+    def test_execute_batch_error(self):
+        self.huey.is_revoked = MagicMock(return_value=False)
+        self.huey.storage.add_to_schedule = MagicMock()
+        storage = self.huey._pipelined_storage = MagicMock()
+
+        @self.huey.db_batch_task(batch_size=10, retries=1, retry_delay=60)
+        def batch_task(items):
+            raise ValueError()
+
+        task = batch_task.s(1)
+        self.conn.pipeline.return_value.execute.return_value = [[self.huey.serialize_task(task)], True, 0]
+        batch_task.task_class.flush_task_class().execute()
+        error = self.huey.serializer.deserialize(storage.return_value.put_data.call_args[0][1])
+        self.assertIn('raise ValueError()', error.metadata['traceback'])
+        retried = self.huey.deserialize_task(self.huey.storage.add_to_schedule.call_args[0][0])
+        self.assertEqual((retried.id, retried.retries), (task.id, 0))
+        self.assertIsNotNone(retried.eta)
+
+    def test_db_batch_task_keyword_arguments(self):
+        @self.huey.db_batch_task(batch_size=2)
+        def batch_task(items):
+            pass
+
+        with self.assertRaises(TypeError):
+            batch_task(1, kind='login')
+        with self.assertRaises(TypeError):
+            self.huey.enqueue_many([batch_task.s(2), batch_task.s(1, kind='login')])
+        self.conn.rpush.assert_not_called()
+        self.conn.pipeline.return_value.rpush.assert_not_called()
+
+    def test_db_batch_task_immediate(self):
+        self.huey = RedisHuey(immediate=True)
+
+        @self.huey.db_batch_task()
+        def batch_task(items):
+            return [a + b for a, b in items]
+
+        self.assertEqual(batch_task(1, 2)(), 3)
+
+
+class ResultOptionsTest(RedisHueyTestCase):
+
+    def test_result_options(self):
+        @self.huey.task(store_result=False)
+        def no_result():
+            return 1
+
+        @self.huey.task(result_ttl=60, result_codec='zlib')
+        def ttl_result():
+            return 'x' * 1000
+
+        @self.huey.task(result_max_size=10)
+        def capped_result():
+            return 'x' * 1000
+
+        self.huey.is_revoked = MagicMock(return_value=False)
+        self.conn.pipeline.return_value.execute.return_value = [False, None, None, 0, 0]
+        self.huey.storage.put_data = MagicMock()
+        for task in (no_result.s(), ttl_result.s(), capped_result.s()):
+            self.huey.execute(task)
+        self.huey.storage.put_data.assert_called_once()
+        key, data = self.huey.storage.put_data.call_args[0]
+        self.assertIn('ResultTooLargeError', self.huey.serializer.deserialize(data).metadata['error'])
+
+        key, ttl, data = self.conn.setex.call_args[0]
+        self.assertEqual(ttl, 60)
+        self.assertLess(len(data), 100)
+        self.assertEqual(self.huey.serializer.deserialize(data), 'x' * 1000)
+
+    def test_store_result_keeps_errors(self):
+        @self.huey.task(store_result=False)
+        def failing_task():
+            raise ValueError()
+
+        self.huey.is_revoked = MagicMock(return_value=False)
+        self.huey.get = MagicMock()
+        self.huey.storage.put_data = MagicMock()
+        self.huey.execute(failing_task.s())
+        key, data = self.huey.storage.put_data.call_args[0]
+        self.assertEqual(self.huey.serializer.deserialize(data).metadata['error'], 'ValueError()')
+
+    def test_get_ttl_result(self):
+        self.conn.pipeline.return_value.execute.return_value = [False, None, b'ttl-result', 0, 1]
+        self.assertEqual(self.huey.get_raw('task-id'), b'ttl-result')
+        pipe = self.conn.pipeline.return_value
+        pipe.get.assert_called_once_with(self.huey.ttl_result_key('task-id'))
+        pipe.delete.assert_called_once_with(self.huey.ttl_result_key('task-id'))
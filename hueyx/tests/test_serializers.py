@@ -0,0 +1,31 @@
+from django.test import TestCase
+from huey.serializer import Serializer
+from huey.utils import Error
+
+from hueyx.serializers import ResultSerializer
+
+
+class ResultSerializerTest(TestCase):
+
+    def setUp(self):
+        self.serializer = ResultSerializer(Serializer())
+
+    def test_pickle(self):
+        data = self.serializer.serialize({'a': 1})
+        self.assertEqual(data, Serializer().serialize({'a': 1}))
+        self.assertEqual(self.serializer.deserialize(data), {'a': 1})
+
+    def test_zlib(self):
+        value = ['x' * 100] * 100
+        data = self.serializer.serialize(value, 'zlib')
+        self.assertLess(len(data), len(self.serializer.serialize(value)))
+        self.assertEqual(self.serializer.deserialize(data), value)
+
+    def test_compressed_huey_serializer(self):
+        serializer = ResultSerializer(Serializer(compression=True))
+        self.assertEqual(serializer.deserialize(serializer.serialize(Error({'error': 'e'}))).metadata, {'error': 'e'})
+        self.assertEqual(serializer.deserialize(serializer.serialize(1, 'zlib')), 1)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(AssertionError):
+            self.serializer.serialize(1, 'json')
@@ -1,7 +1,7 @@
 from django.test import TestCase
 from redis import ConnectionPool
 from huey.storage import RedisExpireStorage
-from hueyx.settings_reader import SingleConfigReader, HueyxException
+from hueyx.settings_reader import SingleConfigReader, HueyxException, ConnectionPools
 
 
 class SingleConfigReaderTest(TestCase):
@@ -136,3 +136,19 @@ class SingleConfigReaderTest(TestCase):
         self.assertFalse(self.assertFalse(isinstance(huey.storage_class, RedisExpireStorage)))
         self.assertEqual(huey.storage.pool.connection_kwargs['db'], 99)
         self.assertEqual(huey.name, 'queue1')
+
+
+class ConnectionPoolsTest(TestCase):
+    def test_shared_pool(self):
+        pools = ConnectionPools()
+        connection = {'host': 'localhost', 'port': 6379, 'db': 99}
+        reader1 = SingleConfigReader('queue1', {'connection': connection}, pools)
+        reader2 = SingleConfigReader('queue2', {'connection': dict(connection)}, pools)
+        reader3 = SingleConfigReader('queue3', {'connection': dict(connection, db=98)}, pools)
+
+        self.assertIs(reader1.connection_pool, reader2.connection_pool)
+        self.assertIsNot(reader1.connection_pool, reader3.connection_pool)
+        stats = pools.stats()
+        self.assertEqual([pool['queues'] for pool in stats], [['queue1', 'queue2'], ['queue3']])
+        self.assertEqual(stats[0]['db'], 99)
+        self.assertEqual(stats[0]['created_connections'], 0)
@@ -0,0 +1,182 @@
+import time
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase
+from huey.api import Task
+
+from redis import ResponseError
+
+from hueyx.signals import SignalPublisher, SignalMetrics, SignalStreamPublisher, SignalStreamReader, DROP_OLDEST, \
+    read_metrics
+
+
+class SignalPublisherTest(TestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.pipe = self.redis.pipeline.return_value
+
+    def published(self):
+        return [call[0][1] for call in self.pipe.publish.call_args_list]
+
+    def test_background_publishing(self):
+        publisher = SignalPublisher(self.redis, 'channel', batch_size=2, flush_interval=0.01)
+        for i in range(5):
+            publisher.publish({'signal': i})
+        for _ in range(100):
+            if len(self.published()) == 5:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.published(), [f'{{"signal": {i}}}' for i in range(5)])
+        self.assertGreaterEqual(self.pipe.execute.call_count, 3)
+        self.pipe.publish.assert_called_with('channel', '{"signal": 4}')
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_flush_in_batches(self, *args):
+        publisher = SignalPublisher(self.redis, 'channel', batch_size=2)
+        for i in range(5):
+            publisher.publish({'signal': i})
+        self.redis.pipeline.assert_not_called()
+        publisher.flush()
+        self.assertEqual(self.pipe.execute.call_count, 3)
+        self.assertEqual(len(self.published()), 5)
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_drop_newest(self, *args):
+        publisher = SignalPublisher(self.redis, 'channel', buffer_size=2)
+        for i in range(3):
+            publisher.publish({'signal': i})
+        publisher.flush()
+        self.assertEqual(self.published(), ['{"signal": 0}', '{"signal": 1}'])
+        self.assertEqual(publisher.dropped, 1)
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_drop_oldest(self, *args):
+        publisher = SignalPublisher(self.redis, 'channel', buffer_size=2, drop_policy=DROP_OLDEST)
+        for i in range(3):
+            publisher.publish({'signal': i})
+        publisher.flush()
+        self.assertEqual(self.published(), ['{"signal": 1}', '{"signal": 2}'])
+        self.assertEqual(publisher.dropped, 1)
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_redis_error(self, *args):
+        self.pipe.execute.side_effect = ConnectionError()
+        publisher = SignalPublisher(self.redis, 'channel')
+        publisher.publish({'signal': 0})
+        publisher.flush()
+        self.assertEqual(publisher.dropped, 1)
+
+
+class SignalStreamTest(TestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.pipe = self.redis.pipeline.return_value
+        self.signal = {'environment': 'env', 'queue': 'queue1', 'pid': 1, 'signal': 'complete', 'task': 'my_task'}
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_stream_publishing(self, *args):
+        publisher = SignalStreamPublisher(self.redis, 'stream', maxlen=1000)
+        publisher.publish(self.signal)
+        publisher.flush()
+        self.pipe.xadd.assert_called_once_with(
+            'stream', {'e': 'env', 'q': 'queue1', 'p': 1, 's': 'complete', 't': 'my_task'},
+            maxlen=1000, approximate=True)
+        self.pipe.publish.assert_not_called()
+
+    def test_read(self):
+        self.redis.xreadgroup.return_value = [
+            [b'stream', [(b'1-0', {b'e': b'env', b'q': b'queue1', b'p': b'1', b's': b'complete', b't': b'my_task'})]]
+        ]
+        reader = SignalStreamReader(self.redis, 'stream', 'group', 'consumer')
+        self.assertEqual(reader.read(count=10), [(b'1-0', self.signal)])
+        self.redis.xgroup_create.assert_called_once_with('stream', 'group', id='0', mkstream=True)
+        self.redis.xreadgroup.assert_called_once_with('group', 'consumer', {'stream': '>'}, count=10, block=1000)
+
+    def test_read_pending(self):
+        self.redis.xreadgroup.return_value = []
+        reader = SignalStreamReader(self.redis, 'stream', 'group', 'consumer')
+        self.assertEqual(reader.read(pending=True), [])
+        self.redis.xreadgroup.assert_called_once_with('group', 'consumer', {'stream': '0'}, count=100, block=None)
+
+    def test_existing_group(self):
+        self.redis.xgroup_create.side_effect = ResponseError('BUSYGROUP Consumer Group name already exists')
+        self.redis.xreadgroup.return_value = []
+        reader = SignalStreamReader(self.redis, 'stream', 'group', 'consumer')
+        reader.read()
+        reader.read()
+        self.redis.xgroup_create.assert_called_once()
+
+    def test_ack(self):
+        reader = SignalStreamReader(self.redis, 'stream', 'group', 'consumer')
+        reader.ack(b'1-0', b'2-0')
+        self.redis.xack.assert_called_once_with('stream', 'group', b'1-0', b'2-0')
+
+
+class SignalMetricsTest(TestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.pipe = self.redis.pipeline.return_value
+        self.task = Task()
+        self.task.name = 'my_task'
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_aggregation(self, *args):
+        metrics = SignalMetrics(self.redis, 'metrics', buckets=(1, 10))
+        metrics.record('enqueued', self.task)
+        metrics.record('executing', self.task)
+        metrics.record('complete', self.task)
+        metrics.record('enqueued', self.task)
+        metrics.flush()
+
+        increments = {call[0][1]: call[0][2] for call in self.pipe.hincrby.call_args_list}
+        self.assertEqual(increments, {
+            'count|my_task|enqueued': 2,
+            'count|my_task|executing': 1,
+            'count|my_task|complete': 1,
+            'duration_bucket|my_task|1.0': 1,
+            'duration_bucket|my_task|10.0': 1,
+            'duration_bucket|my_task|+Inf': 1,
+            'duration_count|my_task': 1,
+        })
+        self.assertEqual(self.pipe.hincrbyfloat.call_args[0][1], 'duration_sum|my_task')
+        self.pipe.execute.assert_called_once()
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_no_duration_on_error(self, *args):
+        metrics = SignalMetrics(self.redis, 'metrics')
+        metrics.record('executing', self.task)
+        metrics.record('error', self.task)
+        metrics.flush()
+        self.assertEqual(len(self.pipe.hincrby.call_args_list), 2)
+        self.assertEqual(metrics._started, {})
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_enqueued_many(self, *args):
+        metrics = SignalMetrics(self.redis, 'metrics')
+        metrics.record('enqueued', self.task)
+        metrics.record('enqueued_many', self.task, 100)
+        self.assertEqual(metrics._counts, {'count|my_task|enqueued': 101})
+
+    @patch('hueyx.signals.threading.Thread')
+    def test_keep_metrics_on_redis_error(self, *args):
+        self.pipe.execute.side_effect = ConnectionError()
+        metrics = SignalMetrics(self.redis, 'metrics')
+        metrics.record('enqueued', self.task)
+        metrics.flush()
+        self.assertEqual(metrics._counts, {'count|my_task|enqueued': 1})
+
+    def test_read_metrics(self):
+        self.redis.hgetall.return_value = {
+            b'count|my_task|complete': b'3',
+            b'duration_bucket|my_task|1.0': b'2',
+            b'duration_bucket|my_task|+Inf': b'3',
+            b'duration_sum|my_task': b'4.5',
+            b'duration_count|my_task': b'3',
+        }
+        self.assertEqual(read_metrics(self.redis, 'metrics'), {
+            'counts': {('my_task', 'complete'): 3},
+            'durations': {'my_task': {'buckets': {'1.0': 2, '+Inf': 3}, 'sum': 4.5, 'count': 3}},
+        })
@@ -0,0 +1,112 @@
+from unittest import skipUnless
+from unittest.mock import MagicMock
+
+from django.test import TestCase
+
+from hueyx.redis_huey import FairPriorityRedisHuey
+from hueyx.storage import FAIR_ENQUEUE_LUA
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401 (lua scripts of fakeredis)
+except ImportError:
+    fakeredis = None
+
+
+class FairPriorityRedisStorageTest(TestCase):
+
+    def setUp(self):
+        self.huey = FairPriorityRedisHuey('queue1', fair_weights={'tenant1': 3})
+        self.storage = self.huey.storage
+        self.conn = self.storage.conn = MagicMock()
+        self.storage._dequeue_script = MagicMock()
+
+    def test_fair_key(self):
+        @self.huey.task(fair_key_arg='tenant')
+        def kwarg_task(a, tenant=None):
+            pass
+
+        @self.huey.task(fair_key_arg=0)
+        def arg_task(tenant):
+            pass
+
+        @self.huey.task(fair_key=lambda a, b: f'{a}-{b}')
+        def callable_task(a, b):
+            pass
+
+        @self.huey.task(fair_key='constant')
+        def constant_task():
+            pass
+
+        @self.huey.db_task(fair_key_arg='tenant')
+        def named_task(a, tenant, *, b=None):
+            pass
+
+        self.assertEqual(self.huey.get_fair_key(kwarg_task.s(1, tenant='t1')), 't1')
+        self.assertEqual(self.huey.get_fair_key(kwarg_task.s(1, 't1')), 't1')
+        self.assertEqual(self.huey.get_fair_key(named_task.s(1, 't2')), 't2')
+        self.assertEqual(self.huey.get_fair_key(kwarg_task.s(1)), 'default')
+        self.assertEqual(self.huey.get_fair_key(arg_task.s(5)), '5')
+        self.assertEqual(self.huey.get_fair_key(callable_task.s(1, 2)), '1-2')
+        self.assertEqual(self.huey.get_fair_key(constant_task.s()), 'constant')
+
+    def test_enqueue(self):
+        @self.huey.task(fair_key_arg='tenant', priority=5)
+        def fair_task(tenant):
+            pass
+
+        fair_task(tenant='t1')
+        script, numkeys, sub_queue, ring, fair_key, score, message = self.conn.eval.call_args[0]
+        self.assertEqual((script, numkeys), (FAIR_ENQUEUE_LUA, 2))
+        self.assertEqual((sub_queue, ring, fair_key, score), (self.storage.sub_queue_key('t1'), self.storage.ring_key,
+                                                              't1', -5))
+        self.assertEqual(self.huey.deserialize_task(message[8:]).kwargs, {'tenant': 't1'})
+
+    def test_enqueue_many(self):
+        @self.huey.task(fair_key_arg=0)
+        def fair_task(tenant):
+            pass
+
+        fair_task.map(['t1', 't2'])
+        pipe = self.conn.pipeline.return_value
+        self.assertEqual([call[0][4] for call in pipe.eval.call_args_list], ['t1', 't2'])
+        self.conn.eval.assert_not_called()
+
+    def test_dequeue(self):
+        self.storage._dequeue_script.return_value = b'12345678message'
+        self.assertEqual(self.storage.dequeue(), b'message')
+        kwargs = self.storage._dequeue_script.call_args[1]
+        self.assertEqual(kwargs['keys'], [self.storage.ring_key, self.storage.turns_key, self.storage.weights_key])
+        self.assertEqual(kwargs['args'], [self.storage.sub_queue_key(''), '{"tenant1": 3}'])
+
+        self.storage._dequeue_script.return_value = None
+        self.assertIsNone(self.storage.dequeue())
+        self.assertFalse(self.storage.blocking)
+
+    def test_queue_size(self):
+        self.conn.lrange.return_value = [b't1', b't2']
+        self.conn.pipeline.return_value.execute.return_value = [3, 4]
+        self.assertEqual(self.storage.fair_queue_sizes(), {'t1': 3, 't2': 4})
+        self.assertEqual(self.huey.pending_count(), 7)
+
+
+@skipUnless(fakeredis, 'requires fakeredis[lua]')
+class FairRedisQueueLuaTest(TestCase):
+
+    def setUp(self):
+        redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.huey = FairPriorityRedisHuey('queue1', fair_weights={'t1': 3}, connection_pool=redis.connection_pool)
+
+    def test_round_robin(self):
+        @self.huey.task(fair_key_arg='tenant')
+        def fair_task(i, tenant):
+            pass
+
+        fair_task.map([(i, 't1') for i in range(4)] + [(i, 't2') for i in range(2)])
+        fair_task(9, 't2', priority=5)
+        self.assertEqual(self.huey.storage.fair_queue_sizes(), {'t1': 4, 't2': 3})
+        tasks = [self.huey.dequeue() for _ in range(7)]
+        self.assertEqual([(task.args[1], task.args[0]) for task in tasks],
+                         [('t1', 0), ('t1', 1), ('t1', 2), ('t2', 9), ('t1', 3), ('t2', 0), ('t2', 1)])
+        self.assertIsNone(self.huey.dequeue())
+        self.assertEqual(self.huey.storage.fair_keys(), [])
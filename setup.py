@@ -41,7 +41,6 @@ setup(
     install_requires=[
         'cached-property',
         'huey>=2.3.0',
-        'redis',
-        'python-redis-lock',
+        'redis>=4.2',
     ],
 )